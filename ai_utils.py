@@ -1,49 +1,101 @@
-from google import genai
-from google.genai import types
 import os
+import math
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
 from dotenv import load_dotenv
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-import google.api_core.exceptions
+from cache_utils import ResponseCache
+from scheduler_utils import RateLimitScheduler
+from telemetry_utils import span
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-class AIEngine:
-    def __init__(self):
-        # Using 'gemini-flash-latest' alias which appeared in the user's available model list
-        self.model_id = "gemini-flash-latest" 
-        
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            logger.warning("GEMINI_API_KEY not found in environment variables.")
-        
-        self.client = genai.Client(api_key=api_key)
+def _genai():
+    """google-genai, imported on first use (it takes a while and the login page doesn't need it)."""
+    from google import genai
+    from google.genai import types
+    return genai, types
 
-    @retry(
-        retry=retry_if_exception_type(google.api_core.exceptions.ResourceExhausted),
-        stop=stop_after_attempt(7),
-        wait=wait_exponential(multiplier=2, min=5, max=60)
-    )
-    def _generate_content_with_retry(self, prompt, context):
-        return self.client.models.generate_content(
-            model=self.model_id,
-            contents=[prompt, context],
-            config=types.GenerateContentConfig(
-                temperature=0.1, 
-            )
-        )
+DEFAULT_CHUNK_TOKENS = 30_000
+DEFAULT_MAP_CONCURRENCY = 4
 
-    def analyze_log(self, log_data: str, user_query: str = "") -> str:
-        """
-        Sends audit trail logs to Gemini for GMP Data Integrity compliance analysis.
-        Focuses on ALCOA+ principles and 21 CFR Part 11 requirements.
-        """
-        if not os.getenv("GEMINI_API_KEY"):
-            return "Error: API Key is missing."
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English/log text)."""
+    return math.ceil(len(text) / 4)
+
+def _chunk_frame(df: pd.DataFrame, chunk_tokens: int, start: int = 0):
+    """
+    Table chunks in the compact encoding of the single-pass context (context_utils.pack_context),
+    each packed up to chunk_tokens. start is the position of df's first row in the whole log.
+    """
+    from context_utils import pack_context # context_utils imports this module
+    if df.empty:
+        return
+    # Pack a window a little larger than the rows a sample says fit; widen it if it all fits
+    sample = pack_context(df.head(200), token_budget=chunk_tokens)
+    window = max(2 * int(chunk_tokens * sample.rows / max(sample.tokens, 1)), 1)
+    offset = 0
+    while offset < len(df):
+        rows = df.iloc[offset:offset + window]
+        packed = pack_context(rows, token_budget=chunk_tokens)
+        if not packed.truncated and offset + window < len(df):
+            window *= 2
+            continue
+        if not packed.rows: # one row larger than the budget: send it on its own
+            packed = pack_context(rows.iloc[:1], token_budget=chunk_tokens + 2 * estimate_tokens(rows.iloc[:1].to_csv()))
+        first, last = start + offset + 1, start + offset + packed.rows
+        preamble, text = packed.text.split("\n", 1)
+        yield f"# Masked audit log (CSV): rows {first}-{last}{preamble[preamble.index(','):]}\n{text}"
+        offset += packed.rows
+
+def chunk_log(log_data, chunk_tokens: int = DEFAULT_CHUNK_TOKENS):
+    """
+    Lazily splits a log into pieces of about chunk_tokens tokens.
+    Accepts text, a DataFrame, or an iterable of DataFrame chunks / text lines
+    (e.g. pd.read_csv(..., chunksize=...) or an open file).
+    Table chunks use the compact context encoding (CSV header, dictionary legend,
+    collapsed repeats) so each one stands alone.
+    """
+    if isinstance(log_data, pd.DataFrame):
+        yield from _chunk_frame(log_data, chunk_tokens)
+        return
+    if isinstance(log_data, str):
+        log_data = log_data.splitlines(keepends=True)
+
+    lines, size, table_rows = [], 0, 0
+    for item in log_data:
+        if isinstance(item, pd.DataFrame):
+            yield from _chunk_frame(item, chunk_tokens, start=table_rows)
+            table_rows += len(item)
+            continue
+        cost = estimate_tokens(item)
+        if lines and size + cost > chunk_tokens:
+            yield "".join(lines)
+            lines, size = [], 0
+        lines.append(item)
+        size += cost
+    if lines:
+        yield "".join(lines)
+
+def _build_response_cache():
+    """Process-wide response cache; disabled with AI_RESPONSE_CACHE=0 or if the cache dir isn't writable."""
+    if os.getenv("AI_RESPONSE_CACHE", "1") == "0":
+        return None
+    try:
+        ttl_hours = float(os.getenv("AI_CACHE_TTL_HOURS", "168"))
+        return ResponseCache(ttl=ttl_hours * 3600)
+    except Exception as e:
+        logger.warning(f"Response cache disabled: {e}")
+        return None
+
+class AIEngine:
+    _response_cache = None
+    _response_cache_ready = False
 
-        # GMP/DI 특화 프롬프트
-        system_instruction = """
+    # GMP/DI 특화 프롬프트
+    SYSTEM_INSTRUCTION = """
         ### ROLE
         You are a **Lead Data Integrity (DI) Auditor** in a pharmaceutical company. 
         Your responsibility is to review the Audit Trail logs of a GMP Computerized System to ensure compliance with **21 CFR Part 11**, **EudraLex Annex 11**, and **ALCOA+ principles**.
@@ -83,16 +135,304 @@ class AIEngine:
         #### 3. Auditor Recommendations
         - Immediate actions required (e.g., "Initiate Deviation Report", "Lock user account <USER_A>").
         """
-             
+
+    def __init__(self, user_id: str = "default"):
+        # Using 'gemini-flash-latest' alias which appeared in the user's available model list
+        self.model_id = "gemini-flash-latest" 
+        self.temperature = 0.1
+        self.last_cache_hit = False
+        self.last_stream = None
+        # Fair-queuing key in the shared scheduler
+        self.user_id = user_id
+        
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            logger.warning("GEMINI_API_KEY not found in environment variables.")
+        
+        # Retries are owned by the scheduler (GEMINI_BASE_URL points at a local fake server for load tests)
+        genai, types = _genai()
+        http_options = types.HttpOptions(
+            base_url=os.getenv("GEMINI_BASE_URL") or None,
+            retry_options=types.HttpRetryOptions(attempts=1),
+        )
+        self.client = genai.Client(api_key=api_key, http_options=http_options)
+        self.scheduler = RateLimitScheduler.get()
+
+        # Shared by every engine in the process so hit/miss counters survive reruns
+        if not AIEngine._response_cache_ready:
+            AIEngine._response_cache = _build_response_cache()
+            AIEngine._response_cache_ready = True
+        self.cache = AIEngine._response_cache
+
+    def _request(self, prompt, context, attempts: list = None):
+        """
+        Builds the async call for one generate request (run on the scheduler loop).
+        attempts, if given, gets one entry per try (the scheduler re-invokes the call on retry).
+        """
+        _, types = _genai()
+
+        def call():
+            if attempts is not None:
+                attempts.append(1)
+            return self.client.aio.models.generate_content(
+                model=self.model_id,
+                contents=[prompt, context],
+                config=types.GenerateContentConfig(
+                    temperature=self.temperature, 
+                )
+            )
+        return call
+
+    def submit_generate(self, prompt, context, attempts: list = None):
+        """Queues a request on the shared rate-limited scheduler; returns a concurrent Future."""
+        tokens = estimate_tokens(prompt) + estimate_tokens(context)
+        return self.scheduler.submit(self._request(prompt, context, attempts), user=self.user_id, tokens=tokens)
+
+    async def agenerate(self, prompt, context):
+        """Awaitable generate request for async callers."""
+        tokens = estimate_tokens(prompt) + estimate_tokens(context)
+        return await self.scheduler.run(self._request(prompt, context), user=self.user_id, tokens=tokens)
+
+    def stream_generate(self, prompt, context, cancel_event=None):
+        """
+        Yields response text chunks as they arrive, through the same scheduler.
+        Setting cancel_event (or closing the generator) stops the request. Timings of the
+        latest stream (ttft, seconds, chunks, chars, cancelled) are kept in last_stream.
+        """
+        tokens = estimate_tokens(prompt) + estimate_tokens(context)
+        start = time.perf_counter()
+        _, types = _genai()
+        open_stream = lambda: self.client.aio.models.generate_content_stream(
+            model=self.model_id,
+            contents=[prompt, context],
+            config=types.GenerateContentConfig(temperature=self.temperature),
+        )
+        stats = self.last_stream = {"ttft": None, "seconds": None, "chunks": 0, "chars": 0, "cancelled": True}
+        with span("llm.stream", model=self.model_id, user=self.user_id, prompt_tokens=tokens) as sp:
+            try:
+                for chunk in self.scheduler.stream(open_stream, user=self.user_id, tokens=tokens, cancel_event=cancel_event):
+                    if chunk.text:
+                        if not stats["chunks"]:
+                            stats["ttft"] = time.perf_counter() - start
+                        stats["chunks"] += 1
+                        stats["chars"] += len(chunk.text)
+                        yield chunk.text
+                stats["cancelled"] = cancel_event is not None and cancel_event.is_set()
+            finally:
+                stats["seconds"] = time.perf_counter() - start
+                sp.set(ttft=stats["ttft"], chunks=stats["chunks"], output_chars=stats["chars"], cancelled=stats["cancelled"])
+
+    def _generate_content_with_retry(self, prompt, context):
+        # Blocks only this caller; backoff happens on the scheduler loop (Retry-After aware)
+        with span("llm.generate", model=self.model_id, user=self.user_id,
+                  bytes=len(prompt) + len(context)) as sp:
+            attempts = []
+            response = self.submit_generate(prompt, context, attempts).result()
+            usage = getattr(response, "usage_metadata", None)
+            sp.set(retries=max(len(attempts) - 1, 0),
+                   prompt_tokens=getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt) + estimate_tokens(context),
+                   output_tokens=getattr(usage, "candidates_token_count", None) or 0)
+            return response
+
+    def _generate(self, prompt: str, context: str, use_cache: bool = True, refresh: bool = False) -> str:
+        """
+        Returns the response text, served from the response cache when the same request
+        was answered before. refresh=True skips the lookup but stores the new answer.
+        """
+        self.last_cache_hit = False
+        cache = self.cache if use_cache else None
+        key = None
+        if cache is not None:
+            key = ResponseCache.key(self.model_id, self.temperature, prompt, context)
+            if not refresh:
+                cached = cache.get(key)
+                if cached is not None:
+                    self.last_cache_hit = True
+                    return cached
+
+        text = self._generate_content_with_retry(prompt, context).text
+        if cache is not None and text:
+            cache.put(key, text)
+        return text
+
+    def _analysis_prompt(self, user_query: str) -> str:
         if user_query:
-            prompt = f"{system_instruction}\n\nUSER QUESTION: {user_query}\n\nPlease answer the user's question based on the provided logs."
-        else:
-            prompt = f"{system_instruction}\n\nPerform a comprehensive security audit summary."
+            return f"{self.SYSTEM_INSTRUCTION}\n\nUSER QUESTION: {user_query}\n\nPlease answer the user's question based on the provided logs."
+        return f"{self.SYSTEM_INSTRUCTION}\n\nPerform a comprehensive security audit summary."
 
+    def analyze_log(self, log_data: str, user_query: str = "", use_cache: bool = True, refresh: bool = False) -> str:
+        """
+        Sends audit trail logs to Gemini for GMP Data Integrity compliance analysis.
+        Focuses on ALCOA+ principles and 21 CFR Part 11 requirements.
+        Identical requests are served from the response cache unless refresh=True.
+        """
+        if not os.getenv("GEMINI_API_KEY"):
+            return "Error: API Key is missing."
+
+        prompt = self._analysis_prompt(user_query)
         try:
             # Using the internal method with retry logic
-            response = self._generate_content_with_retry(prompt, log_data)
-            return response.text
+            return self._generate(prompt, log_data, use_cache=use_cache, refresh=refresh)
         except Exception as e:
             logger.error(f"AI Analysis failed: {e}")
             return f"Error during AI analysis (after retries): {str(e)}"
+
+    def analyze_log_stream(self, log_data: str, user_query: str = "", cancel_event=None,
+                           use_cache: bool = True, refresh: bool = False):
+        """
+        Streaming form of analyze_log: yields the report text as it is generated.
+        Setting cancel_event (or closing the generator) stops the request mid-answer;
+        only complete answers are stored in the response cache.
+        """
+        self.last_cache_hit = False
+        self.last_stream = None
+        if not os.getenv("GEMINI_API_KEY"):
+            yield "Error: API Key is missing."
+            return
+
+        prompt = self._analysis_prompt(user_query)
+        cache = self.cache if use_cache else None
+        key = None
+        if cache is not None:
+            key = ResponseCache.key(self.model_id, self.temperature, prompt, log_data)
+            if not refresh:
+                cached = cache.get(key)
+                if cached is not None:
+                    self.last_cache_hit = True
+                    yield cached
+                    return
+
+        parts = []
+        try:
+            for text in self.stream_generate(prompt, log_data, cancel_event=cancel_event):
+                parts.append(text)
+                yield text
+        except Exception as e:
+            logger.error(f"AI Analysis failed: {e}")
+            separator = "\n\n" if parts else ""
+            yield f"{separator}Error during AI analysis (after retries): {str(e)}"
+            return
+        if cache is not None and parts and not self.last_stream["cancelled"]:
+            cache.put(key, "".join(parts))
+
+    def update_analysis(self, previous_report: str, log_data: str, use_cache: bool = True, refresh: bool = False) -> str:
+        """
+        Incremental review of an append-only log: revises previous_report with the entries
+        appended since it was written (log_data describes only those, plus whole-log statistics).
+        Without a previous report this is analyze_log.
+        """
+        if not previous_report:
+            return self.analyze_log(log_data, use_cache=use_cache, refresh=refresh)
+        if not os.getenv("GEMINI_API_KEY"):
+            return "Error: API Key is missing."
+
+        prompt = (
+            f"{self.SYSTEM_INSTRUCTION}\n\nThe report below covers the audit trail up to the last review. "
+            "New entries have been appended since then; they are provided with pre-screen statistics for the whole log. "
+            "Update the report: keep the earlier findings, add findings from the new entries and revise the "
+            "assessment if needed. Return the complete updated report."
+            f"\n\n### CURRENT REPORT\n{previous_report}"
+        )
+        try:
+            return self._generate(prompt, log_data, use_cache=use_cache, refresh=refresh)
+        except Exception as e:
+            logger.error(f"Incremental AI analysis failed: {e}")
+            return f"Error during AI analysis (after retries): {str(e)}"
+
+    def _map_chunk(self, index: int, chunk: str, user_query: str, use_cache: bool, refresh: bool) -> str:
+        """Map step: findings for one part of the log."""
+        task = (
+            f"USER QUESTION: {user_query}\n\nCollect every log entry relevant to the question."
+            if user_query else "List the DI Observations (Findings) for this part only."
+        )
+        prompt = (
+            f"{self.SYSTEM_INSTRUCTION}\n\nYou are reviewing PART {index + 1} of a larger audit trail. "
+            f"{task} Quote the log evidence verbatim. If nothing is relevant, answer 'No findings.'"
+        )
+        try:
+            return self._generate(prompt, chunk, use_cache=use_cache, refresh=refresh)
+        except Exception as e:
+            logger.error(f"Map step failed for part {index + 1}: {e}")
+            return f"Error: part {index + 1} could not be analyzed ({e})."
+
+    def _reduce(self, partials: list, user_query: str, chunk_tokens: int, use_cache: bool, refresh: bool,
+                max_concurrency: int = DEFAULT_MAP_CONCURRENCY) -> str:
+        """
+        Reduce step: merges per-part findings, hierarchically if they don't fit one request.
+        Every group merges at least two results, so each level is smaller than the last;
+        the groups of one level are sent concurrently.
+        """
+        while True:
+            groups, group, size = [], [], 0
+            for text in partials:
+                cost = estimate_tokens(text)
+                if len(group) >= 2 and size + cost > chunk_tokens:
+                    groups.append(group)
+                    group, size = [], 0
+                group.append(text)
+                size += cost
+            if len(group) == 1 and groups:
+                groups[-1].append(group[0])
+            else:
+                groups.append(group)
+            if len(groups) > 1 and len(groups) >= len(partials):
+                raise RuntimeError(f"reduce made no progress ({len(partials)} partial results)")
+
+            final = len(groups) == 1
+            if final and user_query:
+                task = f"USER QUESTION: {user_query}\n\nAnswer the question using the partial results below."
+            elif final:
+                task = "Merge the partial findings below into one formal Audit Review Report. Remove duplicates and keep the strictest assessment."
+            else:
+                task = "Merge the partial findings below into one consolidated findings list. Remove duplicates, keep all evidence quotes."
+            prompt = f"{self.SYSTEM_INSTRUCTION}\n\nThe log was reviewed in parts. {task}"
+
+            contexts = ["\n\n".join(f"--- PART RESULT {i + 1} ---\n{t}" for i, t in enumerate(group)) for group in groups]
+            if final:
+                return self._generate(prompt, contexts[0], use_cache=use_cache, refresh=refresh)
+            with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+                partials = list(pool.map(lambda context: self._generate(prompt, context, use_cache=use_cache, refresh=refresh), contexts))
+
+    def analyze_log_mapreduce(self, log_data, user_query: str = "", chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+                              max_concurrency: int = DEFAULT_MAP_CONCURRENCY, progress_callback=None,
+                              use_cache: bool = True, refresh: bool = False) -> str:
+        """
+        Full-coverage analysis: runs the ALCOA+ prompt over token-budgeted chunks of the
+        whole log concurrently (map), then merges the findings into one report (reduce).
+        log_data is anything chunk_log accepts. progress_callback(done, submitted, finished_submitting)
+        is called as each chunk completes.
+        """
+        if not os.getenv("GEMINI_API_KEY"):
+            return "Error: API Key is missing."
+
+        results = {}
+        chunks = enumerate(chunk_log(log_data, chunk_tokens))
+        submitted, exhausted = 0, False
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            pending = {}
+            while True:
+                # Keep a bounded window in flight so huge logs are never chunked up front
+                while not exhausted and len(pending) < max_concurrency * 2:
+                    try:
+                        index, chunk = next(chunks)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[pool.submit(self._map_chunk, index, chunk, user_query, use_cache, refresh)] = index
+                    submitted += 1
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+                if progress_callback:
+                    progress_callback(len(results), submitted, exhausted)
+
+        if not results:
+            return "Error: The log is empty."
+        partials = [results[i] for i in sorted(results)]
+        try:
+            return self._reduce(partials, user_query, chunk_tokens, use_cache, refresh, max_concurrency)
+        except Exception as e:
+            logger.error(f"Reduce step failed: {e}")
+            return f"Error during AI analysis (reduce step): {str(e)}"
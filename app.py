@@ -1,8 +1,25 @@
 import streamlit as st
 import pandas as pd
 import os
-from security_utils import SecurityEngine
-from ai_utils import AIEngine
+import hashlib
+import threading
+from security_utils import SecurityEngine, DEFAULT_BATCH_SIZE, spacy_model_name
+from profiler_utils import ROLES, plan_to_frame
+from ingest_utils import (
+    load_upload, file_extension, iter_csv_chunks, iter_text_chunks, iter_excel_chunks, excel_sheets, excel_columns,
+    stream_anonymize, read_preview, DEFAULT_CHUNK_ROWS, STREAMING_THRESHOLD_BYTES, PREVIEW_ROWS
+)
+from ai_utils import AIEngine, DEFAULT_CHUNK_TOKENS, DEFAULT_MAP_CONCURRENCY, estimate_tokens
+from scheduler_utils import RateLimitScheduler
+from context_utils import pack_context, DEFAULT_CONTEXT_TOKENS
+from retrieval_utils import build_index
+from tail_utils import TailAuditor, TAIL_EXTENSIONS
+from event_store_utils import EventStore, INDEXED_FIELDS
+from prescreen_utils import prescreen, build_prescreen_context
+from memo_utils import Memo, content_hash, memo_key
+from store_utils import MaskedStore, store_enabled, store_version
+from schema_utils import context_columns
+from telemetry_utils import Telemetry, span, peak_rss_bytes
 from auth_utils import AuthManager
 from cloud_utils import CloudManager
 from dotenv import load_dotenv
@@ -53,6 +70,213 @@ def login_page(auth):
                     else:
                         st.error(f"Registration failed: {msg}")
 
+# Engines are built once per process, not on every rerun
+@st.cache_resource(max_entries=1)
+def get_auth_manager():
+    return AuthManager()
+
+@st.cache_resource(max_entries=1)
+def get_cloud_manager():
+    return CloudManager.get()
+
+@st.cache_resource(max_entries=1)
+def get_masked_store():
+    return MaskedStore() if store_enabled() else None
+
+@st.cache_resource(max_entries=64)
+def get_ai_engine(user_id: str, api_key_id: str):
+    """One engine per user and API key (the key is baked into the client; api_key_id is its digest)."""
+    return AIEngine(user_id=user_id)
+
+def masking_plan_editor(plan, key):
+    """Lets the user override the profiled column roles."""
+    with st.expander("🧭 Masking Plan"):
+        edited_plan = st.data_editor(
+            plan_to_frame(plan)[["Column", "Role"]],
+            column_config={"Role": st.column_config.SelectboxColumn("Role", options=ROLES, required=True)},
+            disabled=["Column"], hide_index=True, key=key
+        )
+        st.caption("Maskers: enum/timestamp → skip, ip/email → regex, name/text → NER")
+    return dict(zip(edited_plan["Column"], edited_plan["Role"]))
+
+def telemetry_panel():
+    """Per-stage timings (parse, masking per column, LLM, upload) with JSONL/Prometheus export."""
+    telemetry = Telemetry.get()
+    with st.sidebar.expander("📊 Telemetry"):
+        telemetry.enabled = st.toggle("Record stage timings", value=telemetry.enabled,
+                                      help="Process-wide; negligible overhead while off.")
+        st.caption(f"Peak RSS: {peak_rss_bytes() / 2**20:,.0f} MB")
+        if "memo" in st.session_state:
+            held = st.session_state["memo"].session.stats()
+            st.caption(f"This session holds {held['items']} processed artifacts, ~{held['bytes'] / 2**20:,.1f} MB")
+        summary = telemetry.summary()
+        if not summary:
+            st.caption("No spans recorded yet.")
+            return
+        st.dataframe(pd.DataFrame(summary), hide_index=True)
+        with st.popover("Recent spans"):
+            st.dataframe(pd.DataFrame(telemetry.recent(200)[::-1]), hide_index=True)
+        st.download_button("Export JSONL", telemetry.to_jsonl(), file_name="telemetry.jsonl", mime="application/json")
+        st.download_button("Export Prometheus", telemetry.to_prometheus(), file_name="telemetry.prom", mime="text/plain")
+        if st.button("Reset telemetry"):
+            telemetry.reset()
+
+def tail_view(uploaded_file, owner, sec_engine, ai_engine, context_tokens, ner_workers):
+    """Tail mode: only rows appended since this file was last reviewed are masked and screened."""
+    auditor = TailAuditor(f"{owner}/{uploaded_file.name}", engine=sec_engine, n_process=ner_workers)
+    # Reruns of the same upload find nothing new; keep the cycle that did the work for display
+    cycles = st.session_state.setdefault("tail_cycles", {})
+    if uploaded_file.file_id not in cycles:
+        with st.spinner("Reviewing appended rows..."):
+            cycles[uploaded_file.file_id] = auditor.cycle(uploaded_file)
+    cycle = cycles[uploaded_file.file_id]
+
+    st.subheader("📡 Tail Review")
+    if cycle.reset:
+        st.info("This upload does not extend the previously reviewed version of the file; it was reviewed from the start.")
+    st.caption(f"{cycle.new_rows:,} new rows masked and screened in {cycle.seconds:.2f}s, "
+               f"{cycle.rows:,} rows reviewed in total. Masked copy: `{auditor.masked_path}`")
+    stats = auditor.stats()
+    st.caption(f"Time span {stats['first']} to {stats['last']}; {stats['flagged_rows']:,} flagged rows")
+    st.dataframe(auditor.summary_frame(), hide_index=True)
+    with st.expander(f"🔎 Findings ({cycle.new_findings:,} new)"):
+        st.dataframe(auditor.findings().tail(1000), hide_index=True)
+
+    st.subheader("🤖 AI Security Analyst")
+    report = auditor.report
+    if auditor.pending_rows:
+        label = f"Update AI review with {auditor.pending_rows:,} new rows" if report else "Run AI review"
+        slot = st.empty()
+        if slot.button(label):
+            slot.empty()
+            if not os.getenv("GEMINI_API_KEY"):
+                st.error("Missing API Key")
+            else:
+                with st.spinner("Analyzing appended rows..."):
+                    report = auditor.update_summary(ai_engine, token_budget=context_tokens)
+                if report.startswith("Error"):
+                    st.error(report)
+                    report = auditor.report
+    if report:
+        st.markdown(report)
+
+def stream_answer(ai_engine, context, user_query, prefix, refresh=False):
+    """Writes the answer into the page as it arrives; the Stop button cancels the request."""
+    stop = st.empty()
+    stop.button("⏹ Stop", key="stop_analysis", help="Cancel the request; the partial answer is kept.")
+    cancel = threading.Event()
+    stream = ai_engine.analyze_log_stream(context, user_query=user_query, cancel_event=cancel, refresh=refresh)
+    parts, finished = [], False
+    def chunks():
+        yield prefix
+        for text in stream:
+            parts.append(text)
+            yield text
+    try:
+        st.write_stream(chunks())
+        finished = True
+    finally:
+        # Stop reruns the script, which interrupts write_stream: close the request
+        # now so it stops consuming quota, and show what arrived on the next run
+        cancel.set()
+        stream.close()
+        if not finished and parts:
+            st.session_state["stopped_answer"] = prefix + "".join(parts)
+    stop.empty()
+    stats = ai_engine.last_stream
+    if ai_engine.last_cache_hit:
+        st.caption("⚡ Served from response cache")
+    elif stats and stats["ttft"] is not None:
+        st.caption(f"First text after {stats['ttft']:.1f}s, complete after {stats['seconds']:.1f}s")
+    return "".join(parts)
+
+def show_stopped_answer():
+    stopped = st.session_state.pop("stopped_answer", None)
+    if stopped:
+        st.warning("Analysis stopped; the request was cancelled. Partial answer:")
+        st.markdown(stopped)
+
+def backup_upload(cloud, uploaded_file, owner):
+    """Queues the upload for vault backup once per upload (deduped by content digest)."""
+    backed_up = st.session_state.setdefault('uploaded_files', [])
+    if uploaded_file.file_id not in backed_up:
+        success, msg = cloud.backup_file(uploaded_file, uploaded_file.name, owner=owner)
+        if success:
+            st.toast(f"File secured for vault backup. {msg}")
+            backed_up.append(uploaded_file.file_id)
+        else:
+            st.warning(f"Backup Warning: {msg}")
+
+def event_store_view(uploaded_files, owner, cloud, sec_engine, ai_engine, context_tokens, ner_workers, chunk_rows, pdf_workers):
+    """Several uploads: masked events from every file in one indexed table, queried together."""
+    if "event_store" not in st.session_state:
+        st.session_state["event_store"] = EventStore()
+    store = st.session_state["event_store"]
+    file_hashes = st.session_state.setdefault('file_hashes', {})
+    digests = {}
+    for uploaded_file in uploaded_files:
+        backup_upload(cloud, uploaded_file, owner)
+        if uploaded_file.file_id not in file_hashes:
+            file_hashes[uploaded_file.file_id] = content_hash(uploaded_file)
+        digests[file_hashes[uploaded_file.file_id]] = uploaded_file
+    # Files removed from the uploader leave the store
+    for digest in set(store.sources()["digest"]) - set(digests):
+        store.remove(digest)
+    for digest, uploaded_file in digests.items():
+        if store.has(digest):
+            continue
+        progress = st.progress(0.0, text=f"Masking {uploaded_file.name}...")
+        def on_chunk(chunks, rows):
+            done = min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0)
+            progress.progress(done, text=f"{uploaded_file.name}: masked {rows:,} rows")
+        try:
+            with span("app.event_store", bytes=uploaded_file.size) as sp:
+                sp.set(rows=store.add_upload(uploaded_file.name, uploaded_file, sec_engine, digest=digest,
+                                             chunk_rows=chunk_rows, n_process=ner_workers,
+                                             pdf_workers=pdf_workers, progress_callback=on_chunk))
+        except Exception as e:
+            st.error(f"{uploaded_file.name}: {e}")
+        finally:
+            progress.empty()
+
+    st.subheader("🗂️ Unified Event Store")
+    sources = store.sources()
+    st.caption(f"{store.rows:,} anonymized events from {len(sources)} files, {store.nbytes / 1e6:.1f} MB on disk")
+    sources["columns"] = sources["columns"].map(lambda c: ", ".join(f"{k}={v}" for k, v in c.items()))
+    st.dataframe(sources[["name", "rows", "first", "last", "columns"]], hide_index=True)
+
+    field_col, value_col = st.columns([1, 3])
+    field = field_col.selectbox("Field", INDEXED_FIELDS)
+    shared = store.shared_values(field)
+    with st.expander(f"🔗 {field} values in several files ({len(shared)})"):
+        st.dataframe(shared, hide_index=True)
+    value = value_col.selectbox("Timeline for", [None] + sorted(store.distinct(field)))
+    if value is not None:
+        st.dataframe(store.query({field: value}, limit=1000).dropna(axis=1, how="all"), hide_index=True)
+
+    st.subheader("🤖 AI Security Analyst")
+    refresh_cache = st.checkbox(
+        "Bypass response cache (refresh)",
+        help="Ask Gemini again even if this exact request was answered before."
+    )
+    show_stopped_answer()
+    if st.button("Run Full Security Audit"):
+        if not os.getenv("GEMINI_API_KEY"):
+            st.error("Missing API Key")
+        else:
+            context, summary = store.context(token_budget=context_tokens)
+            st.caption(f"AI context: {summary}")
+            result = stream_answer(ai_engine, context, "", "", refresh=refresh_cache)
+            cloud.log_chat(owner, "Full Audit Request", result[:500] + "...")
+
+    user_query = st.text_input("Ask specific question")
+    if st.button("Ask AI"):
+        if user_query and os.getenv("GEMINI_API_KEY"):
+            context, summary = store.context(user_query, token_budget=context_tokens)
+            st.caption(f"Question context: {summary}")
+            answer = stream_answer(ai_engine, context, user_query, "**A:** ", refresh=refresh_cache)
+            cloud.log_chat(owner, user_query, answer)
+
 def main_app(user):
     # Handle both Supabase User object and local dict fallback
     if isinstance(user, dict):
@@ -81,8 +305,16 @@ def main_app(user):
     *Note: This is an early prototype for testing purposes.* **Contact:** Questions or feedback? Reach out to [llyd100100100@gmail.com](mailto:llyd100100100@gmail.com)
     """)
 
-    auth = AuthManager() # For cloud access access
-    cloud = CloudManager()
+    cloud = get_cloud_manager()
+    # Load the NER model while the user is still looking at the page (PII_WARMUP=0 turns this off)
+    if os.getenv("PII_WARMUP", "1") != "0":
+        SecurityEngine.warm_up()
+    # Parsed/anonymized artifacts keyed by upload content hash (this session + process-wide)
+    if 'memo' not in st.session_state:
+        st.session_state['memo'] = Memo()
+    memo = st.session_state['memo']
+    # Anonymized logs on disk, keyed the same way (None if MASKED_STORE=0)
+    masked_store = get_masked_store()
 
     # --- Configuration ---
     # API Key Handling (Auto load from .env or Secrets)
@@ -97,122 +329,428 @@ def main_app(user):
         if api_key_input:
             os.environ["GEMINI_API_KEY"] = api_key_input
 
+    # Performance settings
+    with st.sidebar.expander("⚙️ Performance"):
+        max_workers = os.cpu_count() or 1
+        ner_workers = st.number_input(
+            "NER worker processes", min_value=1, max_value=max_workers,
+            value=min(int(os.getenv("PII_WORKERS", "1")), max_workers)
+        )
+        if not SecurityEngine.is_ready():
+            st.caption(f"PII engine ({spacy_model_name()}) is loading in the background...")
+        mask_cache = SecurityEngine().cache if SecurityEngine.is_ready() else None
+        if mask_cache is not None:
+            stats = mask_cache.stats()
+            st.caption(f"Mask cache: {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%}), {stats['disk_bytes'] / 1e6:.1f} MB on disk")
+            if st.button("Clear mask cache"):
+                mask_cache.clear()
+        streaming_mode = st.checkbox(
+            "Streaming mode (CSV/Excel/TXT)",
+            help=f"Reads and masks the upload in chunks. Always on above {STREAMING_THRESHOLD_BYTES // 2**20} MB."
+        )
+        lean_memory = st.checkbox(
+            "Memory-lean mode", value=True,
+            help="Repeated values are stored once (categoricals) and masked through their distinct values; "
+                 "the parsed original is not kept, and the Original view reads its rows from the upload."
+        )
+        mine_templates = st.checkbox(
+            "Structure TXT logs by template", value=True,
+            help="Learns the line templates of a TXT log and splits each line into fields, so only the variable parts are masked."
+        )
+        chunk_rows = st.number_input("Chunk size (rows)", min_value=1000, value=DEFAULT_CHUNK_ROWS, step=1000)
+        pdf_workers = st.number_input("PDF extraction processes", min_value=1, max_value=max_workers, value=max_workers)
+        context_tokens = st.number_input(
+            "AI context budget (tokens)", min_value=1000, value=DEFAULT_CONTEXT_TOKENS, step=10_000,
+            help="Rows are packed (CSV, dictionary codes, collapsed repeats) until this budget is full."
+        )
+        map_chunk_tokens = st.number_input("Map-reduce chunk size (tokens)", min_value=2000, value=DEFAULT_CHUNK_TOKENS, step=1000)
+        map_concurrency = st.number_input("Map-reduce concurrent requests", min_value=1, max_value=32, value=DEFAULT_MAP_CONCURRENCY)
+        response_cache = AIEngine._response_cache
+        if response_cache is not None:
+            stats = response_cache.stats()
+            st.caption(f"Response cache: {stats['hits']} hits / {stats['misses']} misses, {stats['disk_bytes'] / 1e6:.1f} MB on disk")
+            if st.button("Clear response cache"):
+                response_cache.clear()
+        artifacts = memo.shared.stats()
+        st.caption(f"Processed-file cache: {artifacts['items']} artifacts, {artifacts['bytes'] / 1e6:.0f} MB, {artifacts['hits']} hits")
+        if st.button("Clear processed-file cache"):
+            memo.clear()
+        if masked_store is not None:
+            stored = masked_store.stats()
+            st.caption(f"Masked log store: {stored['files']} files, {stored['bytes'] / 1e6:.0f} MB on disk")
+            if st.button("Clear masked log store"):
+                masked_store.clear()
+        backup = cloud.stats()
+        if backup:
+            st.caption(
+                f"Vault backup: {backup['uploads_pending']} uploads ({backup['bytes_pending'] / 1e6:.1f} MB) and "
+                f"{backup['chats_pending']} chat logs queued, {backup['bytes_saved'] / 1e6:.1f} MB deduplicated"
+                + (f", {backup['uploads_failed']} failed" if backup['uploads_failed'] else "")
+            )
+        sched = RateLimitScheduler.get().stats()
+        st.caption(
+            f"Gemini queue: {sched['queued']} waiting, {sched['in_flight']} in flight, "
+            f"wait avg {sched['wait_avg']:.1f}s / p95 {sched['wait_p95']:.1f}s, {sched['rate_limited']} rate-limited"
+        )
+
     # Upload Section
-    uploaded_file = st.sidebar.file_uploader("Upload Audit Log (CSV, Excel, TXT, PDF)", type=["csv", "xlsx", "xls", "txt", "pdf"])
+    uploaded_files = st.sidebar.file_uploader(
+        "Upload Audit Logs (CSV, Excel, TXT, PDF)", type=["csv", "xlsx", "xls", "txt", "pdf"], accept_multiple_files=True,
+        help="Several files are masked into one event table and reviewed together."
+    ) or []
+    uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
 
-    if uploaded_file:
+    if len(uploaded_files) > 1:
         try:
-            # --- 1. Cloud Backup (Deduped) ---
-            if 'uploaded_files' not in st.session_state:
-                st.session_state['uploaded_files'] = []
+            with st.spinner(f"Loading PII model ({spacy_model_name()})..."):
+                sec_engine = SecurityEngine()
+            api_key_id = hashlib.sha256(os.getenv("GEMINI_API_KEY", "").encode()).hexdigest()[:16]
+            event_store_view(uploaded_files, user_email, cloud, sec_engine, get_ai_engine(user_email, api_key_id),
+                             context_tokens, ner_workers, chunk_rows, pdf_workers)
+        except Exception as e:
+            st.error(f"Error: {e}")
 
-            file_key = f"{user_email}_{uploaded_file.name}"
-            
-            # Only upload if not previously uploaded in this session
-            if file_key not in st.session_state['uploaded_files']:
-                file_content = uploaded_file.getvalue()
-                with st.spinner("Encrypting & Backing up to Vault..."):
-                     success, msg = cloud.upload_file(file_content, file_key)
-                     if success:
-                         st.toast("File securely loaded.")
-                         st.session_state['uploaded_files'].append(file_key)
-                     else:
-                         if "already exists" in msg:
-                             # Check if we should ignore existing files (e.g. re-upload same file)
-                             st.session_state['uploaded_files'].append(file_key) # Mark as done to stop trying
-                         else:
-                             st.warning(f"Backup Warning: {msg}")
+    if uploaded_file:
+        try:
+            # --- 1. Cloud Backup (Deduped by content digest, sent in the background) ---
+            backup_upload(cloud, uploaded_file, user_email)
             
             # --- 2. Local Processing ---
-            file_ext = uploaded_file.name.split('.')[-1].lower()
-            data_content = None
-            data_type = "unknown"
-
-            # Parse
-            uploaded_file.seek(0) # Reset pointer
-            if file_ext == 'csv':
-                data_content = pd.read_csv(uploaded_file)
-                data_type = "dataframe"
-            elif file_ext in ['xlsx', 'xls']:
-                data_content = pd.read_excel(uploaded_file)
-                data_type = "dataframe"
-            elif file_ext == 'txt':
-                data_content = uploaded_file.read().decode("utf-8")
-                data_type = "text"
-            elif file_ext == 'pdf':
-                import pypdf
-                pdf_reader = pypdf.PdfReader(uploaded_file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                data_content = text
-                data_type = "text"
-            
-            if data_content is not None:
-                # --- Security Phase ---
+            file_ext = file_extension(uploaded_file.name)
+            with st.spinner(f"Loading PII model ({spacy_model_name()})..."):
                 sec_engine = SecurityEngine()
+            # Hash once per upload; every stage below is memoized on (hash, config)
+            file_hashes = st.session_state.setdefault('file_hashes', {})
+            if uploaded_file.file_id not in file_hashes:
+                file_hashes[uploaded_file.file_id] = content_hash(uploaded_file)
+            file_hash = file_hashes[uploaded_file.file_id]
+            engine_version = sec_engine.model_version()
+            # PDFs always stream: pages are masked as soon as they are extracted
+            use_streaming = file_ext == 'pdf' or (
+                file_ext in ('csv', 'xlsx', 'txt') and (streaming_mode or uploaded_file.size > STREAMING_THRESHOLD_BYTES)
+            )
+
+            # Workbooks: only the chosen sheet and columns are read
+            sheet, columns = None, None
+            if file_ext == 'xlsx':
+                sheets = memo("sheets", file_hash, (), lambda: excel_sheets(uploaded_file))
+                sheet_col, columns_col = st.columns([1, 3])
+                sheet = sheet_col.selectbox("Sheet", sheets, key=f"sheet_{uploaded_file.name}")
+                all_columns = memo("columns", file_hash, sheet, lambda: excel_columns(uploaded_file, sheet))
+                chosen = columns_col.multiselect("Columns", all_columns, default=all_columns,
+                                                 key=f"columns_{uploaded_file.name}_{sheet}")
+                columns = chosen if chosen and len(chosen) < len(all_columns) else None
+                if sheet != sheets[0] or columns is not None:
+                    # A different selection is a different input: key every stage below on it
+                    file_hash = memo_key(file_hash, sheet, columns)
+
+            tail_mode = file_ext in TAIL_EXTENSIONS and st.sidebar.toggle(
+                "📡 Tail mode", key=f"tail_{uploaded_file.name}",
+                help="For append-only logs: when a newer export of this file is uploaded, only the rows "
+                     "appended since the last review are masked, screened and sent to Gemini."
+            )
+            lean = lean_memory and not use_streaming
+            if tail_mode:
+                api_key_id = hashlib.sha256(os.getenv("GEMINI_API_KEY", "").encode()).hexdigest()[:16]
+                tail_view(uploaded_file, user_email, sec_engine, get_ai_engine(user_email, api_key_id),
+                          context_tokens, ner_workers)
+                data_content, data_type = None, None
+            elif use_streaming:
+                # Chunks are masked as they are read; only previews and the AI context stay in memory
+                plan = None
+                if file_ext in ('csv', 'xlsx'):
+                    def profile_first_chunk():
+                        if file_ext == 'csv':
+                            first_chunk = next(iter_csv_chunks(uploaded_file, chunk_rows), None)
+                        else:
+                            first_chunk = next(iter_excel_chunks(uploaded_file, chunk_rows, sheet=sheet, columns=columns), None)
+                        return sec_engine.profile_dataframe(first_chunk) if first_chunk is not None else None
+                    with st.spinner("Profiling columns..."):
+                        profiled = memo("profile", file_hash, (engine_version, chunk_rows), profile_first_chunk)
+                    if profiled is not None:
+                        plan = masking_plan_editor(profiled, f"plan_{uploaded_file.name}")
+
+                # Keep enough leading rows to fill the AI context budget (a packed row costs >= ~10 tokens)
+                context_rows = max(5000, context_tokens // 10)
+                def run_stream():
+                    progress = st.progress(0.0, text="Streaming PII Firewall...")
+                    def on_chunk(chunks, rows):
+                        done = min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0)
+                        progress.progress(done, text=f"Masked {rows:,} rows ({chunks} chunks)")
+                    try:
+                        with span("app.stream", format=file_ext, bytes=uploaded_file.size) as sp:
+                            result = stream_anonymize(
+                                uploaded_file.name, uploaded_file, sec_engine, chunk_rows=chunk_rows, plan=plan,
+                                batch_size=DEFAULT_BATCH_SIZE, n_process=ner_workers, progress_callback=on_chunk,
+                                pdf_workers=pdf_workers, context_rows=context_rows, sheet=sheet, columns=columns
+                            )
+                            sp.set(rows=result.rows, chunks=result.chunks)
+                            return result
+                    finally:
+                        progress.empty()
+
+                # The masked temp file is removed once the result leaves every cache
+                stream = memo("stream", file_hash, (engine_version, plan, chunk_rows, context_rows), run_stream)
+                st.caption(f"Streamed {stream.rows:,} rows in {stream.chunks} chunks. Masked output: `{stream.output_path}`")
+                if plan and stream.plan:
+                    moved = [col for col, role in stream.plan.items() if plan.get(col) != role]
+                    if moved:
+                        st.caption(f"PII found in later chunks, masked with NER: {', '.join(map(str, moved))}")
+                if stream.page_timings:
+                    with st.expander(f"📄 PDF extraction ({len(stream.page_timings)} pages)"):
+                        timings = pd.DataFrame(stream.page_timings, columns=["Page", "Seconds"]).sort_values("Page")
+                        st.caption(f"Total page time {timings['Seconds'].sum():.2f}s, slowest page {timings['Seconds'].max():.2f}s")
+                        st.dataframe(timings, hide_index=True)
+
+                data_type = stream.data_type
+                data_content = stream.preview_original
+                anonymized_content = stream.context
+            else:
+                # Parse
+                def parse():
+                    with span("app.parse", format=file_ext, bytes=uploaded_file.size, lean=lean) as sp:
+                        parsed = load_upload(uploaded_file.name, uploaded_file, pdf_workers=pdf_workers,
+                                             mine_templates=mine_templates, sheet=sheet, columns=columns, lean=lean)
+                        if parsed[0] is not None:
+                            sp.set(rows=len(parsed[0]) if parsed[1] == "dataframe" else parsed[0].count("\n") + 1)
+                        return parsed
+
+                parsed = []
+                def original():
+                    """The parsed upload. In lean mode it is not cached: a stage that is computed parses it again."""
+                    if not parsed:
+                        with st.spinner("Parsing upload..."):
+                            parsed.append(parse() if lean else memo("parse", file_hash, (file_ext, mine_templates), parse))
+                    return parsed[0][0]
+
+                def parsed_type():
+                    return parsed[0][1] if original() is not None else None
+
+                if lean:
+                    # Only the kind of upload is cached
+                    data_type = memo("parse_type", file_hash, (file_ext, mine_templates), parsed_type)
+                    data_content = None
+                else:
+                    data_content, data_type = original(), parsed_type()
                 anonymized_content = None
 
-                with st.spinner(f"Applying PII Firewall..."):
+            store_key = None
+            if data_type and anonymized_content is None:
+                # --- Security Phase ---
+                # Masking plan: structured columns skip NER (overridable)
+                plan = None
+                if data_type == "dataframe":
+                    with st.spinner("Profiling columns..."):
+                        profiled = memo("profile", file_hash, engine_version, lambda: sec_engine.profile_dataframe(original()))
+                    plan = masking_plan_editor(profiled, f"plan_{uploaded_file.name}")
+
+                def mask():
                     if data_type == "dataframe":
-                        anonymized_content = sec_engine.anonymize_dataframe(data_content)
-                    else:
-                        anonymized_content = sec_engine.anonymize_text(data_content)
+                        return sec_engine.anonymize_dataframe(
+                            original(), batch_size=DEFAULT_BATCH_SIZE, n_process=ner_workers, plan=plan, lean=lean
+                        )
+                    with span("anonymize.text", bytes=len(original())):
+                        return sec_engine.anonymize_text(original())
+
+                if masked_store is not None:
+                    store_key = store_version(engine_version, plan, mode=data_type, lean=lean)
+
+                def anonymize():
+                    # Masked output survives restarts: reopen it (memory-mapped) instead of rerunning NER
+                    if masked_store is None:
+                        return mask()
+                    with span("store.load") as sp:
+                        stored_columns = masked_store.columns(file_hash, store_key)
+                        sp.set(hit=stored_columns is not None)
+                    if stored_columns is None:
+                        masked = mask()
+                        with span("store.save"):
+                            masked_store.save(file_hash, store_key, masked, source=uploaded_file.name)
+                        stored_columns = list(masked.columns) if data_type == "dataframe" else None
+                        del masked
+                    # Only the columns the context, pre-screen and index use are read back;
+                    # the Data Inspector reads its rows from the store separately
+                    keep = context_columns(stored_columns) if data_type == "dataframe" else None
+                    return masked_store.load(file_hash, store_key, columns=keep)
+
+                with st.spinner(f"Applying PII Firewall..."):
+                    anonymized_content = memo("anonymize", file_hash, (engine_version, plan, lean), anonymize)
+                if file_ext == 'txt' and data_type == "dataframe":
+                    fields = (masked_store.columns(file_hash, store_key) if store_key else None) or anonymized_content.columns
+                    st.caption(f"Template-mined: {anonymized_content['Template'].nunique()} line templates, "
+                               f"{len(fields) - 2} fields")
 
+            if data_type:
                 # --- Data Preview ---
                 st.subheader("Data Inspector")
                 view_mode = st.radio("View Mode:", ["Anonymized (Safe)", "Original (Risk)"], horizontal=True)
                 
                 if view_mode == "Original (Risk)":
                     st.warning("⚠️ Accessing raw data.")
-                    if data_type == "dataframe":
+                    if lean:
+                        # Read from the upload on demand instead of keeping the parsed original
+                        raw = read_preview(uploaded_file.name, uploaded_file, sheet=sheet, columns=columns)
+                        st.caption(f"First {PREVIEW_ROWS} rows of the upload")
+                        if isinstance(raw, pd.DataFrame):
+                            st.dataframe(raw)
+                        else:
+                            st.text_area("Raw Text", raw, height=200)
+                    elif data_type == "dataframe":
                         st.dataframe(data_content.head(100))
                     else:
                         st.text_area("Raw Text", data_content, height=200)
                 else:
                     st.success("✅ PII Masked.")
                     if data_type == "dataframe":
-                        st.dataframe(anonymized_content.head(100))
+                        preview = None
+                        if store_key is not None:
+                            preview = masked_store.load(file_hash, store_key, rows=range(min(100, len(anonymized_content))))
+                        st.dataframe(anonymized_content.head(100) if preview is None else preview)
                     else:
                         st.text_area("Anonymized Text", anonymized_content, height=200)
 
                 # --- AI Analysis ---
                 st.subheader("🤖 AI Security Analyst")
-                ai_engine = AIEngine()
+                api_key_id = hashlib.sha256(os.getenv("GEMINI_API_KEY", "").encode()).hexdigest()[:16]
+                ai_engine = get_ai_engine(user_email, api_key_id)
                 
-                # Context Prep
-                if data_type == "dataframe":
-                    data_context = anonymized_content.head(5000).to_markdown(index=False)
-                else:
-                    data_context = anonymized_content[:5000]
+                # Deterministic pre-screen runs on the original rows; only masked rows are sent
+                screen = None
+                if not use_streaming:
+                    def run_prescreen():
+                        data = original()
+                        with span("app.prescreen", rows=len(data) if data_type == "dataframe" else None):
+                            return prescreen(data)
+                    # Keyed like the parse: row numbers refer to the frame or text original() returned
+                    screen = memo("prescreen", file_hash, (file_ext, mine_templates), run_prescreen)
+                    with st.expander(f"🔎 Local pre-screen: {screen.stats['flagged_rows']:,} of {screen.stats['rows']:,} rows flagged"):
+                        st.dataframe(screen.summary_frame(), hide_index=True)
+                        st.dataframe(screen.findings.head(1000), hide_index=True)
+                send_flagged_only = screen is not None and st.toggle(
+                    "Send only pre-screen findings", value=True,
+                    help="Gemini receives whole-log statistics plus the flagged rows with a little context."
+                )
+
+                # Context Prep: fill the token budget with compactly encoded rows
+                def build_context():
+                    with span("app.context", flagged_only=send_flagged_only) as sp:
+                        if send_flagged_only:
+                            text = build_prescreen_context(screen, anonymized_content, token_budget=context_tokens)
+                            sp.set(bytes=len(text))
+                            return text, f"pre-screen summary + flagged windows, ~{estimate_tokens(text):,} tokens"
+                        packed = pack_context(anonymized_content, token_budget=context_tokens)
+                        sp.set(rows=packed.rows, bytes=len(packed.text))
+                        return packed.text, packed.summary()
+
+                data_context, context_summary = memo(
+                    "context", file_hash,
+                    (file_ext, mine_templates, engine_version, plan, use_streaming, chunk_rows, context_tokens, send_flagged_only),
+                    build_context
+                )
+                st.caption(f"AI context: {context_summary}")
+
+                full_coverage = st.toggle(
+                    "Full coverage (map-reduce)",
+                    help="Analyze the whole log in chunks instead of only the rows that fit the context budget."
+                )
+                refresh_cache = st.checkbox(
+                    "Bypass response cache (refresh)",
+                    help="Ask Gemini again even if this exact request was answered before."
+                )
+                retrieve_rows = st.toggle(
+                    "Pick rows for each question", value=True,
+                    help="Questions are answered from the rows most relevant to them (named users, equipment, "
+                         "actions, times and words), found in a local index of the anonymized log."
+                )
+
+                def full_log_source():
+                    """The whole anonymized log, read back from disk in streaming mode."""
+                    if not use_streaming:
+                        return anonymized_content
+                    if data_type == "dataframe":
+                        return pd.read_csv(stream.output_path, chunksize=chunk_rows)
+                    return open(stream.output_path, encoding="utf-8")
+
+                def log_index():
+                    """Retrieval index over the whole anonymized log, built on the first question."""
+                    def build():
+                        with span("app.index") as sp:
+                            if not use_streaming:
+                                index = build_index(anonymized_content)
+                            elif data_type == "dataframe":
+                                index = build_index(pd.read_csv(stream.output_path, chunksize=chunk_rows))
+                            else:
+                                with open(stream.output_path, "rb") as f:
+                                    index = build_index(iter_text_chunks(f, chunk_rows))
+                            sp.set(rows=index.rows, segments=len(index.segments))
+                            return index
+                    with st.spinner("Indexing the anonymized log..."):
+                        return memo("index", file_hash, (file_ext, mine_templates, engine_version, plan, use_streaming, chunk_rows), build)
+
+                def question_context(user_query):
+                    if not retrieve_rows:
+                        return data_context
+                    with span("app.retrieve") as sp:
+                        text, summary = log_index().context(user_query, token_budget=context_tokens)
+                        sp.set(bytes=len(text))
+                    st.caption(f"Question context: {summary}")
+                    return text
+
+                def run_analysis(user_query="", prefix=""):
+                    """Renders the answer and returns its text."""
+                    with span("app.analysis", full_coverage=full_coverage, question=bool(user_query)):
+                        return _run_analysis(user_query, prefix)
+
+                def _run_analysis(user_query, prefix):
+                    if not full_coverage:
+                        context = question_context(user_query) if user_query else data_context
+                        return stream_answer(ai_engine, context, user_query, prefix, refresh=refresh_cache)
+                    progress = st.progress(0.0, text="Analyzing chunks...")
+                    def on_chunk(done, submitted, all_submitted):
+                        total = f"{submitted}" if all_submitted else f"{submitted}+"
+                        progress.progress(done / submitted, text=f"Analyzed chunk {done}/{total}")
+                    source = full_log_source()
+                    try:
+                        with st.spinner("Analyzing..."):
+                            answer = ai_engine.analyze_log_mapreduce(
+                                source, user_query=user_query, chunk_tokens=map_chunk_tokens,
+                                max_concurrency=map_concurrency, progress_callback=on_chunk, refresh=refresh_cache
+                            )
+                    finally:
+                        progress.empty()
+                        if hasattr(source, "close"):
+                            source.close()
+                    st.markdown(prefix + answer)
+                    return answer
+
+                show_stopped_answer()
 
                 if st.button("Run Full Security Audit"):
                     if not os.getenv("GEMINI_API_KEY"):
                         st.error("Missing API Key")
                     else:
-                        with st.spinner("Analyzing..."):
-                            result = ai_engine.analyze_log(data_context)
-                            st.markdown(result)
-                            # Log to Cloud
-                            cloud.log_chat(user_email, "Full Audit Request", result[:500] + "...")
+                        result = run_analysis()
+                        # Log to Cloud
+                        cloud.log_chat(user_email, "Full Audit Request", result[:500] + "...")
 
                 user_query = st.text_input("Ask specific question")
                 if st.button("Ask AI"):
                     if user_query and os.getenv("GEMINI_API_KEY"):
-                         with st.spinner("Consulting..."):
-                            answer = ai_engine.analyze_log(data_context, user_query=user_query)
-                            st.markdown(f"**A:** {answer}")
-                            # Log to Cloud
-                            cloud.log_chat(user_email, user_query, answer)
+                        answer = run_analysis(user_query, prefix="**A:** ")
+                        # Log to Cloud
+                        cloud.log_chat(user_email, user_query, answer)
 
         except Exception as e:
             st.error(f"Error: {e}")
 
+    # Rendered last so this run's spans are included
+    telemetry_panel()
+
 def main():
     if 'user' not in st.session_state:
         st.session_state['user'] = None
 
-    auth = AuthManager()
+    auth = get_auth_manager()
     
     if st.session_state['user']:
         main_app(st.session_state['user'])
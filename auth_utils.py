@@ -4,7 +4,7 @@ import time
 
 class AuthManager:
     def __init__(self):
-        self.cloud = CloudManager() # This initializes Supabase client
+        self.cloud = CloudManager.get() # Shared Supabase client (one per process)
 
     def register_user(self, email, password, name):
         """Registers a user using Supabase Auth."""
@@ -0,0 +1,329 @@
+"""
+Headless batch audit: parse, mask, pre-screen and AI-review every log in a directory or glob.
+
+Parsing and PII masking run on a process pool; Gemini calls go through a bounded
+queue (and the shared rate-limit scheduler). Each file gets a Markdown report in the
+output directory and a line in manifest.jsonl; summary.md combines them. Re-running
+with the same output directory skips files already completed with the same content
+and settings, so a crashed run resumes where it stopped.
+
+Usage:
+    python batch_audit.py test_data_large --out audit_reports --workers 4 --llm-concurrency 4
+    python batch_audit.py "exports/*.csv" --out audit_reports --no-ai
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+from context_utils import DEFAULT_CONTEXT_TOKENS
+from memo_utils import memo_key
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ("csv", "xlsx", "xls", "txt", "pdf")
+MANIFEST = "manifest.jsonl"
+SUMMARY = "summary.md"
+
+def find_inputs(inputs: list, recursive: bool = False) -> list:
+    """Expands directories and globs into a sorted, de-duplicated list of supported files."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*") if recursive else os.path.join(item, "*")
+            candidates = glob.glob(pattern, recursive=recursive)
+        else:
+            candidates = glob.glob(item, recursive=recursive) or [item]
+        paths.extend(p for p in candidates if os.path.isfile(p) and p.rsplit(".", 1)[-1].lower() in SUPPORTED_EXTENSIONS)
+    return sorted(dict.fromkeys(os.path.abspath(p) for p in paths))
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest(out_dir: str) -> dict:
+    """Latest manifest entry per (path, sha256, config)."""
+    entries = {}
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return entries
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue # torn last line after a crash
+            entries[(entry["path"], entry["sha256"], entry["config"])] = entry
+    return entries
+
+def _append_manifest(out_dir: str, entry: dict):
+    with open(os.path.join(out_dir, MANIFEST), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, default=str) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def _write_atomic(path: str, text: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def process_file(path: str, context_tokens: int = DEFAULT_CONTEXT_TOKENS, batch_size: int = 256) -> dict:
+    """
+    Pool worker: parse, mask (plan-driven for tables), pre-screen and build the AI context
+    for one file. Uses the same code paths as the app.
+    """
+    from ingest_utils import load_upload
+    from security_utils import SecurityEngine
+    from prescreen_utils import prescreen, build_prescreen_context
+    from memo_utils import content_hash
+    from store_utils import MaskedStore, store_enabled, store_version
+    from schema_utils import context_columns
+
+    timings = {}
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        data, data_type = load_upload(os.path.basename(path), f, pdf_workers=1)
+    timings["parse"] = time.perf_counter() - start
+    if data_type == "unknown" or data is None:
+        raise ValueError(f"Unsupported file type: {path}")
+
+    engine = SecurityEngine()
+    start = time.perf_counter()
+    if data_type == "dataframe":
+        plan = engine.profile_dataframe(data)
+        rows = len(data)
+        mode = "dataframe"
+    else:
+        # Line by line keeps the masked text row-aligned with the original for the pre-screen
+        lines = data.splitlines()
+        plan, rows, mode = None, len(lines), "lines"
+
+    # Re-runs (and the app, for tables: same content hash and key) reopen stored masked output
+    store = MaskedStore() if store_enabled() else None
+    if store is not None:
+        with open(path, "rb") as f:
+            source_hash = content_hash(f)
+        version = store_version(engine.model_version(), plan, mode=mode)
+        # Only the columns the pre-screen context reads (see schema_utils.context_columns)
+        keep = context_columns(data.columns) if data_type == "dataframe" else None
+        masked = store.load(source_hash, version, columns=keep)
+    else:
+        masked = None
+    reused = masked is not None
+    if masked is None:
+        if data_type == "dataframe":
+            masked = engine.anonymize_dataframe(data, batch_size=batch_size, plan=plan)
+        else:
+            masked = "\n".join(engine.anonymize_values(lines, batch_size=batch_size))
+        if store is not None:
+            store.save(source_hash, version, masked, source=os.path.basename(path))
+        if data_type == "dataframe":
+            masked = masked[context_columns(masked.columns)]
+    timings["mask"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    screen = prescreen(data)
+    context = build_prescreen_context(screen, masked, token_budget=context_tokens)
+    timings["prescreen"] = time.perf_counter() - start
+
+    return {
+        "data_type": data_type,
+        "rows": rows,
+        "context": context,
+        "prescreen": screen.summary_frame().to_dict("records"),
+        "prescreen_text": screen.summary_text(),
+        "flagged_rows": screen.stats["flagged_rows"],
+        "mask_reused": reused,
+        "timings": timings,
+    }
+
+def _render_report(path: str, sha: str, result: dict, analysis: str) -> str:
+    frame = pd.DataFrame(result["prescreen"])
+    t = result["timings"]
+    lines = [
+        f"# Audit Review: {os.path.basename(path)}",
+        "",
+        f"- Source: `{path}`",
+        f"- SHA-256: `{sha}`",
+        f"- Type: {result['data_type']}, rows: {result['rows']:,}, flagged rows: {result['flagged_rows']:,}",
+        f"- Timings: parse {t['parse']:.2f}s, mask {t['mask']:.2f}s{' (stored)' if result.get('mask_reused') else ''}, pre-screen {t['prescreen']:.2f}s"
+        + (f", AI {t['ai']:.2f}s" if "ai" in t else ""),
+        "",
+        "## Deterministic Pre-screen",
+        "",
+        frame.to_markdown(index=False) if not frame.empty else "No rules applicable to this file.",
+        "",
+        "## AI Review",
+        "",
+        analysis or "_Skipped (--no-ai)._",
+        "",
+    ]
+    return "\n".join(lines)
+
+def write_summary(out_dir: str, entries: list, run_stats: dict = None):
+    """Combined summary of every file in the manifest (this and earlier runs)."""
+    rows = []
+    for e in sorted(entries, key=lambda e: e["path"]):
+        counts = {r["Severity"]: 0 for r in e.get("prescreen", [])}
+        for r in e.get("prescreen", []):
+            counts[r["Severity"]] += r["Rows"]
+        rows.append({
+            "File": os.path.basename(e["path"]),
+            "Status": e["status"],
+            "Rows": e.get("rows", 0),
+            "Flagged": e.get("flagged_rows", 0),
+            "Critical": counts.get("Critical", 0),
+            "Major": counts.get("Major", 0),
+            "Minor": counts.get("Minor", 0),
+            "Report": os.path.basename(e["report"]) if e.get("report") else e.get("error", ""),
+        })
+    frame = pd.DataFrame(rows)
+    lines = ["# Batch Audit Summary", ""]
+    if run_stats:
+        lines += [
+            f"- Last run: {run_stats['processed']} processed, {run_stats['skipped']} skipped (already done), "
+            f"{run_stats['failed']} failed in {run_stats['seconds']:.1f}s",
+            f"- Throughput: {run_stats['files_per_min']:.1f} files/min, {run_stats['rows_per_sec']:,.0f} rows/s",
+            "",
+        ]
+    lines.append(frame.to_markdown(index=False) if not frame.empty else "No files.")
+    _write_atomic(os.path.join(out_dir, SUMMARY), "\n".join(lines) + "\n")
+
+def run_batch(paths: list, out_dir: str, workers: int = None, llm_concurrency: int = 4,
+              context_tokens: int = DEFAULT_CONTEXT_TOKENS, use_ai: bool = True, resume: bool = True,
+              progress=print) -> dict:
+    """
+    Audits every path, writing reports, the manifest and the summary into out_dir.
+    Returns run statistics (processed/skipped/failed counts and throughput).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    config = memo_key(context_tokens, use_ai)
+    done = load_manifest(out_dir) if resume else {}
+
+    todo = []
+    for path in paths:
+        sha = file_sha256(path)
+        previous = done.get((path, sha, config))
+        if previous is not None and previous["status"] == "ok":
+            continue
+        todo.append((path, sha))
+    skipped = len(paths) - len(todo)
+    progress(f"{len(paths)} files: {skipped} already done, {len(todo)} to process")
+
+    ai_engine = None
+    if use_ai and todo:
+        from ai_utils import AIEngine
+        if not os.getenv("GEMINI_API_KEY"):
+            raise SystemExit("GEMINI_API_KEY is not set (use --no-ai for pre-screen-only reports)")
+        ai_engine = AIEngine(user_id="batch")
+
+    stats = {"processed": 0, "skipped": skipped, "failed": 0, "rows": 0}
+    start = time.perf_counter()
+
+    def finish(path, sha, result, analysis=None, error=None):
+        entry = {"path": path, "sha256": sha, "config": config, "finished": time.time()}
+        if error is None and analysis is not None and analysis.startswith("Error"):
+            error = analysis
+        if result is not None:
+            entry.update({k: result[k] for k in ("data_type", "rows", "prescreen", "flagged_rows", "timings")})
+            name = f"{os.path.splitext(os.path.basename(path))[0]}_{sha[:8]}.md"
+            _write_atomic(os.path.join(out_dir, name), _render_report(path, sha, result, analysis))
+            entry["report"] = name
+            stats["rows"] += result["rows"]
+        entry["status"] = "ok" if error is None else "failed"
+        if error is not None:
+            entry["error"] = str(error)
+            stats["failed"] += 1
+        else:
+            stats["processed"] += 1
+        _append_manifest(out_dir, entry)
+        done[(path, sha, config)] = entry
+        progress(f"[{stats['processed'] + stats['failed']}/{len(todo)}] {entry['status']}: {os.path.basename(path)}"
+                 + (f" ({error})" if error else ""))
+
+    def review(result):
+        t = time.perf_counter()
+        analysis = ai_engine.analyze_log(result["context"])
+        result["timings"]["ai"] = time.perf_counter() - t
+        return analysis
+
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("fork" if "fork" in methods else None)
+    queue = iter(todo)
+    exhausted = False
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool, \
+            ThreadPoolExecutor(max_workers=llm_concurrency) as llm:
+        parsing, reviewing = {}, {}
+        while True:
+            # Backpressure: stop feeding the pool while the LLM queue is full
+            while not exhausted and len(parsing) < workers * 2 and len(reviewing) < llm_concurrency * 2:
+                item = next(queue, None)
+                if item is None:
+                    exhausted = True
+                    break
+                parsing[pool.submit(process_file, item[0], context_tokens)] = item
+            if not parsing and not reviewing:
+                break
+            finished, _ = wait(list(parsing) + list(reviewing), return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in parsing:
+                    path, sha = parsing.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        finish(path, sha, None, error=f"{type(e).__name__}: {e}")
+                        continue
+                    if ai_engine is None:
+                        finish(path, sha, result)
+                    else:
+                        reviewing[llm.submit(review, result)] = (path, sha, result)
+                else:
+                    path, sha, result = reviewing.pop(future)
+                    try:
+                        finish(path, sha, result, analysis=future.result())
+                    except Exception as e:
+                        finish(path, sha, result, error=f"{type(e).__name__}: {e}")
+
+    seconds = time.perf_counter() - start
+    stats["seconds"] = seconds
+    stats["files_per_min"] = stats["processed"] / seconds * 60 if seconds else 0.0
+    stats["rows_per_sec"] = stats["rows"] / seconds if seconds else 0.0
+    write_summary(out_dir, [e for e in done.values() if e["config"] == config], stats)
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Directories, files or glob patterns")
+    parser.add_argument("--out", default="audit_reports", help="Output directory (reports, manifest, summary)")
+    parser.add_argument("--workers", type=int, default=None, help="Parse/mask processes (default: CPU count)")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="Gemini requests in flight")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS)
+    parser.add_argument("--recursive", action="store_true", help="Descend into sub-directories")
+    parser.add_argument("--no-ai", action="store_true", help="Pre-screen reports only, no Gemini calls")
+    parser.add_argument("--restart", action="store_true", help="Ignore the manifest and redo every file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    paths = find_inputs(args.inputs, recursive=args.recursive)
+    if not paths:
+        raise SystemExit("No supported files found")
+    stats = run_batch(paths, args.out, workers=args.workers, llm_concurrency=args.llm_concurrency,
+                      context_tokens=args.context_tokens, use_ai=not args.no_ai, resume=not args.restart)
+    print(f"Done: {stats['processed']} processed, {stats['skipped']} skipped, {stats['failed']} failed "
+          f"in {stats['seconds']:.1f}s — {stats['files_per_min']:.1f} files/min, {stats['rows_per_sec']:,.0f} rows/s")
+    print(f"Summary: {os.path.join(args.out, SUMMARY)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark: per-value vs batched/multi-process NER in SecurityEngine.anonymize_dataframe.
+
+Usage:
+    python benchmark_anonymize.py --rows 20000 --workers 1 2 4
+"""
+import argparse
+import os
+import random
+import time
+
+import pandas as pd
+from faker import Faker
+
+from security_utils import SecurityEngine, DEFAULT_BATCH_SIZE
+
+EQUIPMENT = ['HPLC-01', 'HPLC-02', 'GC-05', 'Balance-03', 'Bioreactor-100L', 'Mixer-200L', 'TabletPress-A', 'Autoclave-01']
+ACTIONS = ['Login', 'Logout', 'Start Sequence', 'Stop Sequence', 'Abort', 'Data Save', 'Parameter Change', 'Audit Trail Review', 'Delete File']
+
+def make_frame(rows: int) -> pd.DataFrame:
+    fake = Faker()
+    Faker.seed(42)
+    random.seed(42)
+    return pd.DataFrame({
+        'User_ID': [fake.user_name() for _ in range(rows)],
+        'Full_Name': [fake.name() for _ in range(rows)],
+        'IP_Address': [fake.ipv4() for _ in range(rows)],
+        'Detail': [f"{random.choice(ACTIONS)} executed on {random.choice(EQUIPMENT)}. Msg: {fake.sentence()}" for _ in range(rows)],
+    })
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument("--skip-baseline", action="store_true", help="Skip the slow per-value run")
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    engine = SecurityEngine()
+    engine.anonymize_text("warm up the pipeline")
+
+    print(f"Rows: {args.rows}, unique values: {sum(df[c].nunique() for c in df.columns)}")
+    print(f"{'mode':<20}{'seconds':>10}{'rows/s':>12}{'speedup':>10}  identical")
+
+    baseline, base_s = None, None
+    if not args.skip_baseline:
+        baseline, base_s = timed(lambda: engine.anonymize_dataframe(df))
+        print(f"{'per-value':<20}{base_s:>10.2f}{args.rows / base_s:>12.0f}{1.0:>10.2f}  -")
+
+    for n in args.workers:
+        masked, secs = timed(lambda: engine.anonymize_dataframe(df, batch_size=args.batch_size, n_process=n))
+        speedup = f"{base_s / secs:.2f}" if base_s else "-"
+        same = "-" if baseline is None else ("yes" if masked.equals(baseline) else "NO")
+        print(f"{f'batched x{n}':<20}{secs:>10.2f}{args.rows / secs:>12.0f}{speedup:>10}  {same}")
+
+if __name__ == "__main__":
+    main()
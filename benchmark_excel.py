@@ -0,0 +1,109 @@
+"""
+Benchmark: reading large Excel workbooks, each reader in a fresh interpreter.
+
+  pandas          - pd.read_excel of the whole first sheet (the previous load path)
+  stream          - ingest_utils.iter_excel_chunks with openpyxl's read-only reader,
+                    rows consumed chunk by chunk
+  calamine        - the same with the native python-calamine reader (when installed)
+  *-subset        - each reader on one sheet and a few columns
+
+Workbooks are generated with generate_large_test_data.py (optionally with extra
+sheets) and reused on later runs. Reports wall time, time to the first rows and
+peak RSS, and checks that both paths read the same values.
+
+Usage:
+    python benchmark_excel.py --rows 100000 --sheets 3
+    python benchmark_excel.py --xlsx path/to/export.xlsx --columns User_ID Detail
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from generate_large_test_data import generate_file, Pools
+
+# Each probe prints one JSON line: seconds, seconds to the first rows, peak RSS, shape and a checksum
+_PROBE_PRELUDE = """
+import json, time, resource, sys, hashlib
+import pandas as pd
+path, sheet, columns, chunk_rows = sys.argv[1], json.loads(sys.argv[2]), json.loads(sys.argv[3]), int(sys.argv[4])
+start = time.perf_counter()
+"""
+_PROBE_REPORT = """
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+print(json.dumps({"seconds": time.perf_counter() - start, "first": first, "rss": rss, "rows": rows,
+                  "columns": len(names), "checksum": digest.hexdigest(), "engine": engine}))
+"""
+# Checksums hash the cell values as text, so dtype differences between readers do not matter
+_CHECKSUM = "digest.update(frame.astype(str).to_csv(index=False, header=False).encode())"
+
+PROBES = {
+    "pandas": """
+frame = pd.read_excel(path, sheet_name=sheet or 0, usecols=columns)
+first = time.perf_counter() - start
+digest, rows, names, engine = hashlib.sha256(), len(frame), list(frame.columns), "openpyxl"
+%(checksum)s
+""",
+    "stream": """
+from ingest_utils import iter_excel_chunks, excel_engine
+digest, rows, first, names, engine = hashlib.sha256(), 0, None, [], excel_engine()
+with open(path, "rb") as f:
+    for frame in iter_excel_chunks(f, chunk_rows, sheet=sheet, columns=columns):
+        if first is None:
+            first, names = time.perf_counter() - start, list(frame.columns)
+        rows += len(frame)
+        %(checksum)s
+""",
+}
+
+def run_probe(reader: str, path: str, sheet=None, columns=None, chunk_rows: int = 10_000, engine: str = "openpyxl") -> dict:
+    code = _PROBE_PRELUDE + PROBES[reader] % {"checksum": _CHECKSUM} + _PROBE_REPORT
+    proc = subprocess.run([sys.executable, "-c", code, path, json.dumps(sheet), json.dumps(columns), str(chunk_rows)],
+                          capture_output=True, text=True, env=dict(os.environ, EXCEL_ENGINE=engine),
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        return {"error": (proc.stderr.strip().splitlines() or ["failed"])[-1]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="Rows per sheet of the generated workbook")
+    parser.add_argument("--sheets", type=int, default=3, help="Sheets in the generated workbook")
+    parser.add_argument("--xlsx", default=None, help="Use an existing workbook instead of generating one")
+    parser.add_argument("--data-dir", default="benchmark_data", help="Generated inputs (reused across runs)")
+    parser.add_argument("--sheet", default=None, help="Sheet for the subset runs (default: the last sheet)")
+    parser.add_argument("--columns", nargs="+", default=["Timestamp", "User_ID", "Detail"], help="Columns for the subset runs")
+    parser.add_argument("--chunk-rows", type=int, default=10_000)
+    args = parser.parse_args()
+
+    path = args.xlsx or os.path.join(args.data_dir, f"bench_{args.rows}_rows_{args.sheets}_sheets.xlsx")
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print(f"Generating {path}...")
+        generate_file(path, "xlsx", args.rows, density=0.02, pools=Pools(42), sheets=args.sheets)
+    print(f"Workbook: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+    from ingest_utils import excel_sheets, CalamineWorkbook
+    with open(path, "rb") as f:
+        sheet = args.sheet or excel_sheets(f)[-1]
+    readers = [("pandas", "pandas", "openpyxl"), ("stream", "stream", "openpyxl")]
+    if CalamineWorkbook is not None:
+        readers.append(("calamine", "stream", "calamine"))
+
+    print(f"{'reader':<16}{'seconds':>10}{'first rows':>12}{'peak RSS':>11}{'rows':>10}{'cols':>6}  engine, same values as pandas")
+    for label, selection in [("", (None, None)), ("-subset", (sheet, args.columns))]:
+        reference = None
+        for name, reader, engine in readers:
+            result = run_probe(reader, path, *selection, chunk_rows=args.chunk_rows, engine=engine)
+            name += label
+            if "error" in result:
+                print(f"{name:<16}{result['error']}")
+                continue
+            reference = reference or result["checksum"]
+            print(f"{name:<16}{result['seconds']:>9.2f}s{result['first'] or 0:>11.2f}s{result['rss'] / 2**20:>8.0f} MB"
+                  f"{result['rows']:>10,}{result['columns']:>6}  {result['engine']}, {result['checksum'] == reference}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Benchmark: sequential vs parallel PDF text extraction (ingest_utils.iter_pdf_pages).
+
+Generates a large audit-report PDF like generate_large_test_data.py does, then
+times extraction at several worker counts and checks the text is identical.
+
+Usage:
+    python benchmark_pdf.py --pages 2000 --workers 1 2 4
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import time
+
+from faker import Faker
+from fpdf import FPDF
+
+from ingest_utils import iter_pdf_pages, read_pdf_text
+
+EQUIPMENT = ['HPLC-01', 'HPLC-02', 'GC-05', 'Balance-03', 'Bioreactor-100L', 'Mixer-200L', 'TabletPress-A', 'Autoclave-01']
+LINES_PER_PAGE = 25
+
+def make_pdf(path: str, pages: int):
+    fake = Faker()
+    Faker.seed(42)
+    random.seed(42)
+    pdf = FPDF()
+    pdf.set_auto_page_break(False)
+    pdf.set_font("Arial", size=10)
+    line_no = 0
+    for _ in range(pages):
+        pdf.add_page()
+        for _ in range(LINES_PER_PAGE):
+            line_no += 1
+            line = f"{line_no}. [{fake.date()}] User: {fake.name()} accessed {random.choice(EQUIPMENT)}. Result: {random.choice(['Pass', 'Fail'])}"
+            pdf.cell(0, 10, txt=line, ln=1)
+    pdf.output(path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, os.cpu_count() or 1}))
+    parser.add_argument("--pdf", default=None, help="Use an existing PDF instead of generating one")
+    parser.add_argument("--data-dir", default="benchmark_data", help="Generated inputs (reused across runs)")
+    args = parser.parse_args()
+
+    path = args.pdf or os.path.join(args.data_dir, f"bench_{args.pages}_pages.pdf")
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print(f"Generating {path}...")
+        make_pdf(path, args.pages)
+    with open(path, "rb") as f:
+        data = f.read()
+    print(f"PDF: {path} ({len(data) / 1e6:.1f} MB)")
+
+    reference = None
+    print(f"{'workers':<10}{'seconds':>10}{'pages/s':>10}{'first page':>12}{'p50 page':>10}{'p95 page':>10}  identical")
+    for n in args.workers:
+        start = time.perf_counter()
+        first, timings = None, []
+        for page_no, text, seconds in iter_pdf_pages(io.BytesIO(data), max_workers=n):
+            first = first or time.perf_counter() - start
+            timings.append(seconds)
+        total = time.perf_counter() - start
+
+        text = read_pdf_text(io.BytesIO(data), max_workers=n)
+        reference = reference or text
+        p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+        print(f"{n:<10}{total:>10.2f}{len(timings) / total:>10.0f}{first:>12.3f}"
+              f"{statistics.median(timings):>10.4f}{p95:>10.4f}  {'yes' if text == reference else 'NO'}")
+
+if __name__ == "__main__":
+    main()
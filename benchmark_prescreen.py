@@ -0,0 +1,40 @@
+"""
+Benchmark: deterministic ALCOA+ pre-screen (prescreen_utils.prescreen) on a large log.
+
+Replicates a mock audit log from test_data_large (see generate_large_test_data.py)
+up to the requested row count and times one full pass of every rule.
+
+Usage:
+    python benchmark_prescreen.py --rows 1000000
+"""
+import argparse
+import glob
+import time
+
+import pandas as pd
+
+from prescreen_utils import prescreen, build_prescreen_context
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--csv", default=None, help="Source log (default: first mock CSV in test_data_large)")
+    args = parser.parse_args()
+
+    path = args.csv or sorted(glob.glob("test_data_large/mock_audit_log_*.csv"))[0]
+    base = pd.read_csv(path)
+    df = pd.concat([base] * (-(-args.rows // len(base))), ignore_index=True).head(args.rows)
+    print(f"Log: {path} replicated to {len(df):,} rows")
+
+    start = time.perf_counter()
+    result = prescreen(df)
+    screened = time.perf_counter() - start
+    context = build_prescreen_context(result, df, token_budget=100_000)
+    total = time.perf_counter() - start
+
+    print(result.summary_frame().to_string(index=False))
+    print(f"prescreen: {screened:.2f}s ({len(df) / screened:,.0f} rows/s), with context build: {total:.2f}s")
+    print(f"findings: {len(result.findings):,}, context: {len(context):,} chars")
+
+if __name__ == "__main__":
+    main()
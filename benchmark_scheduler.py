@@ -0,0 +1,61 @@
+"""
+Load test: many users sharing one Gemini quota through scheduler_utils.RateLimitScheduler.
+
+Starts the local fake Gemini server (fake_gemini_server.py) with a small quota window,
+fires U users x R requests through AIEngine and reports throughput, 429s,
+queue wait percentiles and per-user completion spread (fairness).
+
+Usage:
+    python benchmark_scheduler.py --users 8 --requests 10 --server-rpm 20 --window 2
+"""
+import argparse
+import os
+import statistics
+import time
+
+from fake_gemini_server import start_server
+from scheduler_utils import RateLimitScheduler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=10, help="Requests per user")
+    parser.add_argument("--server-rpm", type=int, default=20, help="Requests the fake server admits per window")
+    parser.add_argument("--window", type=float, default=2.0, help="Fake server quota window in seconds")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--client-rpm", type=int, default=None,
+                        help="Scheduler limit per minute (default: matches the server quota)")
+    args = parser.parse_args()
+
+    server, state, url = start_server(rpm=args.server_rpm, window=args.window, latency=args.latency)
+    os.environ["GEMINI_BASE_URL"] = url
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
+    client_rpm = args.client_rpm or int(args.server_rpm * 60 / args.window)
+    RateLimitScheduler._instance = RateLimitScheduler(rpm=client_rpm, max_concurrency=args.concurrency)
+
+    from ai_utils import AIEngine
+    engines = [AIEngine(user_id=f"user{u}") for u in range(args.users)]
+    for engine in engines:
+        engine.cache = None
+
+    start = time.perf_counter()
+    futures = [(engine.user_id, engine.submit_generate("Review this log.", f"{engine.user_id} request {r}"))
+               for r in range(args.requests) for engine in engines]
+    finished = {}
+    for user, future in futures:
+        future.result()
+        finished.setdefault(user, []).append(time.perf_counter() - start)
+    total = time.perf_counter() - start
+    server.shutdown()
+
+    stats = RateLimitScheduler.get().stats()
+    n = args.users * args.requests
+    last = [max(times) for times in finished.values()]
+    print(f"requests: {n} in {total:.1f}s ({n / total:.1f} req/s), client limit {client_rpm}/min")
+    print(f"server: {state.requests} received, {state.rejected} rejected (429), {state.completed} completed")
+    print(f"scheduler: wait avg {stats['wait_avg']:.2f}s, p95 {stats['wait_p95']:.2f}s, rate-limited {stats['rate_limited']}")
+    print(f"fairness: per-user finish time min {min(last):.1f}s / median {statistics.median(last):.1f}s / max {max(last):.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark: cold-start cost of the app, each step in a fresh interpreter.
+
+  import   - importing app.py's modules (what the login page waits for)
+  engine   - building SecurityEngine (trimmed NER-only pipeline, pruned recognizers)
+             plus the first analyze call, per spaCy model
+  full     - the same with Presidio's defaults (full pipeline, every recognizer),
+             for comparison
+
+Usage:
+    python benchmark_startup.py
+    python benchmark_startup.py --models en_core_web_sm en_core_web_lg --repeat 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from security_utils import SPACY_MODELS
+
+# Each probe prints one JSON line: seconds, peak RSS and details
+_PROBE_PRELUDE = """
+import json, time, resource, sys
+start = time.perf_counter()
+"""
+_PROBE_RSS = "resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)"
+
+PROBES = {
+    "import": """
+import app
+print(json.dumps({"seconds": time.perf_counter() - start, "rss": %(rss)s,
+                  "heavy_loaded": [m for m in ("spacy", "presidio_analyzer", "google.genai", "supabase") if m in sys.modules]}))
+""",
+    "engine": """
+from security_utils import SecurityEngine, PII_ENTITIES
+engine = SecurityEngine()
+loaded = time.perf_counter() - start
+engine.analyzer.analyze(text="Contact John Smith at 555-123-4567", entities=PII_ENTITIES, language="en")
+print(json.dumps({"seconds": time.perf_counter() - start, "load": loaded, "rss": %(rss)s,
+                  "pipes": engine.analyzer.nlp_engine.nlp["en"].pipe_names,
+                  "recognizers": len(engine.analyzer.registry.recognizers)}))
+""",
+    "full": """
+import os
+from presidio_analyzer import AnalyzerEngine
+from presidio_analyzer.nlp_engine import NlpEngineProvider
+from security_utils import PII_ENTITIES
+provider = NlpEngineProvider(nlp_configuration={"nlp_engine_name": "spacy",
+    "models": [{"lang_code": "en", "model_name": os.environ["SPACY_MODEL"]}]})
+analyzer = AnalyzerEngine(nlp_engine=provider.create_engine())
+loaded = time.perf_counter() - start
+analyzer.analyze(text="Contact John Smith at 555-123-4567", entities=PII_ENTITIES, language="en")
+print(json.dumps({"seconds": time.perf_counter() - start, "load": loaded, "rss": %(rss)s,
+                  "pipes": analyzer.nlp_engine.nlp["en"].pipe_names,
+                  "recognizers": len(analyzer.registry.recognizers)}))
+""",
+}
+
+def run_probe(name: str, model: str = None) -> dict:
+    env = dict(os.environ, PII_MASK_CACHE="0", PII_WARMUP="0")
+    if model:
+        env["SPACY_MODEL"] = model
+    code = _PROBE_PRELUDE + PROBES[name] % {"rss": _PROBE_RSS}
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        return {"error": (proc.stderr.strip().splitlines() or ["failed"])[-1]}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def best_of(name: str, model: str, repeat: int) -> dict:
+    runs = [run_probe(name, model) for _ in range(repeat)]
+    ok = [r for r in runs if "error" not in r]
+    return min(ok, key=lambda r: r["seconds"]) if ok else runs[0]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=SPACY_MODELS, help="spaCy models (names or paths)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per probe; the fastest is reported")
+    parser.add_argument("--no-full", action="store_true", help="Skip the Presidio-defaults comparison")
+    args = parser.parse_args()
+
+    result = best_of("import", None, args.repeat)
+    if "error" in result:
+        print(f"import: {result['error']}")
+    else:
+        print(f"import app: {result['seconds']:.2f}s, {result['rss'] / 2**20:.0f} MB RSS, "
+              f"heavy modules loaded: {', '.join(result['heavy_loaded']) or 'none'}")
+
+    for model in args.models:
+        for name in ["engine"] + ([] if args.no_full else ["full"]):
+            result = best_of(name, model, args.repeat)
+            label = f"{model} {'trimmed' if name == 'engine' else 'default'}"
+            if "error" in result:
+                print(f"{label:>32}: {result['error']}")
+                continue
+            print(f"{label:>32}: ready {result['load']:.2f}s, first analyze {result['seconds'] - result['load']:.2f}s, "
+                  f"{result['rss'] / 2**20:.0f} MB RSS, {result['recognizers']} recognizers, pipes {result['pipes']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+Benchmark suite: parse, anonymize, context build, LLM call and end-to-end time
+per format and size, on synthetic logs from generate_large_test_data.py.
+
+The LLM is the local fake Gemini server (fake_gemini_server.py) with a fixed latency,
+so timings measure this code, not the network. Each run appends one JSON line per
+(format, size) to --results, tagged with the git commit, so runs can be compared
+across commits (--compare prints ratios against the most recent other commit).
+
+Usage:
+    python benchmark_suite.py --formats csv txt --sizes 10000 100000
+    python benchmark_suite.py --formats csv xlsx txt pdf --sizes 1000 10000 --compare
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from generate_large_test_data import generate_file
+
+STAGES = ["parse", "anonymize", "context", "llm", "end_to_end"]
+
+def git_revision() -> dict:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        sha, dirty = "unknown", False
+    return {"commit": sha, "dirty": dirty}
+
+def dataset(data_dir: str, fmt: str, rows: int, density: float, seed: int) -> str:
+    """Generates (once) the synthetic log for one format/size and returns its path."""
+    path = os.path.join(data_dir, f"bench_{rows}_{density:g}_{seed}.{fmt}")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        generate_file(path + ".tmp", fmt, rows, density=density, seed=seed)
+        os.replace(path + ".tmp", path)
+    return path
+
+def run_case(path: str, context_tokens: int, batch_size: int) -> dict:
+    """Runs the batch pipeline (same code paths as the app) plus one stubbed LLM call."""
+    from batch_audit import process_file
+    from ai_utils import AIEngine
+
+    start = time.perf_counter()
+    result = process_file(path, context_tokens=context_tokens, batch_size=batch_size)
+    t = result["timings"]
+
+    engine = AIEngine(user_id="benchmark")
+    llm_start = time.perf_counter()
+    analysis = engine.analyze_log(result["context"], use_cache=False)
+    llm = time.perf_counter() - llm_start
+    if analysis.startswith("Error"):
+        raise RuntimeError(analysis)
+
+    return {
+        "rows": result["rows"],
+        "flagged_rows": result["flagged_rows"],
+        "context_chars": len(result["context"]),
+        "seconds": {
+            "parse": t["parse"],
+            "anonymize": t["mask"],
+            "context": t["prescreen"],
+            "llm": llm,
+            "end_to_end": time.perf_counter() - start,
+        },
+    }
+
+def load_history(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def compare(current: list, history: list):
+    """Prints stage time ratios (current / baseline) against the latest run of another commit."""
+    for rec in current:
+        baseline = next((h for h in reversed(history)
+                         if h["format"] == rec["format"] and h["size"] == rec["size"] and h["commit"] != rec["commit"]), None)
+        if baseline is None:
+            print(f"{rec['format']:>4} {rec['size']:>10,}: no earlier commit to compare with")
+            continue
+        ratios = "  ".join(f"{stage} x{rec['seconds'][stage] / max(baseline['seconds'][stage], 1e-9):.2f}" for stage in STAGES)
+        print(f"{rec['format']:>4} {rec['size']:>10,} vs {baseline['commit']}: {ratios}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", nargs="+", default=["csv", "txt"], choices=["csv", "xlsx", "txt", "pdf"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000], help="Rows (log lines) per file")
+    parser.add_argument("--density", type=float, default=0.01, help="Share of rows with an injected ALCOA+ violation")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default="benchmark_data", help="Generated inputs (reused across runs)")
+    parser.add_argument("--results", default=os.path.join("benchmark_results", "history.jsonl"))
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per case; the fastest is recorded")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Fake Gemini response latency (s)")
+    parser.add_argument("--context-tokens", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--compare", action="store_true", help="Print ratios against the latest other commit")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    # Measure the work, not the caches
+    os.environ["PII_MASK_CACHE"] = "0"
+    os.environ["MASKED_STORE"] = "0"
+    os.environ["AI_RESPONSE_CACHE"] = "0"
+    os.environ["GEMINI_API_KEY"] = "benchmark"
+    os.environ.setdefault("GEMINI_RPM", "100000")
+    from fake_gemini_server import start_server
+    server, _, url = start_server(rpm=100_000, latency=args.llm_latency)
+    os.environ["GEMINI_BASE_URL"] = url
+
+    meta = {
+        **git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "density": args.density,
+        "llm_latency": args.llm_latency,
+    }
+    history = load_history(args.results)
+    records = []
+    try:
+        for fmt in args.formats:
+            for size in args.sizes:
+                path = dataset(args.data_dir, fmt, size, args.density, args.seed)
+                runs = [run_case(path, args.context_tokens, args.batch_size) for _ in range(args.repeat)]
+                best = min(runs, key=lambda r: r["seconds"]["end_to_end"])
+                rec = {**meta, "format": fmt, "size": size, "bytes": os.path.getsize(path), **best,
+                       "rows_per_s": best["rows"] / max(best["seconds"]["end_to_end"] - best["seconds"]["llm"], 1e-9)}
+                records.append(rec)
+                s = rec["seconds"]
+                print(f"{fmt:>4} {size:>10,} rows ({rec['bytes'] / 1e6:7.1f} MB): "
+                      + "  ".join(f"{stage} {s[stage]:.2f}s" for stage in STAGES)
+                      + f"  ({rec['rows_per_s']:,.0f} rows/s excl. LLM)", flush=True)
+    finally:
+        server.shutdown()
+
+    if not args.no_save and records:
+        os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+        with open(args.results, "a", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps(rec, default=str) + "\n")
+        print(f"Appended {len(records)} results to {args.results} (commit {meta['commit']}{', dirty' if meta['dirty'] else ''})")
+    if args.compare:
+        compare(records, history)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+import os
+import hmac
+import time
+import hashlib
+import sqlite3
+import secrets
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Local cache root (override with AUDIT_CACHE_DIR, e.g. on read-only containers)
+CACHE_DIR = os.getenv("AUDIT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai-audit-reviewer"))
+
+def _ensure_dir(path: str) -> str:
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def load_secret(name: str, cache_dir: str = None) -> bytes:
+    """Per-install random key used to digest cache keys (created on first use)."""
+    path = os.path.join(_ensure_dir(cache_dir or CACHE_DIR), name)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    key = secrets.token_bytes(32)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+class DiskLRU:
+    """
+    SQLite-backed key/value store with size-based LRU eviction and optional TTL.
+    Keys are expected to be digests; values are stored as given.
+    Entries written under another format version are dropped on open.
+    """
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, ttl: float = None, version: int = 0):
+        _ensure_dir(os.path.dirname(path) or ".")
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used)")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != version:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute(f"PRAGMA user_version = {int(version)}")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get_many(self, keys: list) -> dict:
+        """Returns {key: value} for the keys present (and not expired)."""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value, created FROM entries WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                for key, value, created in rows:
+                    if self.ttl is None or now - created <= self.ttl:
+                        found[key] = value
+            if found:
+                self._conn.executemany("UPDATE entries SET last_used=? WHERE key=?", [(now, k) for k in found])
+        return found
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: dict):
+        if not items:
+            return
+        now = time.time()
+        rows = [(k, v, len(k) + len(v), now, now) for k, v in items.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.execute("COMMIT")
+            # Upper bound (replaced rows are counted twice); _evict recomputes the exact size
+            self._size += sum(row[2] for row in rows)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def put(self, key: str, value):
+        self.put_many({key: value})
+
+    def _evict(self):
+        """Drops expired entries, then least recently used ones down to 90% of max_bytes."""
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+        target = int(self.max_bytes * 0.9)
+        size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        cursor = self._conn.execute("SELECT key, size FROM entries ORDER BY last_used")
+        doomed = []
+        for key, entry_size in cursor:
+            if size <= target:
+                break
+            doomed.append((key,))
+            size -= entry_size
+        cursor.close()
+        self._conn.executemany("DELETE FROM entries WHERE key=?", doomed)
+        self._size = size
+        logger.info(f"Cache eviction: removed {len(doomed)} entries")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._size = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+class MaskCache:
+    """
+    Content-addressed cache of masked values: in-process LRU in front of a DiskLRU.
+    Raw values never reach disk; entries are keyed by a keyed digest of
+    (namespace, value), where the namespace pins model version and entity set.
+    A value that masking left unchanged is stored as UNCHANGED, not as itself.
+    """
+    UNCHANGED = "" # masking never turns a non-empty value into an empty one
+    def __init__(self, namespace: str, cache_dir: str = None, max_memory_items: int = 100_000,
+                 max_disk_bytes: int = 256 * 1024 * 1024):
+        cache_dir = cache_dir or CACHE_DIR
+        self.namespace = namespace
+        self._secret = load_secret("mask_cache.key", cache_dir)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_memory_items = max_memory_items
+        # Version 1: unchanged values stored as UNCHANGED (older files may hold raw values)
+        self.disk = DiskLRU(os.path.join(cache_dir, "mask_cache.sqlite"), max_bytes=max_disk_bytes, version=1)
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, value: str) -> str:
+        msg = f"{self.namespace}\x00{value}".encode("utf-8", "surrogatepass")
+        return hmac.new(self._secret, msg, hashlib.blake2b).hexdigest()[:64]
+
+    def _remember(self, key: str, masked: str):
+        self._memory[key] = masked
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, values: list) -> dict:
+        """Returns {value: masked} for cached values."""
+        found, pending = {}, {}
+        with self._lock:
+            for value in values:
+                key = self.digest(value)
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[value] = self._memory[key]
+                else:
+                    pending[key] = value
+        if pending:
+            for key, masked in self.disk.get_many(list(pending)).items():
+                masked = pending[key] if masked == self.UNCHANGED else masked
+                found[pending[key]] = masked
+                with self._lock:
+                    self._remember(key, masked)
+        self.hits += len(found)
+        self.misses += len(values) - len(found)
+        return found
+
+    def get(self, value: str):
+        return self.get_many([value]).get(value)
+
+    def put_many(self, pairs: dict):
+        """Stores {value: masked}."""
+        items = {self.digest(value): (value, masked) for value, masked in pairs.items()}
+        with self._lock:
+            for key, (_, masked) in items.items():
+                self._remember(key, masked)
+        self.disk.put_many({key: self.UNCHANGED if masked == value else masked for key, (value, masked) in items.items()})
+
+    def put(self, value: str, masked: str):
+        self.put_many({value: masked})
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self.disk.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+            "disk_bytes": self.disk.size_bytes,
+        }
+
+class ResponseCache:
+    """
+    Persistent cache of LLM responses keyed by a digest of the full request
+    (model, temperature, prompt incl. system instruction and question, masked context).
+    Entries expire after ttl seconds; the store is size-bounded.
+    """
+    def __init__(self, cache_dir: str = None, ttl: float = 7 * 24 * 3600, max_disk_bytes: int = 128 * 1024 * 1024):
+        cache_dir = cache_dir or CACHE_DIR
+        self.disk = DiskLRU(os.path.join(cache_dir, "response_cache.sqlite"), max_bytes=max_disk_bytes, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            data = str(part).encode("utf-8", "surrogatepass")
+            # Length-prefix each part so ("ab", "c") and ("a", "bc") differ
+            h.update(len(data).to_bytes(8, "big"))
+            h.update(data)
+        return h.hexdigest()
+
+    def get(self, key: str):
+        value = self.disk.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, text: str):
+        self.disk.put(key, text)
+
+    def clear(self):
+        self.disk.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "disk_bytes": self.disk.size_bytes,
+        }
@@ -1,66 +1,451 @@
-import streamlit as st
-from supabase import create_client, Client
+import os
+import io
+import json
+import time
+import uuid
+import base64
+import hashlib
+import sqlite3
+import logging
 import datetime
+import threading
+import httpx
+import streamlit as st
+from cache_utils import CACHE_DIR, _ensure_dir
+from telemetry_utils import span
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Bucket name must be 'audit-vault' (User created)
+VAULT_BUCKET = "audit-vault"
+# Supabase resumable (TUS) uploads must be sent in 6 MB chunks (the last one may be shorter)
+TUS_CHUNK_BYTES = 6 * 2**20
+CHAT_BATCH_SIZE = 50
+FLUSH_INTERVAL = 2.0 # seconds between background flushes
+MAX_ATTEMPTS = 8
+MAX_BACKOFF = 60.0
+DIGEST_BLOCK_BYTES = 1 << 20
+
+class AlreadyExists(Exception):
+    pass
+
+def content_object_name(digest: str) -> str:
+    """Vault key of a content-addressed object (sha256 hex digest)."""
+    return f"objects/sha256/{digest[:2]}/{digest}"
+
+def pointer_object_name(owner: str, filename: str) -> str:
+    """Vault key of the name pointer for one user's file."""
+    safe = lambda part: part.replace("/", "_").replace("\\", "_") or "_"
+    return f"names/{safe(owner)}/{safe(filename)}.json"
+
+def _credentials():
+    """SUPABASE_URL / SUPABASE_KEY from Streamlit secrets, else the environment."""
+    try:
+        url, key = st.secrets.get("SUPABASE_URL"), st.secrets.get("SUPABASE_KEY")
+    except Exception: # no secrets.toml (headless use)
+        url = key = None
+    return url or os.getenv("SUPABASE_URL"), key or os.getenv("SUPABASE_KEY")
+
+class CloudSpool:
+    """
+    Durable local queue (SQLite + blob files) of vault uploads and chat-log rows that
+    have not reached Supabase yet. Survives restarts; the worker resumes from it.
+    """
+    def __init__(self, path: str):
+        self.blob_dir = _ensure_dir(os.path.join(os.path.dirname(path) or ".", "cloud_spool_blobs"))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            "id INTEGER PRIMARY KEY, bucket TEXT, object_name TEXT, blob_path TEXT, size INTEGER, "
+            "upload_url TEXT, attempts INTEGER DEFAULT 0, next_try REAL DEFAULT 0, error TEXT, "
+            "failed INTEGER DEFAULT 0, created REAL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chat_logs (id INTEGER PRIMARY KEY, payload TEXT, created REAL)")
+        # Digests known to be in the vault (local half of the dedupe index)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS digests (sha256 TEXT PRIMARY KEY, size INTEGER, confirmed REAL)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(uploads)")}
+        for column, decl in (("digest", "TEXT"), ("upsert", "INTEGER DEFAULT 0")):
+            if column not in columns: # spools written before content addressing
+                self._conn.execute(f"ALTER TABLE uploads ADD COLUMN {column} {decl}")
+        # One pending upload per content digest, so concurrent backups of a file queue it once
+        duplicates = self._conn.execute( # queued twice by older versions
+            "SELECT id, blob_path FROM uploads WHERE digest IS NOT NULL AND failed=0 AND id NOT IN "
+            "(SELECT MIN(id) FROM uploads WHERE digest IS NOT NULL AND failed=0 GROUP BY digest)"
+        ).fetchall()
+        for upload_id, blob_path in duplicates:
+            self.remove_upload(upload_id, blob_path)
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uploads_digest ON uploads (digest) WHERE digest IS NOT NULL AND failed=0"
+        )
+
+    @staticmethod
+    def digest(fileobj):
+        """(sha256 hex digest, size) of fileobj, read in blocks without writing anything."""
+        h = hashlib.sha256()
+        size = 0
+        for block in iter(lambda: fileobj.read(DIGEST_BLOCK_BYTES), b""):
+            h.update(block)
+            size += len(block)
+        return h.hexdigest(), size
+
+    def spool_blob(self, fileobj):
+        """
+        Copies fileobj into a new blob file, hashing it on the way.
+        Returns (blob_path, sha256 hex digest, size); the file is fsynced.
+        """
+        blob_path = os.path.join(self.blob_dir, uuid.uuid4().hex)
+        h = hashlib.sha256()
+        size = 0
+        fd = os.open(blob_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            for block in iter(lambda: fileobj.read(DIGEST_BLOCK_BYTES), b""):
+                h.update(block)
+                f.write(block)
+                size += len(block)
+            f.flush()
+            os.fsync(f.fileno())
+        return blob_path, h.hexdigest(), size
+
+    def has_digest(self, digest: str) -> bool:
+        """True if the content is in the vault or already queued for it."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM digests WHERE sha256=? UNION ALL SELECT 1 FROM uploads WHERE digest=? AND failed=0 LIMIT 1",
+                (digest, digest),
+            ).fetchone() is not None
+
+    def add_digest(self, digest: str, size: int):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO digests VALUES (?, ?, ?)", (digest, size, time.time()))
+
+    def add_upload(self, bucket: str, object_name: str, data=None, blob_path: str = None, size: int = None,
+                   digest: str = None, upsert: bool = False) -> int:
+        """
+        Queues bytes (data) or an already spooled blob; the blob is always on disk before the row.
+        Content with a digest is queued only if it is neither in the vault nor already queued;
+        otherwise nothing is inserted and None is returned (the caller still owns the blob).
+        """
+        if blob_path is None:
+            blob_path, _, size = self.spool_blob(io.BytesIO(data))
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO uploads (bucket, object_name, blob_path, size, digest, upsert, created) "
+                "SELECT ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM digests WHERE sha256=?)",
+                (bucket, object_name, blob_path, size, digest, int(upsert), time.time(), digest),
+            )
+            return cur.lastrowid if cur.rowcount else None
+
+    def next_upload(self, now: float = None):
+        """Oldest upload that is due (not failed, backoff elapsed), as a dict."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, bucket, object_name, blob_path, size, upload_url, attempts, digest, upsert FROM uploads "
+                "WHERE failed=0 AND next_try<=? ORDER BY id LIMIT 1", (now or time.time(),)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(["id", "bucket", "object_name", "blob_path", "size", "upload_url", "attempts", "digest",
+                         "upsert"], row))
+
+    def update_upload(self, upload_id: int, **fields):
+        cols = ", ".join(f"{k}=?" for k in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE uploads SET {cols} WHERE id=?", (*fields.values(), upload_id))
+
+    def remove_upload(self, upload_id: int, blob_path: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM uploads WHERE id=?", (upload_id,))
+        try:
+            os.remove(blob_path)
+        except OSError:
+            pass
+
+    def add_chat(self, payload: dict):
+        with self._lock:
+            self._conn.execute("INSERT INTO chat_logs (payload, created) VALUES (?, ?)",
+                               (json.dumps(payload), time.time()))
+
+    def chat_batch(self, limit: int) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, payload FROM chat_logs ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def remove_chats(self, ids: list):
+        with self._lock:
+            self._conn.executemany("DELETE FROM chat_logs WHERE id=?", [(i,) for i in ids])
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending, pending_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM uploads WHERE failed=0").fetchone()
+            failed, last_error = self._conn.execute(
+                "SELECT COUNT(*), MAX(error) FROM uploads WHERE failed=1").fetchone()
+            chats = self._conn.execute("SELECT COUNT(*) FROM chat_logs").fetchone()[0]
+        return {"uploads_pending": pending, "bytes_pending": pending_bytes, "uploads_failed": failed,
+                "last_error": last_error, "chats_pending": chats}
+
+class TusUploader:
+    """Chunked, resumable uploads to Supabase Storage over the TUS protocol."""
+    def __init__(self, base_url: str, key: str, http: httpx.Client, chunk_bytes: int = TUS_CHUNK_BYTES):
+        self.base_url = base_url.rstrip("/")
+        self.endpoint = f"{self.base_url}/storage/v1/upload/resumable"
+        self.http = http
+        self.chunk_bytes = chunk_bytes
+        self.headers = {"authorization": f"Bearer {key}", "apikey": key, "Tus-Resumable": "1.0.0"}
+
+    def create(self, bucket: str, object_name: str, size: int, content_type: str = "application/octet-stream",
+               upsert: bool = False) -> str:
+        meta = {"bucketName": bucket, "objectName": object_name, "contentType": content_type}
+        encoded = ",".join(f"{k} {base64.b64encode(v.encode()).decode()}" for k, v in meta.items())
+        resp = self.http.post(self.endpoint, headers={
+            **self.headers, "Upload-Length": str(size), "Upload-Metadata": encoded, "x-upsert": str(upsert).lower(),
+        })
+        if resp.status_code == 409:
+            raise AlreadyExists(f"{bucket}/{object_name}")
+        resp.raise_for_status()
+        return resp.headers["Location"]
+
+    def exists(self, bucket: str, object_name: str) -> bool:
+        """Remote half of the dedupe index: HEAD on the stored object."""
+        resp = self.http.head(f"{self.base_url}/storage/v1/object/{bucket}/{quote(object_name)}", headers=self.headers)
+        if resp.status_code in (400, 404):
+            return False
+        resp.raise_for_status()
+        return True
+
+    def offset(self, upload_url: str):
+        """Bytes the server already has for this upload, or None if it no longer knows it."""
+        resp = self.http.head(upload_url, headers=self.headers)
+        if resp.status_code in (404, 410):
+            return None
+        resp.raise_for_status()
+        return int(resp.headers["Upload-Offset"])
+
+    def send(self, upload_url: str, fileobj, offset: int, size: int, on_chunk=None) -> int:
+        """PATCHes the rest of fileobj from offset; on_chunk(offset) after each acknowledged chunk."""
+        while offset < size:
+            fileobj.seek(offset)
+            chunk = fileobj.read(self.chunk_bytes)
+            resp = self.http.patch(upload_url, content=chunk, headers={
+                **self.headers, "Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream",
+            })
+            resp.raise_for_status()
+            offset = int(resp.headers["Upload-Offset"])
+            if on_chunk:
+                on_chunk(offset)
+        return offset
 
 class CloudManager:
-    def __init__(self):
+    """
+    Supabase access for the app: one client and HTTP pool per process (CloudManager.get()).
+    Vault uploads and chat logs go to a durable local spool and are sent by a background
+    worker (uploads chunked and resumable via TUS, chat rows inserted in batches), so
+    callers never wait on the network and nothing is lost if the process dies.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, url: str = None, key: str = None, spool_path: str = None,
+                 chunk_bytes: int = TUS_CHUNK_BYTES, start_worker: bool = True):
         # Initialize Supabase
-        self.supabase: Client = None
-        sb_url = st.secrets.get("SUPABASE_URL")
-        sb_key = st.secrets.get("SUPABASE_KEY")
-        
+        self.supabase = None
+        if url is None and key is None:
+            url, key = _credentials()
+
         self.is_connected = False
-        if sb_url and sb_key:
+        if url and key:
             try:
-                self.supabase = create_client(sb_url, sb_key)
+                from supabase import create_client # imported only when configured
+                self.supabase = create_client(url, key)
                 self.is_connected = True
             except Exception as e:
-                print(f"Supabase Init Error: {e}")
+                logger.error(f"Supabase Init Error: {e}")
 
-    def upload_file(self, file_content: bytes, filename: str) -> tuple[bool, str]:
-        """Uploads a file to Supabase Storage bucket 'audit-vault'."""
+        self.spool = None
+        self.dedup_hits = 0 # uploads skipped by digest (local or remote index)
+        self.bytes_saved = 0
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()
+        self._worker = None
+        if self.is_connected:
+            self.http = httpx.Client(timeout=httpx.Timeout(60.0, connect=10.0))
+            self.tus = TusUploader(url, key, self.http, chunk_bytes=chunk_bytes)
+            self.spool = CloudSpool(spool_path or os.path.join(_ensure_dir(CACHE_DIR), "cloud_spool.sqlite"))
+            if start_worker:
+                self._worker = threading.Thread(target=self._run, name="cloud-worker", daemon=True)
+                self._worker.start()
+
+    @classmethod
+    def get(cls) -> "CloudManager":
+        """The process-wide instance (credentials from secrets/environment)."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def backup_file(self, fileobj, filename: str, owner: str = "shared") -> tuple[bool, str]:
+        """
+        Backs a file up to the 'audit-vault' bucket, content-addressed. The bytes are hashed
+        before anything is written; content already in the vault (local digest index here, a
+        HEAD on the object in the worker) or already queued is never spooled or transferred
+        again. The owner's filename is stored as a small pointer object naming the digest.
+        Returns as soon as everything is spooled locally.
+        """
         if not self.is_connected:
             return False, "Supabase Configuration Missing."
-
         try:
-            # Bucket name must be 'audit-vault' (User created)
-            bucket_name = "audit-vault"
-            
-            # Avoid duplicate overwrite errors by adding timestamp if needed, 
-            # though generic upload usually handles or fails. 
-            # Supabase storage 'upload' fails if file exists. We might use 'upsert' option if available in py lib 
-            # or just let it fail and rename. Let's try upsert logic or simple upload.
-            
-            # Note: storage.from_() returns a StorageFileApi
-            res = self.supabase.storage.from_(bucket_name).upload(
-                path=filename,
-                file=file_content,
-                file_options={"content-type": "application/octet-stream", "upsert": "false"} 
-            )
-            # res usually returns path or id
-            return True, f"Uploaded to {bucket_name}/{filename}"
-            
-        except Exception as e:
-            # Common error: 'The resource already exists'. Attempt rename or specific check?
-            # For this MVP, we just return the error.
-            if "already exists" in str(e):
-                return False, "File already exists in Vault."
-            return False, f"Storage Error: {str(e)}"
+            fileobj.seek(0)
+            digest, size = self.spool.digest(fileobj)
+            fileobj.seek(0)
+            queued = False
+            if not self.spool.has_digest(digest):
+                blob_path, digest, size = self.spool.spool_blob(fileobj)
+                fileobj.seek(0)
+                # Atomic: of two sessions backing up the same file, only one queues it
+                queued = self.spool.add_upload(VAULT_BUCKET, content_object_name(digest), blob_path=blob_path,
+                                               size=size, digest=digest) is not None
+                if not queued:
+                    os.remove(blob_path)
+            if queued:
+                status = "queued"
+            else:
+                self.dedup_hits += 1
+                self.bytes_saved += size
+                status = "already in vault"
+            pointer = {"sha256": digest, "size": size, "object": content_object_name(digest), "filename": filename,
+                       "owner": owner, "updated": datetime.datetime.now().isoformat()}
+            self.spool.add_upload(VAULT_BUCKET, pointer_object_name(owner, filename), data=json.dumps(pointer).encode(),
+                                  upsert=True)
+        except OSError as e:
+            return False, f"Spool Error: {e}"
+        self._wakeup.set()
+        return True, f"Content {status} (sha256 {digest[:12]})"
+
+    def upload_file(self, file_content: bytes, filename: str) -> tuple[bool, str]:
+        """Queues bytes for the vault (see backup_file)."""
+        return self.backup_file(io.BytesIO(file_content), filename)
 
     def log_chat(self, user_name: str, question: str, answer: str) -> tuple[bool, str]:
-        """Logs chat to Supabase 'chat_logs' table."""
+        """Queues a row for the 'chat_logs' table (inserted in batches)."""
         if not self.is_connected:
             return False, "Supabase Configuration Missing."
 
+        data = {
+            "user_name": user_name,
+            "question": question,
+            "answer": answer,
+            "timestamp": datetime.datetime.now().isoformat()
+        }
         try:
-            data = {
-                "user_name": user_name,
-                "question": question,
-                "answer": answer,
-                "timestamp": datetime.datetime.now().isoformat()
-            }
-            self.supabase.table("chat_logs").insert(data).execute()
-            return True, "Log saved to Supabase"
-            
-        except Exception as e:
+            self.spool.add_chat(data)
+        except sqlite3.Error as e:
             return False, f"Log Error: {str(e)}"
+        return True, "Log queued for Supabase"
+
+    def stats(self) -> dict:
+        if self.spool is None:
+            return {}
+        return {**self.spool.stats(), "dedup_hits": self.dedup_hits, "bytes_saved": self.bytes_saved}
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Waits until the spool is drained (or only failed uploads remain). True if drained."""
+        if self.spool is None:
+            return True
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            s = self.spool.stats()
+            if not s["uploads_pending"] and not s["chats_pending"]:
+                return True
+            if self._worker is None:
+                self.process_once()
+            else:
+                self._idle.clear()
+                self._wakeup.set()
+                self._idle.wait(min(0.2, max(deadline - time.monotonic(), 0)))
+        return False
+
+    def close(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout=5)
+        if self.spool is not None:
+            self.http.close()
+
+    # --- background worker ---
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                busy = self.process_once()
+            except Exception as e: # keep the worker alive whatever happens
+                logger.error(f"Cloud worker error: {e}")
+                busy = False
+            if not busy:
+                self._idle.set()
+                self._wakeup.wait(FLUSH_INTERVAL)
+                self._wakeup.clear()
+
+    def process_once(self) -> bool:
+        """Sends one chat batch and one upload. Returns True if anything was sent."""
+        sent = self._flush_chats()
+        upload = self.spool.next_upload()
+        if upload is not None:
+            sent = self._send_upload(upload) or sent
+        return sent
+
+    def _flush_chats(self) -> bool:
+        batch = self.spool.chat_batch(CHAT_BATCH_SIZE)
+        if not batch:
+            return False
+        ids, rows = zip(*batch)
+        try:
+            with span("cloud.log_chat", rows=len(rows)):
+                self.supabase.table("chat_logs").insert(list(rows)).execute()
+        except Exception as e:
+            logger.warning(f"Chat log flush failed ({len(rows)} rows kept in spool): {e}")
+            return False
+        self.spool.remove_chats(list(ids))
+        return True
+
+    def _send_upload(self, upload: dict) -> bool:
+        name = f"{upload['bucket']}/{upload['object_name']}"
+        try:
+            with span("cloud.upload", bytes=upload["size"]) as sp, open(upload["blob_path"], "rb") as f:
+                offset = None
+                if upload["upload_url"]:
+                    offset = self.tus.offset(upload["upload_url"])
+                elif upload["digest"] and self.tus.exists(upload["bucket"], upload["object_name"]):
+                    # Another install (or an earlier run) already stored this content
+                    sp.set(bytes=0, deduplicated=True)
+                    self.dedup_hits += 1
+                    self.bytes_saved += upload["size"]
+                    raise AlreadyExists(name)
+                if offset is None:
+                    url = self.tus.create(upload["bucket"], upload["object_name"], upload["size"],
+                                          upsert=bool(upload["upsert"]))
+                    self.spool.update_upload(upload["id"], upload_url=url)
+                    upload["upload_url"], offset = url, 0
+                sp.set(resumed_at=offset)
+                self.tus.send(upload["upload_url"], f, offset, upload["size"])
+        except AlreadyExists:
+            logger.info(f"Vault object {name} already exists; nothing to send")
+        except FileNotFoundError:
+            logger.error(f"Spooled blob for {name} is missing; dropping queued upload")
+            self.spool.remove_upload(upload["id"], upload["blob_path"])
+            return False
+        except Exception as e:
+            attempts = upload["attempts"] + 1
+            delay = min(MAX_BACKOFF, 2 ** attempts)
+            logger.warning(f"Vault upload {name} failed (attempt {attempts}/{MAX_ATTEMPTS}): {e}")
+            self.spool.update_upload(upload["id"], attempts=attempts, next_try=time.time() + delay,
+                                     error=str(e)[:500], failed=int(attempts >= MAX_ATTEMPTS))
+            return False
+        if upload["digest"]:
+            self.spool.add_digest(upload["digest"], upload["size"])
+        self.spool.remove_upload(upload["id"], upload["blob_path"])
+        return True
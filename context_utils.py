@@ -0,0 +1,198 @@
+import re
+import string
+import logging
+import numpy as np
+import pandas as pd
+from ai_utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Default share of the model context spent on log evidence (Gemini Flash accepts far more)
+DEFAULT_CONTEXT_TOKENS = 100_000
+
+# Columns with at most this many distinct values are dictionary-encoded when it saves space
+DICT_MAX_UNIQUE = 64
+
+RUN_COLUMN = "_n"
+_RUN_NOTE = f"# {RUN_COLUMN} = consecutive identical events collapsed into one line; timestamps shown as first~last."
+
+_TIME_NAME = re.compile(r"time|date", re.IGNORECASE)
+_NEWLINES = re.compile(r"[\r\n]+")
+
+# Room reserved for the summary line, whose length depends on the row counts
+_SUMMARY_RESERVE = 160
+
+class PackedContext:
+    """A log packed into a token budget, plus what made it in."""
+    def __init__(self, text: str, rows: int, total_rows: int, lines: int, token_budget: int,
+                 encoding: str, dictionary_columns: list = None):
+        self.text = text
+        self.rows = rows # source rows/lines covered
+        self.total_rows = total_rows
+        self.lines = lines # data lines emitted (after run-length collapse)
+        self.tokens = estimate_tokens(text)
+        self.token_budget = token_budget
+        self.encoding = encoding
+        self.dictionary_columns = dictionary_columns or []
+
+    @property
+    def truncated(self) -> bool:
+        return self.rows < self.total_rows
+
+    def summary(self) -> str:
+        parts = [f"{self.rows:,} of {self.total_rows:,} rows", f"{self.tokens:,} / {self.token_budget:,} tokens", self.encoding]
+        if self.lines < self.rows:
+            parts.append(f"{self.rows - self.lines:,} repeats collapsed")
+        if self.dictionary_columns:
+            parts.append("dictionary: " + ", ".join(self.dictionary_columns))
+        return " · ".join(parts)
+
+def _time_columns(df: pd.DataFrame) -> list:
+    return [c for c in df.columns
+            if _TIME_NAME.search(str(c)) or pd.api.types.is_datetime64_any_dtype(df[c])]
+
+def collapse_runs(df: pd.DataFrame, time_columns: list):
+    """
+    Collapses consecutive rows that are identical apart from their timestamps.
+    Returns (frame, counts); collapsed timestamps become "first~last".
+    """
+    keys = [c for c in df.columns if c not in time_columns]
+    if len(df) < 2 or not keys:
+        return df.reset_index(drop=True), np.ones(len(df), dtype=np.int64)
+
+    same = np.ones(len(df) - 1, dtype=bool)
+    for col in keys:
+        values = df[col].to_numpy()
+        missing = pd.isna(values)
+        same &= (values[1:] == values[:-1]) | (missing[1:] & missing[:-1])
+    starts = np.flatnonzero(np.r_[True, ~same])
+    counts = np.diff(np.r_[starts, len(df)])
+    if len(starts) == len(df):
+        return df.reset_index(drop=True), counts
+
+    out = df.iloc[starts].reset_index(drop=True)
+    ends = np.r_[starts[1:], len(df)] - 1
+    multi = counts > 1
+    for col in time_columns:
+        first = out[col].astype(str)
+        last = df[col].iloc[ends].astype(str).to_numpy()
+        out[col] = np.where(multi, first + "~" + last, first)
+    return out, counts
+
+def _dictionary_encode(df: pd.DataFrame, skip: list, max_unique: int):
+    """
+    Replaces low-cardinality text columns with short codes where that saves characters.
+    Returns (frame, {column: (codes per row, labels in first-seen order, prefix)}).
+    """
+    encoded, out = {}, df
+    prefixes = iter(string.ascii_uppercase)
+    for col in df.columns:
+        if col in skip or pd.api.types.is_numeric_dtype(df[col]):
+            continue
+        codes, labels = pd.factorize(df[col], sort=False)
+        if not 1 < len(labels) <= max_unique:
+            continue
+        prefix = next(prefixes, None)
+        if prefix is None:
+            break
+        names = [f"{prefix}{i + 1}" for i in range(len(labels))]
+        value_len = np.array([len(str(v)) for v in labels])
+        name_len = np.array([len(n) for n in names])
+        used = codes >= 0
+        saving = (value_len - name_len)[codes[used]].sum() - sum(len(f"{n}={v}; ") for n, v in zip(names, labels))
+        if saving <= 0:
+            continue
+        if out is df:
+            out = df.copy()
+        out[col] = pd.Series(np.array(names, dtype=object)[np.where(used, codes, 0)], index=df.index).where(used)
+        encoded[col] = (codes, labels, prefix)
+    return out, encoded
+
+def _legend_line(col, labels, prefix, count: int) -> str:
+    entries = "; ".join(f"{prefix}{i + 1}={_NEWLINES.sub(' ', str(v))}" for i, v in enumerate(labels[:count]))
+    return f"# {col}: {entries}"
+
+def _pack_frame(df: pd.DataFrame, token_budget: int, dict_max_unique: int, collapse: bool) -> PackedContext:
+    total_rows = len(df)
+    if df.empty:
+        return PackedContext(df.to_csv(index=False), 0, 0, 0, token_budget, "csv")
+
+    text_cols = [c for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])]
+    time_cols = _time_columns(df)
+    if collapse:
+        frame, counts = collapse_runs(df, time_cols)
+    else:
+        frame, counts = df.reset_index(drop=True), np.ones(len(df), dtype=np.int64)
+    if (counts > 1).any():
+        frame = frame.assign(**{RUN_COLUMN: counts})
+
+    frame, encoded = _dictionary_encode(frame, skip=time_cols + [RUN_COLUMN], max_unique=dict_max_unique)
+    # One physical line per row keeps the per-row cost additive
+    for col in text_cols:
+        if col in encoded:
+            continue
+        if pd.api.types.infer_dtype(frame[col], skipna=True) == "string":
+            frame[col] = frame[col].str.replace(_NEWLINES, " ", regex=True)
+        else:
+            frame[col] = frame[col].map(lambda v: _NEWLINES.sub(" ", v) if isinstance(v, str) else v)
+
+    csv_lines = frame.to_csv(index=False, lineterminator="\n").split("\n")
+    header, rows = csv_lines[0], csv_lines[1:len(frame) + 1]
+
+    # Per-line cost = the row itself + legend entries for codes it introduces first
+    cost = np.fromiter((len(r) + 1 for r in rows), dtype=np.int64, count=len(rows))
+    fixed = len(header) + 1 + _SUMMARY_RESERVE
+    for col, (codes, labels, prefix) in encoded.items():
+        fixed += len(f"# {col}: \n")
+        first_seen = pd.Series(codes).drop_duplicates()
+        first_seen = first_seen[first_seen >= 0]
+        entry_len = np.array([len(f"{prefix}{i + 1}={v}; ") for i, v in enumerate(labels)])
+        np.add.at(cost, first_seen.index.to_numpy(), entry_len[first_seen.to_numpy()])
+    if RUN_COLUMN in frame.columns:
+        fixed += len(_RUN_NOTE) + 1
+
+    budget_chars = token_budget * 4
+    n = int(np.searchsorted(np.cumsum(cost), budget_chars - fixed, side="right"))
+    covered = int(counts[:n].sum())
+
+    preamble = [f"# Masked audit log (CSV): rows 1-{covered} of {total_rows}, {n} lines."]
+    if RUN_COLUMN in frame.columns:
+        preamble.append(_RUN_NOTE)
+    for col, (codes, labels, prefix) in encoded.items():
+        used = codes[:n]
+        count = int(used.max()) + 1 if n and (used >= 0).any() else 0
+        preamble.append(_legend_line(col, labels, prefix, count))
+    text = "\n".join(preamble + [header] + rows[:n]) + "\n"
+    return PackedContext(text, covered, total_rows, n, token_budget, "csv", list(encoded))
+
+def _pack_text(text: str, token_budget: int, collapse: bool) -> PackedContext:
+    lines = text.splitlines()
+    total = len(lines)
+    counts = np.ones(total, dtype=np.int64)
+    if collapse and total > 1:
+        values = np.array(lines, dtype=object)
+        starts = np.flatnonzero(np.r_[True, values[1:] != values[:-1]])
+        counts = np.diff(np.r_[starts, total])
+        lines = [f"{values[s]}  [x{c}]" if c > 1 else values[s] for s, c in zip(starts, counts)]
+
+    cost = np.fromiter((len(line) + 1 for line in lines), dtype=np.int64, count=len(lines))
+    n = int(np.searchsorted(np.cumsum(cost), token_budget * 4 - _SUMMARY_RESERVE, side="right"))
+    covered = int(counts[:n].sum())
+    head = f"# Masked audit log: lines 1-{covered} of {total}" + (", repeats shown as [xN]." if n < covered else ".")
+    body = "\n".join([head] + lines[:n]) + "\n"
+    return PackedContext(body, covered, total, n, token_budget, "text")
+
+def pack_context(data, token_budget: int = DEFAULT_CONTEXT_TOKENS, dict_max_unique: int = DICT_MAX_UNIQUE,
+                 collapse: bool = True) -> PackedContext:
+    """
+    Packs an anonymized log (DataFrame or text) into at most token_budget tokens, taking
+    rows from the top until the budget is full. DataFrames are written as CSV with
+    low-cardinality columns dictionary-encoded; consecutive repeated events are
+    collapsed with a count. The result reports the rows and tokens included.
+    """
+    if isinstance(data, pd.DataFrame):
+        packed = _pack_frame(data, token_budget, dict_max_unique, collapse)
+    else:
+        packed = _pack_text(data or "", token_budget, collapse)
+    logger.info(f"Packed context: {packed.summary()}")
+    return packed
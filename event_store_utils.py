@@ -0,0 +1,330 @@
+import os
+import re
+import json
+import sqlite3
+import tempfile
+import threading
+import weakref
+import logging
+import numpy as np
+import pandas as pd
+from schema_utils import resolve_columns, parse_text_log
+from ingest_utils import stream_anonymize, iter_text_chunks, DEFAULT_CHUNK_ROWS
+from prescreen_utils import parse_timestamps
+from context_utils import pack_context, DEFAULT_CONTEXT_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# One row per event, whatever the source file called its columns (see schema_utils.COLUMN_ALIASES)
+EVENT_FIELDS = ["timestamp", "user", "action", "equipment", "status", "department", "detail"]
+# Indexed together with the timestamp, so a filter on one of them also returns rows in time order
+INDEXED_FIELDS = ["user", "equipment", "action", "department"]
+INSERT_CHUNK_ROWS = 50_000
+# Indexes are dropped while a file at least this fraction of the stored events is
+# added, then rebuilt: a bulk index build is faster than indexing row by row
+REBUILD_INDEX_RATIO = 0.3
+# Shortest value that selects rows when it is named in a question
+MIN_MATCH_CHARS = 3
+_DATE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+
+def _remove_db(path: str):
+    for name in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+
+def _time_columns(columns) -> list:
+    return [c for c in columns if resolve_columns([c]).get("timestamp") == c]
+
+def _normalized_timestamps(frame: pd.DataFrame) -> pd.Series:
+    """ISO 8601 text (sorts chronologically); a separate Date and Time column are combined."""
+    columns = _time_columns(frame.columns)
+    if not columns:
+        return pd.Series(None, index=frame.index, dtype=object)
+    values = frame[columns[0]].astype(str)
+    if len(columns) > 1:
+        values = values + " " + frame[columns[1]].astype(str)
+    parsed = parse_timestamps(values)
+    text = np.datetime_as_string(parsed.to_numpy().astype("datetime64[s]"))
+    return pd.Series(text, index=frame.index, dtype=object).where(parsed.notna(), None)
+
+def event_frame(frame: pd.DataFrame) -> tuple:
+    """
+    The EVENT_FIELDS of a table under their canonical names, an "extra" column with the
+    remaining columns as JSON, and the mapping {field: source column} that was used.
+    """
+    resolved = resolve_columns(frame.columns)
+    if resolved.get("detail") == resolved.get("action"):
+        resolved.pop("detail", None) # e.g. AuditMsg: one column, stored once as the action
+    time_columns = _time_columns(frame.columns)
+    if time_columns:
+        resolved["timestamp"] = " + ".join(time_columns)
+
+    events = pd.DataFrame({"timestamp": _normalized_timestamps(frame)}, index=frame.index)
+    for field in EVENT_FIELDS[1:]:
+        column = frame[resolved[field]] if field in resolved else None
+        events[field] = None if column is None else column.astype(str).astype(object).where(column.notna(), None)
+    rest = [c for c in frame.columns if c not in resolved.values() and c not in time_columns]
+    events["extra"] = frame[rest].to_json(orient="records", lines=True, force_ascii=False).split("\n")[:len(frame)] if rest else None
+    return events.reset_index(drop=True), resolved
+
+class EventStore:
+    """
+    Embedded SQLite table of anonymized events from many log files, with every file's
+    columns mapped to the same fields (user, action, equipment, timestamp...). Cross-file
+    lookups (one user across exports, a time window, values shared by several files) are
+    indexed queries. Without a path the database is a temp file removed with the store.
+    """
+    def __init__(self, path: str = None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="events_", suffix=".sqlite")
+            os.close(fd)
+            self._finalizer = weakref.finalize(self, _remove_db, path)
+        else:
+            self._finalizer = None
+        self.path = path
+        self._lock = threading.Lock()
+        self._distinct = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "id INTEGER PRIMARY KEY, name TEXT, digest TEXT UNIQUE, rows INTEGER DEFAULT 0, columns TEXT)"
+        )
+        fields = ", ".join(f'"{f}" TEXT' for f in EVENT_FIELDS)
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS events (source_id INTEGER, row INTEGER, {fields}, extra TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS events_source ON events(source_id, row)")
+        self._create_indexes()
+
+    def _create_indexes(self):
+        self._conn.execute('CREATE INDEX IF NOT EXISTS events_timestamp ON events("timestamp")')
+        for field in INDEXED_FIELDS:
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS events_{field} ON events("{field}", "timestamp")')
+
+    def _drop_indexes(self):
+        for name in ["timestamp"] + INDEXED_FIELDS:
+            self._conn.execute(f"DROP INDEX IF EXISTS events_{name}")
+
+    def close(self):
+        self._conn.close()
+        if self._finalizer is not None:
+            self._finalizer()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+
+    def has(self, digest: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sources WHERE digest = ?", (digest,)).fetchone() is not None
+
+    def add(self, name: str, data, digest: str = None, chunk_rows: int = INSERT_CHUNK_ROWS) -> int:
+        """
+        Adds one anonymized log: a DataFrame, text, or an iterable of DataFrame chunks or
+        lists of text lines. A digest already in the store is not added twice.
+        Returns the number of events added.
+        """
+        digest = digest or name
+        if self.has(digest):
+            return 0
+        chunks = data
+        if isinstance(data, pd.DataFrame):
+            chunks = (data.iloc[i:i + chunk_rows] for i in range(0, len(data), chunk_rows))
+        elif isinstance(data, str):
+            lines = data.splitlines()
+            chunks = (lines[i:i + chunk_rows] for i in range(0, len(lines), chunk_rows))
+
+        with self._lock:
+            stored = self._conn.execute("SELECT COALESCE(SUM(rows), 0) FROM sources").fetchone()[0]
+            cur = self._conn.execute("INSERT OR IGNORE INTO sources (name, digest) VALUES (?, ?)", (name, digest))
+            if not cur.rowcount: # added by another session since the check above
+                return 0
+            source_id = cur.lastrowid
+            rows, mapping, dropped = 0, None, False
+            placeholders = ", ".join("?" * (len(EVENT_FIELDS) + 3))
+            try:
+                for chunk in chunks:
+                    if not isinstance(chunk, pd.DataFrame):
+                        chunk = parse_text_log("\n".join(line.rstrip("\r\n") for line in chunk)).drop(columns="detail")
+                    events, resolved = event_frame(chunk)
+                    mapping = mapping or resolved
+                    events.insert(0, "row", range(rows, rows + len(events)))
+                    events.insert(0, "source_id", source_id)
+                    if not dropped and rows + len(events) >= REBUILD_INDEX_RATIO * stored:
+                        self._drop_indexes()
+                        dropped = True
+                    self._conn.execute("BEGIN")
+                    self._conn.executemany(f"INSERT INTO events VALUES ({placeholders})", events.itertuples(index=False, name=None))
+                    self._conn.execute("COMMIT")
+                    rows += len(events)
+            except Exception:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                self._remove(source_id)
+                raise
+            finally:
+                if dropped:
+                    self._create_indexes()
+            self._conn.execute("UPDATE sources SET rows = ?, columns = ? WHERE id = ?",
+                               (rows, json.dumps(mapping or {}), source_id))
+            self._distinct.clear()
+        return rows
+
+    def add_upload(self, name: str, fileobj, engine, digest: str = None, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                   n_process: int = 1, pdf_workers: int = None, progress_callback=None) -> int:
+        """
+        Masks a CSV/XLSX/TXT/PDF upload chunk by chunk (see ingest_utils.stream_anonymize)
+        and adds the masked rows; only anonymized events reach the store.
+        """
+        if self.has(digest or name):
+            return 0
+        result = stream_anonymize(name, fileobj, engine, chunk_rows=chunk_rows, context_rows=0, n_process=n_process,
+                                  pdf_workers=pdf_workers, progress_callback=progress_callback)
+        try:
+            with open(result.output_path, "rb") as f:
+                if result.data_type == "dataframe":
+                    chunks = pd.read_csv(f, chunksize=chunk_rows, dtype=str, keep_default_na=False, na_values=[""])
+                else:
+                    chunks = iter_text_chunks(f, chunk_rows)
+                return self.add(name, chunks, digest=digest)
+        finally:
+            result.cleanup()
+
+    def _remove(self, source_id: int):
+        self._conn.execute("DELETE FROM events WHERE source_id = ?", (source_id,))
+        self._conn.execute("DELETE FROM sources WHERE id = ?", (source_id,))
+
+    def remove(self, digest: str):
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM sources WHERE digest = ?", (digest,)).fetchone()
+            if row is not None:
+                self._remove(row[0])
+                self._distinct.clear()
+
+    def sources(self) -> pd.DataFrame:
+        """One row per file: name, digest, events and the {field: column} mapping used."""
+        with self._lock:
+            frame = pd.read_sql_query(
+                "SELECT s.id, s.name, s.digest, s.rows, s.columns, MIN(e.timestamp) AS first, MAX(e.timestamp) AS last "
+                "FROM sources s LEFT JOIN events e ON e.source_id = s.id GROUP BY s.id ORDER BY s.id", self._conn
+            )
+        frame["columns"] = frame["columns"].map(lambda c: json.loads(c) if c else {})
+        return frame
+
+    @property
+    def rows(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(rows), 0) FROM sources").fetchone()[0]
+
+    def query(self, where: dict = None, start: str = None, end: str = None, limit: int = None,
+              match_all: bool = True) -> pd.DataFrame:
+        """
+        Events in time order across every file, with the file name as "source".
+        where maps fields to a value or a list of values (all fields must match, or any
+        one with match_all=False); start/end bound the timestamp (ISO text, end exclusive).
+        """
+        clauses, params, matches = [], [], []
+        for field, values in (where or {}).items():
+            if field not in EVENT_FIELDS:
+                raise ValueError(f"Unknown event field: {field}")
+            values = [values] if isinstance(values, str) else list(values)
+            matches.append(f'e."{field}" IN ({", ".join("?" * len(values))})')
+            params += values
+        if matches:
+            clauses.append(" AND ".join(matches) if match_all else f"({' OR '.join(matches)})")
+        if start is not None:
+            clauses.append('e."timestamp" >= ?')
+            params.append(start)
+        if end is not None:
+            clauses.append('e."timestamp" < ?')
+            params.append(end)
+        sql = (
+            "SELECT s.name AS source, e.row, " + ", ".join(f'e."{f}"' for f in EVENT_FIELDS) + ", e.extra "
+            "FROM events e JOIN sources s ON s.id = e.source_id"
+            + (" WHERE " + " AND ".join(clauses) if clauses else "")
+            + ' ORDER BY e."timestamp", e.source_id, e.row'
+            + (" LIMIT ?" if limit else "")
+        )
+        if limit:
+            params.append(int(limit))
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=params)
+
+    def distinct(self, field: str) -> list:
+        """Distinct values of an indexed field (read from its index, remembered until the next add)."""
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"Not an indexed field: {field}")
+        if field not in self._distinct:
+            with self._lock:
+                rows = self._conn.execute(f'SELECT DISTINCT "{field}" FROM events WHERE "{field}" IS NOT NULL').fetchall()
+            self._distinct[field] = [r[0] for r in rows]
+        return self._distinct[field]
+
+    def shared_values(self, field: str, min_sources: int = 2, limit: int = 100) -> pd.DataFrame:
+        """Values of an indexed field that occur in at least min_sources files (e.g. one user in several exports)."""
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"Not an indexed field: {field}")
+        sql = (
+            f'SELECT e."{field}" AS value, COUNT(DISTINCT e.source_id) AS files, COUNT(*) AS events, '
+            "MIN(e.timestamp) AS first, MAX(e.timestamp) AS last, GROUP_CONCAT(DISTINCT s.name) AS sources "
+            f'FROM events e JOIN sources s ON s.id = e.source_id WHERE e."{field}" IS NOT NULL '
+            f'GROUP BY e."{field}" HAVING files >= ? ORDER BY files DESC, events DESC LIMIT ?'
+        )
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=(min_sources, limit))
+
+    def question_filters(self, question: str) -> tuple:
+        """
+        Conditions named in a question: values of the indexed fields (whole-word,
+        case-insensitive) and ISO dates. Returns (where, start, end).
+        """
+        where = {}
+        for field in INDEXED_FIELDS:
+            hits = [v for v in self.distinct(field) if len(v) >= MIN_MATCH_CHARS
+                    and re.search(rf"(?<!\w){re.escape(v)}(?!\w)", question, re.IGNORECASE)]
+            if hits:
+                where[field] = hits
+        days = sorted(_DATE.findall(question))
+        start = end = None
+        if days:
+            start = days[0]
+            end = (pd.Timestamp(days[-1]) + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+        return where, start, end
+
+    def context(self, question: str = "", token_budget: int = DEFAULT_CONTEXT_TOKENS) -> tuple:
+        """
+        Gemini context over every file: the files and their mapped columns, values shared
+        across files, then events in time order (only those matching the values and dates
+        named in the question, if any). Returns (text, summary).
+        """
+        max_rows = max(5000, token_budget // 10)
+        where, start, end = self.question_filters(question) if question else ({}, None, None)
+        selection = [f"{f} = {', '.join(v)}" for f, v in where.items()]
+        if start:
+            selection.append(f"{start} <= timestamp < {end}")
+        events = self.query(where, start, end, limit=max_rows)
+        if events.empty and len(where) > 1:
+            selection.append("no event matches all of these, showing events matching any of them")
+            events = self.query(where, start, end, limit=max_rows, match_all=False)
+        if events.empty and selection:
+            selection.append("no event matches, showing every file instead")
+            events = self.query(limit=max_rows)
+
+        sources = self.sources()
+        lines = [f"### UNIFIED EVENT TABLE ({len(sources)} files, {int(sources['rows'].sum()):,} anonymized events; "
+                 "columns normalized to timestamp/user/action/equipment/status/department/detail)"]
+        for s in sources.itertuples():
+            mapped = ", ".join(f"{k}={v}" for k, v in s.columns.items())
+            lines.append(f"- {s.name}: {s.rows:,} events, {s.first} to {s.last} ({mapped})")
+        for field in INDEXED_FIELDS:
+            shared = self.shared_values(field, limit=10)
+            if not shared.empty:
+                lines.append(f"- {field} values in several files: "
+                             + "; ".join(f"{r.value} ({r.files} files, {r.events:,} events)" for r in shared.itertuples()))
+        lines.append(f"- Selection: {'; '.join(selection) if selection else 'all events in time order'}\n")
+        header = "\n".join(lines) + "\n"
+
+        events = events.drop(columns=["row"]).dropna(axis=1, how="all")
+        packed = pack_context(events, token_budget=max(token_budget - len(header) // 4, 1000))
+        summary = f"{len(sources)} files; {len(events):,} events selected" + (f" ({'; '.join(selection)})" if selection else "")
+        return header + packed.text, f"{summary}; {packed.summary()}"
@@ -0,0 +1,162 @@
+"""
+Local stand-in for the Gemini REST API (generateContent / streamGenerateContent).
+
+Enforces its own requests-per-minute quota and answers 429 with a Retry-After header,
+so the scheduler and streaming UI can be load-tested without real quota.
+
+Usage:
+    python fake_gemini_server.py --port 8765 --rpm 60 --latency 0.5
+    GEMINI_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=fake streamlit run app.py
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_PATH = re.compile(r"/v1beta/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)")
+
+class FakeGemini:
+    """Server state: quota window, latency and counters."""
+    def __init__(self, rpm: int = 60, latency: float = 0.2, stream_chunks: int = 5, reply: str = None,
+                 window: float = 60.0):
+        self.rpm = rpm
+        self.window = window # quota window in seconds (shorten for tests)
+        self.latency = latency
+        self.stream_chunks = stream_chunks
+        self.reply = reply
+        self.requests = 0
+        self.rejected = 0
+        self.completed = 0
+        self.cancelled = 0
+        self._window = deque()
+        self._lock = threading.Lock()
+
+    def admit(self) -> float:
+        """Returns 0 if the request fits the quota, else seconds until it would."""
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            while self._window and now - self._window[0] >= self.window:
+                self._window.popleft()
+            if self.rpm and len(self._window) >= self.rpm:
+                self.rejected += 1
+                return self.window - (now - self._window[0])
+            self._window.append(now)
+            return 0.0
+
+    def answer(self, body: dict) -> str:
+        if self.reply is not None:
+            return self.reply
+        parts = [p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", [])]
+        chars = sum(len(p) for p in parts)
+        return (
+            "#### 1. Compliance Summary\n- Assessment: MINOR OBSERVATION\n"
+            f"- Reviewed {chars} characters of masked audit trail (fake backend).\n"
+        )
+
+def _response_json(text: str, finish: bool = True) -> dict:
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    return {
+        "candidates": [candidate],
+        "usageMetadata": {"promptTokenCount": 0, "candidatesTokenCount": len(text) // 4, "totalTokenCount": len(text) // 4},
+    }
+
+def make_handler(state: FakeGemini):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, code: int, payload: dict, headers: dict = None):
+            data = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            match = _PATH.search(self.path)
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not match:
+                self._send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+                return
+
+            wait = state.admit()
+            if wait:
+                self._send_json(
+                    429,
+                    {"error": {"code": 429, "message": "Quota exceeded (fake)", "status": "RESOURCE_EXHAUSTED",
+                               "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo",
+                                            "retryDelay": f"{wait:.3f}s"}]}},
+                    headers={"Retry-After": f"{wait:.3f}"},
+                )
+                return
+
+            text = state.answer(body)
+            if match.group("method") == "generateContent":
+                time.sleep(state.latency)
+                self._send_json(200, _response_json(text))
+                with state._lock:
+                    state.completed += 1
+                return
+
+            # Server-sent events, one chunk every latency/stream_chunks seconds
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            n = max(state.stream_chunks, 1)
+            step = -(-len(text) // n)
+            try:
+                for i in range(0, len(text), step):
+                    time.sleep(state.latency / n)
+                    last = i + step >= len(text)
+                    event = json.dumps(_response_json(text[i:i + step], finish=last))
+                    self.wfile.write(f"data: {event}\r\n\r\n".encode())
+                    self.wfile.flush()
+                with state._lock:
+                    state.completed += 1
+            except (BrokenPipeError, ConnectionResetError):
+                # Client cancelled mid-stream
+                with state._lock:
+                    state.cancelled += 1
+            self.close_connection = True
+
+    return Handler
+
+def start_server(port: int = 0, **kwargs):
+    """Starts the fake server on a background thread. Returns (server, state, base_url)."""
+    state = FakeGemini(**kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rpm", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    server, state, url = start_server(args.port, rpm=args.rpm, latency=args.latency)
+    print(f"Fake Gemini listening on {url} (rpm={args.rpm}, latency={args.latency}s)")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"requests={state.requests} completed={state.completed} rejected={state.rejected} cancelled={state.cancelled}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
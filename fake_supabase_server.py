@@ -0,0 +1,207 @@
+"""
+Local stand-in for the Supabase APIs CloudManager uses: Storage (object upload/HEAD
+and TUS resumable uploads at /storage/v1/upload/resumable) and PostgREST inserts.
+
+Objects and rows are kept in memory. fail_next(n) makes the next n requests fail
+with 503 and offline=True fails everything, so retries, resume and the local
+spool can be tested without a Supabase project.
+
+Usage:
+    python fake_supabase_server.py --port 8766
+    SUPABASE_URL=http://127.0.0.1:8766 SUPABASE_KEY=fake.fake.fake streamlit run app.py
+"""
+import argparse
+import base64
+import itertools
+import json
+import re
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+_OBJECT = re.compile(r"^/storage/v1/object/(?P<bucket>[^/]+)/(?P<path>.+)$")
+_TUS = re.compile(r"^/storage/v1/upload/resumable(?:/(?P<id>[\w-]+))?$")
+_TABLE = re.compile(r"^/rest/v1/(?P<table>\w+)")
+
+class FakeSupabase:
+    """Server state: stored objects, table rows, open TUS uploads and counters."""
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.objects = {} # (bucket, path) -> bytes
+        self.rows = {} # table -> [row]
+        self.uploads = {} # tus id -> {"bucket", "path", "length", "data"}
+        self.requests = 0
+        self.bytes_received = 0
+        self.patches = 0
+        self.inserts = 0
+        self.offline = False
+        self._failures = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def fail_next(self, n: int = 1):
+        with self._lock:
+            self._failures += n
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            if self.offline:
+                return True
+            if self._failures:
+                self._failures -= 1
+                return True
+            return False
+
+def _metadata(header: str) -> dict:
+    """Decodes a TUS Upload-Metadata header ("key base64value, ...")."""
+    out = {}
+    for item in filter(None, (p.strip() for p in (header or "").split(","))):
+        key, _, value = item.partition(" ")
+        out[key] = base64.b64decode(value).decode() if value else ""
+    return out
+
+def _file_part(body: bytes, content_type: str) -> bytes:
+    """The "file" field of a multipart/form-data body (storage3 uploads), else the body itself."""
+    if not content_type.startswith("multipart/form-data"):
+        return body
+    message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    for part in message.get_payload():
+        if part.get_param("name", header="content-disposition") == "file":
+            return part.get_payload(decode=True)
+    return b""
+
+def make_handler(state: FakeSupabase):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _send(self, code: int, payload=None, headers: dict = None):
+            data = json.dumps(payload).encode() if payload is not None else b""
+            self.send_response(code)
+            if payload is not None:
+                self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Tus-Resumable", "1.0.0")
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _unavailable(self) -> bool:
+            time.sleep(state.latency)
+            if state._should_fail():
+                self._body()
+                self._send(503, {"statusCode": "503", "error": "Unavailable", "message": "fake outage"})
+                return True
+            return False
+
+        def do_HEAD(self):
+            if self._unavailable():
+                return
+            tus, obj = _TUS.match(self.path), _OBJECT.match(self.path.split("?")[0])
+            if tus and tus.group("id"):
+                upload = state.uploads.get(tus.group("id"))
+                if upload is None:
+                    self._send(404)
+                else:
+                    self._send(200, headers={"Upload-Offset": str(len(upload["data"])),
+                                             "Upload-Length": str(upload["length"]), "Cache-Control": "no-store"})
+            elif obj:
+                key = (obj.group("bucket"), unquote(obj.group("path")))
+                self._send(200 if key in state.objects else 404)
+            else:
+                self._send(404)
+
+        def do_POST(self):
+            if self._unavailable():
+                return
+            path = self.path.split("?")[0]
+            tus, obj, table = _TUS.match(path), _OBJECT.match(path), _TABLE.match(path)
+            upsert = self.headers.get("x-upsert", "false").lower() == "true"
+            if tus and not tus.group("id"):
+                self._body()
+                meta = _metadata(self.headers.get("Upload-Metadata"))
+                key = (meta.get("bucketName"), meta.get("objectName"))
+                if key in state.objects and not upsert:
+                    self._send(409, {"statusCode": "409", "error": "Duplicate", "message": "The resource already exists"})
+                    return
+                upload_id = f"u{next(state._ids)}"
+                state.uploads[upload_id] = {"bucket": key[0], "path": key[1], "data": bytearray(),
+                                            "length": int(self.headers.get("Upload-Length", 0))}
+                host = self.headers.get("Host")
+                self._send(201, headers={"Location": f"http://{host}/storage/v1/upload/resumable/{upload_id}"})
+            elif obj:
+                data = _file_part(self._body(), self.headers.get("Content-Type", ""))
+                key = (obj.group("bucket"), unquote(obj.group("path")))
+                if key in state.objects and not upsert:
+                    self._send(400, {"statusCode": "409", "error": "Duplicate", "message": "The resource already exists"})
+                    return
+                state.objects[key] = data
+                state.bytes_received += len(data)
+                self._send(200, {"Key": f"{key[0]}/{key[1]}", "Id": f"o{next(state._ids)}"})
+            elif table:
+                rows = json.loads(self._body() or b"[]")
+                rows = rows if isinstance(rows, list) else [rows]
+                with state._lock:
+                    state.rows.setdefault(table.group("table"), []).extend(rows)
+                    state.inserts += 1
+                self._send(201, rows)
+            else:
+                self._body()
+                self._send(404, {"message": "Not found"})
+
+        def do_PATCH(self):
+            if self._unavailable():
+                return
+            tus = _TUS.match(self.path)
+            data = self._body()
+            upload = state.uploads.get(tus.group("id")) if tus and tus.group("id") else None
+            if upload is None:
+                self._send(404)
+                return
+            if int(self.headers.get("Upload-Offset", -1)) != len(upload["data"]):
+                self._send(409, {"message": "Upload-Offset mismatch"})
+                return
+            upload["data"] += data
+            state.bytes_received += len(data)
+            state.patches += 1
+            if len(upload["data"]) >= upload["length"]:
+                state.objects[(upload["bucket"], upload["path"])] = bytes(upload["data"])
+            self._send(204, headers={"Upload-Offset": str(len(upload["data"]))})
+
+    return Handler
+
+def start_server(port: int = 0, **kwargs):
+    """Starts the fake server on a background thread. Returns (server, state, base_url)."""
+    state = FakeSupabase(**kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, state, url = start_server(args.port, latency=args.latency)
+    print(f"Fake Supabase listening on {url}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"requests={state.requests} objects={len(state.objects)} bytes={state.bytes_received} "
+                  f"rows={sum(len(r) for r in state.rows.values())}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,34 @@
-import pandas as pd
-import random
-from faker import Faker
-from fpdf import FPDF
+"""
+Synthetic GMP audit-trail generator (CSV / XLSX / TXT / PDF).
+
+Rows are generated in vectorized chunks and streamed to disk, so files can hold
+millions of rows or thousands of PDF pages with bounded memory. Baseline activity is
+clean (chronological, business hours, named accounts, no destructive actions);
+a configurable share of rows carries an injected ALCOA+ violation.
+
+Usage:
+    python generate_large_test_data.py                                   # 20 mixed files x 250 rows
+    python generate_large_test_data.py --files 1 --rows 2000000 --formats csv --violation-density 0.01
+    python generate_large_test_data.py --files 1 --formats pdf --pdf-pages 5000
+"""
+import argparse
+import json
 import os
+import random
+import zlib
 
-fake = Faker()
-Faker.seed(42)
+import numpy as np
+import pandas as pd
+from faker import Faker
 
 OUTPUT_DIR = "test_data_large"
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
 
 # --- Configuration ---
 NUM_FILES = 20
 ROWS_PER_FILE = 250
+CHUNK_ROWS = 50_000
+LINES_PER_PAGE = 60
+XLSX_MAX_ROWS = 1_048_575
 
 # Equipment and Process Lists for GMP context
 EQUIPMENT = ['HPLC-01', 'HPLC-02', 'GC-05', 'Balance-03', 'Bioreactor-100L', 'Mixer-200L', 'TabletPress-A', 'Autoclave-01']
@@ -21,65 +36,274 @@ ACTIONS = ['Login', 'Logout', 'Start Sequence', 'Stop Sequence', 'Abort', 'Data
 DEPARTMENTS = ['QC Lab', 'Production', 'Warehouse', 'IT Security', 'QA Assurance']
 ERROR_MSGS = ['Connection Timeout', 'Value Out of Spec', 'Integrity Violation', 'Disk Full', 'User Locked', 'Authorized Access']
 
-def generate_csv_excel(filename, file_type):
-    data = []
-    for _ in range(ROWS_PER_FILE):
-        data.append({
-            'Timestamp': fake.date_time_this_year().isoformat(),
-            'User_ID': fake.user_name(),
-            'Full_Name': fake.name(), # PII
-            'IP_Address': fake.ipv4(), # PII
-            'Equipment_ID': random.choice(EQUIPMENT),
-            'Action_Type': random.choice(ACTIONS),
-            'Department': random.choice(DEPARTMENTS),
-            'Detail': f"{random.choice(ACTIONS)} executed on {random.choice(EQUIPMENT)}. Status: {random.choice(['Success', 'Fail'])}. Msg: {fake.sentence()}"
+# Baseline rows only use actions that no pre-screen rule flags
+CLEAN_ACTIONS = ['Login', 'Logout', 'Start Sequence', 'Stop Sequence', 'Data Save', 'Parameter Change', 'Audit Trail Review']
+GENERIC_ACCOUNTS = ['admin', 'Admin', 'administrator', 'user1', 'test', 'system']
+
+# Injected ALCOA+ violations (names match prescreen_utils.RULES)
+VIOLATIONS = ['data_deletion', 'generic_account', 'off_hours', 'non_chronological', 'abort_then_pass', 'audit_trail_change']
+
+COLUMNS = ['Timestamp', 'User_ID', 'Full_Name', 'IP_Address', 'Equipment_ID', 'Action_Type', 'Department', 'Detail']
+ALIASES = {'User_ID': 'Operator', 'Action_Type': 'Event', 'Timestamp': 'DateTime'}
+
+BUSINESS_START = 8 * 3600
+BUSINESS_SECONDS = 10 * 3600 # 08:00-18:00, Monday-Friday
+
+class Pools:
+    """Faker values drawn once; rows sample from them (Faker per row is the bottleneck)."""
+    def __init__(self, seed: int = 42, size: int = 2000):
+        fake = Faker()
+        Faker.seed(seed)
+        self.users = np.array([fake.user_name() for _ in range(size)], dtype=object)
+        self.names = np.array([fake.name() for _ in range(size)], dtype=object)
+        self.ips = np.array([fake.ipv4() for _ in range(size)], dtype=object)
+        self.sentences = np.array([fake.sentence() for _ in range(size)], dtype=object)
+
+def _business_time(seconds: np.ndarray, start: np.datetime64) -> np.ndarray:
+    """Maps seconds of business time since start (a Monday) onto calendar timestamps."""
+    day = seconds // BUSINESS_SECONDS
+    calendar_day = (day // 5) * 7 + day % 5
+    return start + (calendar_day * 86400 + BUSINESS_START + seconds % BUSINESS_SECONDS).astype("timedelta64[s]")
+
+def generate_chunks(rows: int, density: float = 0.0, seed: int = 42, chunk_rows: int = CHUNK_ROWS,
+                    pools: Pools = None, start: str = "2026-01-05"):
+    """
+    Yields (DataFrame, violation) chunks totalling rows rows. violation holds the injected
+    violation name per row ("" for clean rows); abort_then_pass is marked on the passing row.
+    """
+    rng = np.random.default_rng(seed)
+    pools = pools or Pools(seed)
+    start = np.datetime64(start, "s")
+    clock = 0
+    for offset in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - offset)
+        seconds = clock + np.cumsum(rng.integers(1, 120, n))
+        clock = int(seconds[-1])
+        ts = _business_time(seconds, start)
+        base = ts.copy()
+
+        user = pools.users[rng.integers(0, len(pools.users), n)]
+        action = np.array(CLEAN_ACTIONS, dtype=object)[rng.integers(0, len(CLEAN_ACTIONS), n)]
+        equipment = np.array(EQUIPMENT, dtype=object)[rng.integers(0, len(EQUIPMENT), n)]
+        status = np.where(rng.random(n) < 0.8, "Success", "Fail").astype(object)
+
+        violation = np.full(n, "", dtype=object)
+        busy = np.zeros(n, dtype=bool) # rows already used by an injected pattern
+        picked = np.flatnonzero(rng.random(n) < density)
+        kinds = np.array(VIOLATIONS, dtype=object)[rng.integers(0, len(VIOLATIONS), len(picked))]
+        # abort_then_pass first: it also claims the two preceding rows
+        for kind in ['abort_then_pass'] + [k for k in VIOLATIONS if k != 'abort_then_pass']:
+            rows_k = picked[kinds == kind]
+            rows_k = rows_k[~busy[rows_k]]
+            if kind == 'abort_then_pass':
+                # Two aborts on one instrument, then a passing run on it
+                rows_k = rows_k[rows_k >= 2]
+                rows_k = rows_k[~busy[rows_k - 1] & ~busy[rows_k - 2] & (np.diff(rows_k, prepend=-3) >= 3)]
+                for shift in (2, 1):
+                    action[rows_k - shift] = 'Abort'
+                    equipment[rows_k - shift] = equipment[rows_k]
+                    busy[rows_k - shift] = True
+                status[rows_k] = "Success"
+            elif kind == 'data_deletion':
+                action[rows_k] = 'Delete File'
+            elif kind == 'audit_trail_change':
+                action[rows_k] = 'Audit Trail Disabled'
+            elif kind == 'generic_account':
+                user[rows_k] = np.array(GENERIC_ACCOUNTS, dtype=object)[rng.integers(0, len(GENERIC_ACCOUNTS), len(rows_k))]
+            elif kind == 'off_hours':
+                day = ts[rows_k].astype("datetime64[D]")
+                ts[rows_k] = day + rng.integers(3600, 6 * 3600, len(rows_k)).astype("timedelta64[s]")
+            elif kind == 'non_chronological':
+                rows_k = rows_k[rows_k >= 1]
+                # Before both preceding rows (gaps are < 2 min) but still within business hours
+                ts[rows_k] = base[rows_k - 1] - rng.integers(120, 600, len(rows_k)).astype("timedelta64[s]")
+            violation[rows_k] = kind
+            busy[rows_k] = True
+
+        frame = pd.DataFrame({
+            'Timestamp': np.datetime_as_string(ts, unit="s"),
+            'User_ID': user,
+            'Full_Name': pools.names[rng.integers(0, len(pools.names), n)],
+            'IP_Address': pools.ips[rng.integers(0, len(pools.ips), n)],
+            'Equipment_ID': equipment,
+            'Action_Type': action,
+            'Department': np.array(DEPARTMENTS, dtype=object)[rng.integers(0, len(DEPARTMENTS), n)],
         })
-    
-    df = pd.DataFrame(data)
-    
-    # Randomly rename columns to simulate diversity
-    if random.choice([True, False]):
-        df.rename(columns={'User_ID': 'Operator', 'Action_Type': 'Event', 'Timestamp': 'DateTime'}, inplace=True)
-    
-    if file_type == 'csv':
-        df.to_csv(os.path.join(OUTPUT_DIR, filename), index=False)
+        sentences = pools.sentences[rng.integers(0, len(pools.sentences), n)]
+        frame['Detail'] = frame['Action_Type'] + " executed on " + frame['Equipment_ID'] + ". Status: " + status + ". Msg: " + sentences
+        yield frame, violation
+
+def write_csv(path: str, chunks, aliases: dict = None) -> int:
+    rows = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for frame, _ in chunks:
+            frame.rename(columns=aliases or {}).to_csv(f, index=False, header=rows == 0)
+            rows += len(frame)
+    return rows
+
+def write_xlsx(path: str, chunks, aliases: dict = None, sheets: int = 1) -> int:
+    """sheets > 1 repeats the log on extra sheets (multi-sheet LIMS exports)."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    worksheets = [wb.create_sheet(title="AuditTrail" if i == 0 else f"AuditTrail_{i + 1}") for i in range(sheets)]
+    for ws in worksheets:
+        ws.append([(aliases or {}).get(c, c) for c in COLUMNS])
+    rows = 0
+    for frame, _ in chunks:
+        for record in frame.itertuples(index=False, name=None):
+            if rows >= XLSX_MAX_ROWS:
+                break
+            for ws in worksheets:
+                ws.append(record)
+            rows += 1
+    wb.save(path)
+    return rows
+
+def _text_lines(frame: pd.DataFrame, rng: np.random.Generator) -> pd.Series:
+    severity = np.array(['INFO', 'WARN', 'ERROR'], dtype=object)[rng.integers(0, 3, len(frame))]
+    return ("[" + frame['Timestamp'].str.replace("T", " ") + "] [Sev: " + severity + "] User:" + frame['User_ID']
+            + " (" + frame['IP_Address'] + ") performed " + frame['Action_Type'] + " on " + frame['Equipment_ID']
+            + ". Details: " + frame['Detail'].str.split(" executed on ").str[-1].str.split(". ", n=1).str[-1])
+
+def write_txt(path: str, chunks, seed: int = 42) -> int:
+    rng = np.random.default_rng(seed)
+    rows = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for frame, _ in chunks:
+            f.write("\n".join(_text_lines(frame, rng)) + "\n")
+            rows += len(frame)
+    return rows
+
+class StreamingPdf:
+    """
+    Minimal PDF writer that emits each page as soon as it is full (Helvetica text only).
+    FPDF keeps the whole document in memory, which caps practical sizes at a few hundred pages.
+    """
+    def __init__(self, path: str, font_size: int = 8):
+        self.f = open(path, "wb")
+        self.font_size = font_size
+        self.offsets = {}
+        self.pages = []
+        self._write(b"%PDF-1.4\n")
+        # 1 = catalog, 2 = page tree (written last), 3 = font
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        self._object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        self.next_id = 4
+
+    def _write(self, data: bytes):
+        self.f.write(data)
+
+    def _object(self, obj_id: int, body: bytes):
+        self.offsets[obj_id] = self.f.tell()
+        self._write(b"%d 0 obj\n" % obj_id + body + b"\nendobj\n")
+
+    @staticmethod
+    def _escape(text: str) -> bytes:
+        text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        return text.encode("cp1252", "replace")
+
+    def add_page(self, lines: list):
+        leading = self.font_size + 4
+        body = b"BT /F1 %d Tf %d TL 36 806 Td " % (self.font_size, leading)
+        body += b" T* ".join(b"(" + self._escape(line) + b") Tj" for line in lines) + b" ET"
+        stream = zlib.compress(body)
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self._object(content_id, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        self._object(page_id, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                              b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        self.pages.append(page_id)
+
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % p for p in self.pages)
+        self._object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.pages)))
+        xref = self.f.tell()
+        size = self.next_id
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for obj_id in range(1, size):
+            self._write(b"%010d 00000 n \n" % self.offsets[obj_id])
+        self._write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref))
+        self.f.close()
+
+def write_pdf(path: str, chunks, title: str = None) -> int:
+    pdf = StreamingPdf(path)
+    page = [f"Audit Report - {title or os.path.basename(path)}"]
+    rows = 0
+    for frame, violation in chunks:
+        result = np.where(frame['Detail'].str.contains("Status: Success", regex=False), "Pass", "Fail")
+        # Reports print full names, except where a shared account signed the entry
+        user = frame['Full_Name'].where(violation != 'generic_account', frame['User_ID'])
+        lines = ("[" + frame['Timestamp'].str.replace("T", " ") + "] User: '" + user + "' performed "
+                 + frame['Action_Type'] + " on " + frame['Equipment_ID'] + ". Result: " + result)
+        for line in lines:
+            page.append(line)
+            if len(page) == LINES_PER_PAGE:
+                pdf.add_page(page)
+                page = []
+        rows += len(frame)
+    if page:
+        pdf.add_page(page)
+    pdf.close()
+    return rows
+
+def generate_file(path: str, fmt: str, rows: int, density: float = 0.0, seed: int = 42,
+                  aliases: dict = None, pools: Pools = None, sheets: int = 1) -> dict:
+    """Writes one file and returns {path, format, rows, violations: {kind: count}}."""
+    counts = dict.fromkeys(VIOLATIONS, 0)
+    if fmt == 'xlsx':
+        rows = min(rows, XLSX_MAX_ROWS)
+
+    def counted():
+        for frame, violation in generate_chunks(rows, density=density, seed=seed, pools=pools):
+            kinds, n = np.unique(violation[violation != ""], return_counts=True)
+            for kind, k in zip(kinds, n):
+                counts[kind] += int(k)
+            yield frame, violation
+
+    if fmt == 'csv':
+        written = write_csv(path, counted(), aliases)
+    elif fmt == 'xlsx':
+        written = write_xlsx(path, counted(), aliases, sheets)
+    elif fmt == 'txt':
+        written = write_txt(path, counted(), seed)
+    elif fmt == 'pdf':
+        written = write_pdf(path, counted())
     else:
-        df.to_excel(os.path.join(OUTPUT_DIR, filename), index=False)
-
-def generate_txt(filename):
-    with open(os.path.join(OUTPUT_DIR, filename), 'w', encoding='utf-8') as f:
-        for _ in range(ROWS_PER_FILE):
-            line = f"[{fake.date_time_this_year()}] [Sev: {random.choice(['INFO', 'WARN', 'ERROR'])}] User:{fake.user_name()} ({fake.ipv4()}) performed {random.choice(ACTIONS)} on {random.choice(EQUIPMENT)}. Details: {fake.sentence()}\n"
-            f.write(line)
-
-def generate_pdf(filename):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=10)
-    pdf.cell(200, 10, txt=f"Audit Report - {filename}", ln=1, align='C')
-    
-    for i in range(1, 50): # PDF logic is slow, limit pages/lines for prototype but enough to test
-        line = f"{i}. [{fake.date()}] User: {fake.name()} accessed {random.choice(EQUIPMENT)}. Result: {random.choice(['Pass', 'Fail'])}"
-        pdf.cell(0, 10, txt=line, ln=1)
-        
-    pdf.output(os.path.join(OUTPUT_DIR, filename))
-
-# --- Main Generation Loop ---
-print(f"Generating {NUM_FILES} files in {OUTPUT_DIR}...")
-
-for i in range(1, NUM_FILES + 1):
-    ftype = random.choice(['csv', 'xlsx', 'txt', 'pdf'])
-    fname = f"mock_audit_log_{i:02d}_{random.choice(DEPARTMENTS).replace(' ', '_')}.{ftype}"
-    
-    if ftype == 'csv':
-        generate_csv_excel(fname, 'csv')
-    elif ftype == 'xlsx':
-        generate_csv_excel(fname, 'xlsx')
-    elif ftype == 'txt':
-        generate_txt(fname)
-    elif ftype == 'pdf':
-        generate_pdf(fname)
-        
-    print(f"Created: {fname}")
-
-print("Done!")
+        raise ValueError(f"Unknown format: {fmt}")
+    return {"path": path, "format": fmt, "rows": written, "violations": counts}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out-dir", default=OUTPUT_DIR)
+    parser.add_argument("--files", type=int, default=NUM_FILES)
+    parser.add_argument("--rows", type=int, default=ROWS_PER_FILE, help="Rows (log lines) per CSV/XLSX/TXT file")
+    parser.add_argument("--pdf-pages", type=int, default=None, help=f"Pages per PDF ({LINES_PER_PAGE} lines each; default: from --rows)")
+    parser.add_argument("--formats", nargs="+", default=['csv', 'xlsx', 'txt', 'pdf'], choices=['csv', 'xlsx', 'txt', 'pdf'])
+    parser.add_argument("--violation-density", type=float, default=0.02, help="Share of rows with an injected violation")
+    parser.add_argument("--alias-ratio", type=float, default=0.5, help="Share of tabular files using Operator/Event/DateTime headers")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    os.makedirs(args.out_dir, exist_ok=True)
+    pools = Pools(args.seed)
+    print(f"Generating {args.files} files in {args.out_dir}...")
+
+    manifest = []
+    for i in range(1, args.files + 1):
+        ftype = random.choice(args.formats)
+        fname = f"mock_audit_log_{i:02d}_{random.choice(DEPARTMENTS).replace(' ', '_')}.{ftype}"
+        # Randomly rename columns to simulate diversity
+        aliases = ALIASES if random.random() < args.alias_ratio else None
+        rows = args.pdf_pages * LINES_PER_PAGE if ftype == 'pdf' and args.pdf_pages else args.rows
+        info = generate_file(os.path.join(args.out_dir, fname), ftype, rows, density=args.violation_density,
+                             seed=args.seed + i, aliases=aliases, pools=pools)
+        manifest.append(info)
+        print(f"Created: {fname} ({info['rows']:,} rows, {sum(info['violations'].values()):,} violations)")
+
+    with open(os.path.join(args.out_dir, "generation_manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+import io
+import os
+import time
+import tempfile
+import weakref
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from template_utils import mine_lines
+
+try:
+    from python_calamine import CalamineWorkbook # optional native (Rust) reader, much faster than openpyxl
+except ImportError:
+    CalamineWorkbook = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_ROWS = 20_000
+DEFAULT_CHUNK_LINES = 5_000
+# Distinct values whose masks a stream keeps for later chunks; past this the map starts over
+STREAM_MASK_MAP_MAX = 200_000
+
+# Uploads above this size default to the streaming path in the app
+STREAMING_THRESHOLD_BYTES = 50 * 1024 * 1024
+
+# Lean mode: string columns with at most this share of distinct values are kept as
+# categoricals (small integer codes plus one copy of each value)
+LEAN_CATEGORY_RATIO = 0.5
+# Rows shown by the Original view when it is read back from the upload
+PREVIEW_ROWS = 100
+
+# Below this many pages a process pool costs more than it saves
+PDF_PARALLEL_MIN_PAGES = 16
+PDF_PAGES_PER_TASK = 8
+
+def file_extension(filename: str) -> str:
+    return filename.split('.')[-1].lower()
+
+_pdf_reader = None
+
+def _init_pdf_worker(data: bytes):
+    """Process pool initializer: each worker parses the PDF structure once."""
+    global _pdf_reader
+    import pypdf
+    _pdf_reader = pypdf.PdfReader(io.BytesIO(data))
+
+def _extract_pdf_pages(page_numbers) -> list:
+    """Process pool worker: returns [(page_no, text, seconds)] for a run of pages."""
+    out = []
+    for page_no in page_numbers:
+        start = time.perf_counter()
+        text = _pdf_reader.pages[page_no].extract_text() or ""
+        out.append((page_no, text, time.perf_counter() - start))
+    return out
+
+def iter_pdf_pages(fileobj, max_workers: int = None, pages_per_task: int = PDF_PAGES_PER_TASK):
+    """
+    Yields (page_no, text, seconds) as pages finish extracting, in completion order.
+    Pages are spread over a process pool; small documents are read in-process.
+    """
+    fileobj.seek(0)
+    data = fileobj.read()
+    _init_pdf_worker(data)
+    n_pages = len(_pdf_reader.pages)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    if max_workers <= 1 or n_pages < PDF_PARALLEL_MIN_PAGES:
+        for page_no in range(n_pages):
+            yield from _extract_pdf_pages([page_no])
+        return
+
+    tasks = [range(i, min(i + pages_per_task, n_pages)) for i in range(0, n_pages, pages_per_task)]
+    methods = multiprocessing.get_all_start_methods()
+    ctx = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx,
+                             initializer=_init_pdf_worker, initargs=(data,)) as pool:
+        futures = [pool.submit(_extract_pdf_pages, task) for task in tasks]
+        for future in as_completed(futures):
+            yield from future.result()
+
+def read_pdf_text(fileobj, max_workers: int = None) -> str:
+    """Extracts all pages (in parallel) and joins them in page order, one newline per page."""
+    pages = {}
+    for page_no, text, _ in iter_pdf_pages(fileobj, max_workers=max_workers):
+        pages[page_no] = text
+    return "".join(pages[i] + "\n" for i in range(len(pages)))
+
+def mine_text_file(fileobj, encoding: str = "utf-8"):
+    """Template-mined frame of a text log (see template_utils.mine_lines), or None if it isn't templated."""
+    open_lines = lambda: (line for chunk in iter_text_chunks(fileobj, encoding=encoding) for line in chunk)
+    return mine_lines(open_lines)
+
+def load_upload(filename: str, fileobj, pdf_workers: int = None, mine_templates: bool = True,
+                sheet=None, columns: list = None, lean: bool = False):
+    """
+    Parses a whole upload into memory.
+    Returns (data_content, data_type) with data_type "dataframe", "text" or "unknown".
+    Templated TXT logs come back as a structured frame (one column per template slot)
+    unless mine_templates is False. For Excel, sheet/columns select what is read.
+    lean=True reads tables in chunks and stores low-cardinality string columns as
+    categoricals (see compact_frame); the values are the same.
+    """
+    file_ext = file_extension(filename)
+    fileobj.seek(0) # Reset pointer
+    if file_ext == 'csv':
+        if lean:
+            return concat_compact(compact_frame(chunk) for chunk in iter_csv_chunks(fileobj)), "dataframe"
+        return pd.read_csv(fileobj), "dataframe"
+    elif file_ext == 'xlsx' or (file_ext == 'xls' and excel_engine() == "calamine"):
+        if lean:
+            chunks = (compact_frame(chunk) for chunk in iter_excel_chunks(fileobj, sheet=sheet, columns=columns))
+            frame = concat_compact(chunks)
+            return frame if frame is not None else read_excel(fileobj, sheet=sheet, columns=columns), "dataframe"
+        return read_excel(fileobj, sheet=sheet, columns=columns), "dataframe"
+    elif file_ext == 'xls':
+        frame = pd.read_excel(fileobj, sheet_name=sheet or 0, usecols=columns)
+        return compact_frame(frame) if lean else frame, "dataframe"
+    elif file_ext == 'txt':
+        if mine_templates:
+            mined = mine_text_file(fileobj)
+            if mined is not None:
+                return compact_frame(mined) if lean else mined, "dataframe"
+            fileobj.seek(0)
+        return fileobj.read().decode("utf-8"), "text"
+    elif file_ext == 'pdf':
+        return read_pdf_text(fileobj, max_workers=pdf_workers), "text"
+    return None, "unknown"
+
+def compact_frame(df: pd.DataFrame, ratio: float = LEAN_CATEGORY_RATIO, columns: list = None) -> pd.DataFrame:
+    """
+    df with its low-cardinality string columns (or the given columns) as categoricals.
+    Other columns are shared with df, not copied.
+    """
+    out = df.copy(deep=False)
+    if columns is None:
+        columns = [c for c in out.columns if (out[c].dtype == object or pd.api.types.is_string_dtype(out[c].dtype))
+                   and not isinstance(out[c].dtype, pd.CategoricalDtype) and out[c].nunique() <= ratio * len(out)]
+    for col in columns:
+        out[col] = out[col].astype("category")
+    return out
+
+def concat_compact(chunks):
+    """
+    Concatenates compacted chunks (None if there are none). Columns the first chunk
+    stores as categoricals stay categorical, with the categories of every chunk merged.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return None
+    categorical = [c for c in first.columns if isinstance(first[c].dtype, pd.CategoricalDtype)]
+    parts = [first] + [compact_frame(chunk, columns=categorical) for chunk in chunks]
+    if len(parts) == 1:
+        return first
+    merged = {c: pd.api.types.union_categoricals([part[c] for part in parts]) for c in categorical}
+    # A chunk whose cells are all empty in some column leaves it object-typed; re-infer on the whole
+    frame = pd.concat([part.drop(columns=categorical) for part in parts], ignore_index=True).infer_objects()
+    for col, values in merged.items():
+        frame[col] = values
+    return frame[list(first.columns)]
+
+def read_preview(filename: str, fileobj, rows: int = PREVIEW_ROWS, sheet=None, columns: list = None):
+    """The first rows of an upload, read from its bytes: a DataFrame for tables, else text lines."""
+    file_ext = file_extension(filename)
+    fileobj.seek(0)
+    if file_ext == 'csv':
+        return pd.read_csv(fileobj, nrows=rows)
+    elif file_ext == 'xlsx' or (file_ext == 'xls' and excel_engine() == "calamine"):
+        return next(iter_excel_chunks(fileobj, rows, sheet=sheet, columns=columns), pd.DataFrame())
+    elif file_ext == 'xls':
+        return pd.read_excel(fileobj, sheet_name=sheet or 0, usecols=columns, nrows=rows)
+    elif file_ext == 'pdf':
+        return "\n".join(read_pdf_text(fileobj).splitlines()[:rows])
+    return "".join(next(iter_text_chunks(fileobj, rows), []))
+
+def excel_engine() -> str:
+    """python-calamine (native) when installed, else openpyxl's read-only mode; EXCEL_ENGINE=openpyxl forces the latter."""
+    if CalamineWorkbook is not None and os.getenv("EXCEL_ENGINE", "calamine") != "openpyxl":
+        return "calamine"
+    return "openpyxl"
+
+def _open_workbook(fileobj, engine: str):
+    fileobj.seek(0)
+    if engine == "calamine":
+        return CalamineWorkbook.from_filelike(fileobj)
+    from openpyxl import load_workbook
+    # read_only parses rows from the sheet XML on demand instead of building every cell object up front
+    return load_workbook(fileobj, read_only=True, data_only=True)
+
+def excel_sheets(fileobj) -> list:
+    engine = excel_engine()
+    wb = _open_workbook(fileobj, engine)
+    if engine == "calamine":
+        return list(wb.sheet_names)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def _calamine_value(value):
+    if value == "":
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value) # calamine reports every number as float; openpyxl/pandas keep integers
+    return value
+
+def _iter_sheet_rows(fileobj, sheet=None):
+    """Yields the rows of one sheet (first sheet by default) as tuples, empty cells as None."""
+    engine = excel_engine()
+    wb = _open_workbook(fileobj, engine)
+    if engine == "calamine":
+        name = sheet if sheet is not None else wb.sheet_names[0]
+        for row in wb.get_sheet_by_name(name).iter_rows():
+            yield tuple(_calamine_value(v) for v in row)
+        return
+    try:
+        ws = wb[sheet] if sheet is not None else wb.worksheets[0]
+        yield from ws.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+def _column_names(header) -> list:
+    """Header cells as unique column names, like pandas (Unnamed: i, duplicates get .1, .2)."""
+    names, seen = [], {}
+    for i, value in enumerate(header or ()):
+        name = f"Unnamed: {i}" if value is None or value == "" else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def excel_columns(fileobj, sheet=None) -> list:
+    return _column_names(next(_iter_sheet_rows(fileobj, sheet), None))
+
+def iter_excel_chunks(fileobj, chunk_rows: int = DEFAULT_CHUNK_ROWS, sheet=None, columns: list = None):
+    """
+    Yields DataFrames of at most chunk_rows rows from one sheet without loading the
+    workbook: rows are read in streaming fashion and only the selected columns are kept.
+    Trailing empty rows are dropped, like pd.read_excel does.
+    """
+    rows = _iter_sheet_rows(fileobj, sheet)
+    names = _column_names(next(rows, None))
+    keep = list(range(len(names))) if columns is None else [names.index(c) for c in columns]
+    out_names = [names[i] for i in keep]
+
+    batch, blank = [], []
+    for row in rows:
+        values = [row[i] if i < len(row) else None for i in keep]
+        if all(v is None for v in values):
+            blank.append(values) # held back until a non-empty row follows
+            continue
+        for values in blank + [values]:
+            batch.append(values)
+            if len(batch) >= chunk_rows:
+                yield pd.DataFrame(batch, columns=out_names)
+                batch = []
+        blank = []
+    if batch:
+        yield pd.DataFrame(batch, columns=out_names)
+
+def read_excel(fileobj, sheet=None, columns: list = None, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> pd.DataFrame:
+    """One sheet (optionally some columns) via the streaming reader."""
+    chunks = list(iter_excel_chunks(fileobj, chunk_rows, sheet=sheet, columns=columns))
+    if not chunks:
+        return pd.DataFrame(columns=columns if columns is not None else excel_columns(fileobj, sheet))
+    if len(chunks) == 1:
+        return chunks[0]
+    # A chunk whose cells are all empty in some column leaves it object-typed; re-infer on the whole
+    return pd.concat(chunks, ignore_index=True).infer_objects()
+
+def iter_csv_chunks(fileobj, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+    """Yields DataFrames of at most chunk_rows rows."""
+    fileobj.seek(0)
+    yield from pd.read_csv(fileobj, chunksize=chunk_rows)
+
+def iter_text_chunks(fileobj, chunk_lines: int = DEFAULT_CHUNK_LINES, encoding: str = "utf-8"):
+    """Yields lists of at most chunk_lines lines (line endings kept)."""
+    fileobj.seek(0)
+    reader = io.TextIOWrapper(fileobj, encoding=encoding, newline="")
+    try:
+        lines = []
+        for line in reader:
+            lines.append(line)
+            if len(lines) >= chunk_lines:
+                yield lines
+                lines = []
+        if lines:
+            yield lines
+    finally:
+        # Don't let the wrapper close the caller's file
+        reader.detach()
+
+def _remove_file(path: str):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+class StreamResult:
+    """
+    Outcome of a streaming anonymization run. Only bounded previews are held in memory;
+    the full masked output lives in output_path, which is removed by cleanup() or once
+    the result is garbage-collected (e.g. evicted from every cache).
+    """
+    def __init__(self, data_type: str, output_path: str):
+        self.data_type = data_type
+        self.output_path = output_path
+        self.preview_original = None
+        self.preview_masked = None
+        self.context = None
+        self.rows = 0
+        self.chunks = 0
+        self.plan = None # masking plan after the last chunk (tables)
+        self.page_timings = [] # [(page_no, seconds)] for PDFs, in completion order
+        self._finalizer = weakref.finalize(self, _remove_file, output_path)
+
+    def cleanup(self):
+        self._finalizer()
+
+def _iter_pdf_line_chunks(fileobj, result: StreamResult, pdf_workers: int = None):
+    """Yields the lines of each PDF page in page order as soon as that page is extracted."""
+    done, next_page = {}, 0
+    for page_no, text, seconds in iter_pdf_pages(fileobj, max_workers=pdf_workers):
+        result.page_timings.append((page_no, seconds))
+        done[page_no] = text
+        while next_page in done:
+            yield (done.pop(next_page) + "\n").splitlines(keepends=True)
+            next_page += 1
+
+def stream_anonymize(filename: str, fileobj, engine, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                     preview_rows: int = 100, context_rows: int = 5000, plan: dict = None,
+                     batch_size: int = 256, n_process: int = 1, output_dir: str = None,
+                     progress_callback=None, pdf_workers: int = None, sheet=None,
+                     columns: list = None) -> StreamResult:
+    """
+    Reads a CSV/XLSX/TXT/PDF upload in fixed-size chunks and anonymizes each chunk as it arrives.
+    Masked chunks are appended to a temp file. Masks are reused across chunks through a
+    {value: mask} map kept for the whole stream (bounded by STREAM_MASK_MAP_MAX), so a
+    repeated value goes through NER once even with the mask cache off. Peak memory is
+    bounded by the chunk size.
+
+    For tables, the masking plan is profiled on the first chunk unless one is given; new
+    values of skipped columns are re-checked on every chunk, so PII that first shows up
+    later is still masked.
+    Excel rows are read from one sheet (sheet/columns select what is read).
+    PDFs are extracted in parallel and each page is masked as soon as it is ready.
+    progress_callback(chunks_done, rows_done) is called after each chunk.
+    """
+    file_ext = file_extension(filename)
+    if file_ext not in ('csv', 'xlsx', 'txt', 'pdf'):
+        raise ValueError(f"Streaming is only supported for CSV/XLSX/TXT/PDF, not .{file_ext}")
+
+    tabular = file_ext in ('csv', 'xlsx')
+    fd, output_path = tempfile.mkstemp(prefix="masked_", suffix=".csv" if tabular else ".txt", dir=output_dir)
+    result = StreamResult("dataframe" if tabular else "text", output_path)
+    masks = {}
+
+    with os.fdopen(fd, "w", encoding="utf-8", newline="") as out:
+        if tabular:
+            originals, contexts, seen = [], [], {}
+            if file_ext == 'csv':
+                frame_chunks = iter_csv_chunks(fileobj, chunk_rows)
+            else:
+                frame_chunks = iter_excel_chunks(fileobj, chunk_rows, sheet=sheet, columns=columns)
+            for chunk in frame_chunks:
+                if plan is None:
+                    plan = engine.profile_dataframe(chunk)
+                plan = engine.recheck_plan(chunk, plan, seen)
+                if len(masks) > STREAM_MASK_MAP_MAX:
+                    masks.clear()
+                masked = engine.anonymize_dataframe(chunk, batch_size=batch_size, n_process=n_process, plan=plan, masks=masks)
+                masked.to_csv(out, index=False, header=result.chunks == 0)
+
+                # Keep only the leading rows needed for preview and AI context
+                if result.rows < preview_rows:
+                    originals.append(chunk.head(preview_rows - result.rows))
+                if result.rows < context_rows:
+                    contexts.append(masked.head(context_rows - result.rows))
+                result.rows += len(chunk)
+                result.chunks += 1
+                if progress_callback:
+                    progress_callback(result.chunks, result.rows)
+
+            result.plan = plan
+            result.preview_original = pd.concat(originals, ignore_index=True) if originals else pd.DataFrame()
+            result.context = pd.concat(contexts, ignore_index=True) if contexts else pd.DataFrame()
+            result.preview_masked = result.context.head(preview_rows)
+        else:
+            original_head, masked_head = [], []
+            if file_ext == 'pdf':
+                line_chunks = _iter_pdf_line_chunks(fileobj, result, pdf_workers=pdf_workers)
+            else:
+                line_chunks = iter_text_chunks(fileobj, chunk_rows)
+            for lines in line_chunks:
+                # Line by line: log records are independent and dedupe well
+                stripped = [line.rstrip("\r\n") for line in lines]
+                if len(masks) > STREAM_MASK_MAP_MAX:
+                    masks.clear()
+                masked = engine.anonymize_values(stripped, batch_size=batch_size, n_process=n_process, masks=masks)
+                out.write("".join(m + line[len(s):] for m, s, line in zip(masked, stripped, lines)))
+
+                if result.rows < context_rows:
+                    original_head.extend(lines[:context_rows - result.rows])
+                    masked_head.extend(m + "\n" for m in masked[:context_rows - result.rows])
+                result.rows += len(lines)
+                result.chunks += 1
+                if progress_callback:
+                    progress_callback(result.chunks, result.rows)
+
+            result.preview_original = "".join(original_head[:preview_rows])
+            result.preview_masked = "".join(masked_head[:preview_rows])
+            result.context = "".join(masked_head)
+
+    return result
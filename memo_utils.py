@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Cross-session artifact budget (parsed/anonymized frames dominate)
+DEFAULT_SHARED_MB = 2048
+# Per-session: a handful of recent uploads, so switching back is instant
+DEFAULT_SESSION_ITEMS = 32
+DEFAULT_SESSION_MB = 512
+
+_MISSING = object()
+
+def content_hash(fileobj, block_size: int = 1 << 20) -> str:
+    """Digest of an upload's bytes, read in blocks; leaves the file at position 0."""
+    h = hashlib.blake2b(digest_size=20)
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(block_size), b""):
+        h.update(block)
+    fileobj.seek(0)
+    return h.hexdigest()
+
+def memo_key(*parts) -> str:
+    """Stable key for a pipeline stage: dicts are order-insensitive, everything else by repr."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, dict):
+            part = sorted(part.items(), key=lambda kv: str(kv[0]))
+        data = repr(part).encode("utf-8", "surrogatepass")
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return h.hexdigest()
+
+def estimate_size(obj, _depth: int = 0) -> int:
+    """Approximate memory held by a cached artifact (DataFrames sampled, not scanned)."""
+    if obj is None or _depth > 3:
+        return 0
+    if isinstance(obj, pd.DataFrame):
+        # Categoricals exactly (codes plus one copy of each category), the rest from a sample
+        categorical = [i for i, dtype in enumerate(obj.dtypes) if isinstance(dtype, pd.CategoricalDtype)]
+        size = sum(obj.iloc[:, i].cat.codes.nbytes + obj.iloc[:, i].cat.categories.memory_usage(deep=True)
+                   for i in categorical)
+        if categorical:
+            obj = obj.iloc[:, sorted(set(range(obj.shape[1])) - set(categorical))]
+        if len(obj) > 2000:
+            sample = obj.head(2000).memory_usage(deep=True, index=False).sum()
+            return int(size + sample * len(obj) / 2000)
+        return int(size + obj.memory_usage(deep=True, index=False).sum())
+    if isinstance(obj, pd.Series):
+        return estimate_size(obj.to_frame(), _depth)
+    if isinstance(obj, (str, bytes)):
+        return len(obj)
+    if isinstance(obj, (list, tuple)):
+        return sum(estimate_size(v, _depth + 1) for v in obj)
+    if isinstance(obj, dict):
+        return sum(estimate_size(v, _depth + 1) for v in obj.values())
+    if hasattr(obj, "nbytes"): # numpy arrays, and artifacts that report their own footprint
+        return int(obj.nbytes)
+    if hasattr(obj, "__dict__"):
+        return sum(estimate_size(v, _depth + 1) for v in vars(obj).values())
+    return sys.getsizeof(obj)
+
+class ArtifactCache:
+    """
+    Bounded LRU of pipeline artifacts (parsed upload, masking plan, anonymized data, context)
+    keyed by memo_key(stage, content hash, config). Entries are evicted least recently used
+    first when either max_items or max_bytes is exceeded, or explicitly via evict/clear.
+    Values are returned as stored (callers must not mutate them).
+    """
+    def __init__(self, max_items: int = 256, max_bytes: int = DEFAULT_SHARED_MB * 2**20):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (value, size, tag)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._computing = {} # key -> lock, so concurrent sessions compute once
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key: str, value, tag: str = None, size: int = None):
+        size = estimate_size(value) if size is None else size
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes:
+                logger.info(f"Artifact {key[:12]} ({size / 1e6:.0f} MB) exceeds the cache budget; not cached")
+                return
+            self._entries[key] = (value, size, tag)
+            self._bytes += size
+            while len(self._entries) > self.max_items or self._bytes > self.max_bytes:
+                _, (_, dropped, _) = self._entries.popitem(last=False)
+                self._bytes -= dropped
+
+    def get_or_compute(self, key: str, compute, tag: str = None):
+        """Returns the cached value for key, computing (once, even across threads) on a miss."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        with self._lock:
+            key_lock = self._computing.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    self.hits += 1
+                    return value
+                self.misses += 1
+                start = time.perf_counter()
+                value = compute()
+                self.put(key, value, tag=tag)
+                logger.info(f"Computed artifact {tag or key[:12]} in {time.perf_counter() - start:.2f}s")
+                return value
+        finally:
+            with self._lock:
+                self._computing.pop(key, None)
+
+    def evict(self, tag: str = None, key: str = None) -> int:
+        """Drops one key, or every entry carrying tag (e.g. a file's content hash)."""
+        with self._lock:
+            doomed = [k for k, (_, _, t) in self._entries.items() if k == key or (tag is not None and t == tag)]
+            for k in doomed:
+                self._bytes -= self._entries.pop(k)[1]
+        return len(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "items": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+class Memo:
+    """
+    Two-level memo for one session: the session's own bounded cache in front of the
+    process-wide one. A hit in either level skips the work; results land in both, so
+    the current session keeps its artifacts even if other sessions push them out of
+    the shared cache.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_items: int = DEFAULT_SESSION_ITEMS, max_bytes: int = DEFAULT_SESSION_MB * 2**20):
+        self.session = ArtifactCache(max_items=max_items, max_bytes=max_bytes)
+        self.shared = Memo.shared_cache()
+
+    @classmethod
+    def shared_cache(cls) -> ArtifactCache:
+        """Process-wide cache sized by ARTIFACT_CACHE_MB."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                mb = int(os.getenv("ARTIFACT_CACHE_MB", DEFAULT_SHARED_MB))
+                cls._shared = ArtifactCache(max_items=1024, max_bytes=mb * 2**20)
+            return cls._shared
+
+    def __call__(self, stage: str, file_hash: str, config, compute):
+        """Result of compute() for (stage, file, config), from either cache level if possible."""
+        key = memo_key(stage, file_hash, config)
+        value = self.session.get(key, _MISSING)
+        if value is not _MISSING:
+            self.session.hits += 1
+            return value
+        value = self.shared.get_or_compute(key, compute, tag=file_hash)
+        self.session.put(key, value, tag=file_hash)
+        return value
+
+    def evict(self, file_hash: str):
+        """Forgets everything derived from one upload, in this session and process-wide."""
+        self.session.evict(tag=file_hash)
+        self.shared.evict(tag=file_hash)
+
+    def clear(self):
+        self.session.clear()
+        self.shared.clear()
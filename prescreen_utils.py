@@ -0,0 +1,268 @@
+import re
+import logging
+import numpy as np
+import pandas as pd
+from schema_utils import canonical_frame, resolve_columns, parse_text_log
+from context_utils import pack_context
+
+logger = logging.getLogger(__name__)
+
+SEVERITY_ORDER = ["Critical", "Major", "Minor"]
+
+# rule -> (severity, ALCOA+ principle, description)
+RULES = {
+    "data_deletion": ("Critical", "Original / Legible", "Delete/drop/remove action on data"),
+    "audit_trail_change": ("Critical", "Legible / Enduring", "Audit trail configuration changed or disabled"),
+    "abort_then_pass": ("Critical", "Testing into compliance", "Repeated aborted runs followed by a passing run"),
+    "generic_account": ("Major", "Attributable", "Shared or generic account"),
+    "non_chronological": ("Major", "Contemporaneous", "Timestamp earlier than a preceding entry"),
+    "off_hours": ("Minor", "Contemporaneous", "Activity outside business hours"),
+}
+
+BUSINESS_HOURS = (7, 19) # [start, end) local hour
+WEEKEND_IS_OFF_HOURS = True
+ABORT_RUN_MIN = 2
+
+GENERIC_ACCOUNT = re.compile(
+    r"^(?:admin\w*|administrator|root|system|sys|guest|test\w*|shared\w*|service\w*|user\d*|operator\d*|lab\d*|qc\d*|default)$",
+    re.IGNORECASE,
+)
+DELETION = re.compile(r"\b(?:delete[ds]?|deletion|drop(?:ped)?|remove[ds]?|purge[ds]?)\b", re.IGNORECASE)
+AUDIT_TRAIL_CHANGE = re.compile(
+    r"audit[ _-]?trail[ _-]?(?:config\w*|disabled?|off|deactivat\w*|setting\w*)|(?:disabl\w*|turn\w* off)[ _-]audit[ _-]?trail",
+    re.IGNORECASE,
+)
+ABORT = re.compile(r"\babort(?:ed)?\b", re.IGNORECASE)
+STATUS_IN_TEXT = re.compile(r"\b(?:Status|Result)\s*[:=]\s*(\w+)", re.IGNORECASE)
+PASS = re.compile(r"^(?:pass(?:ed)?|success(?:ful)?|ok|complete[d]?|compliant)$", re.IGNORECASE)
+
+def _match(series: pd.Series, pattern) -> np.ndarray:
+    """Regex test evaluated once per distinct value (audit columns are low-cardinality)."""
+    if series is None:
+        return None
+    codes, uniques = pd.factorize(series, sort=False)
+    hits = np.fromiter((bool(pattern.search(str(v))) for v in uniques), dtype=bool, count=len(uniques))
+    return np.where(codes >= 0, hits[np.maximum(codes, 0)], False)
+
+def parse_timestamps(series: pd.Series) -> pd.Series:
+    """
+    Naive microsecond timestamps (offsets converted to UTC); unparseable values become NaT.
+    The unit is fixed so int64 views compare across calls (pandas infers it per call);
+    microseconds also hold sentinel dates such as 9999-12-31, which nanoseconds cannot.
+    """
+    parsed = pd.to_datetime(series, errors="coerce", format="ISO8601", utc=True)
+    if parsed.isna().mean() > 0.5:
+        parsed = pd.to_datetime(series, errors="coerce", format="mixed", utc=True)
+    return parsed.dt.tz_localize(None).dt.as_unit("us")
+
+class PrescreenResult:
+    """Per-rule row flags over the whole log, the findings table and summary statistics."""
+    def __init__(self, flags: pd.DataFrame, findings: pd.DataFrame, stats: dict, columns: dict, carry: dict = None):
+        self.flags = flags # bool column per rule, positional rows
+        self.findings = findings
+        self.stats = stats
+        self.columns = columns # canonical field -> source column
+        self.carry = carry # state for screening rows appended later (see prescreen)
+
+    @property
+    def flagged(self) -> np.ndarray:
+        return self.flags.to_numpy().any(axis=1)
+
+    def summary_frame(self) -> pd.DataFrame:
+        rows = [(rule, *RULES[rule][:2], int(self.flags[rule].sum())) for rule in self.flags.columns]
+        return pd.DataFrame(rows, columns=["Rule", "Severity", "Principle", "Rows"])
+
+    def summary_text(self) -> str:
+        return summary_text(self.stats, {rule: int(self.flags[rule].sum()) for rule in self.flags.columns})
+
+def summary_text(stats: dict, counts: dict) -> str:
+    """Statistics and per-rule row counts as Markdown bullets (for the model and reports)."""
+    lines = [
+        f"- Rows scanned: {stats['rows']:,}; flagged rows: {stats['flagged_rows']:,}",
+        f"- Time span: {stats['first']} to {stats['last']}; distinct users: {stats['users']}",
+    ]
+    for rule, count in counts.items():
+        if count:
+            severity, principle, description = RULES[rule]
+            lines.append(f"- {rule} ({severity}, {principle}): {count:,} rows — {description}")
+    return "\n".join(lines)
+
+def _abort_then_pass(canon: pd.DataFrame, ts: pd.Series, is_abort: np.ndarray, carried_runs: dict = None):
+    """
+    Flags a passing entry that follows >= ABORT_RUN_MIN consecutive aborts on the same
+    equipment (time order). carried_runs {equipment: aborts} continues runs that ended
+    an earlier part of the log. Returns (flag per row, run length per flagged row,
+    trailing abort run per equipment).
+    """
+    n = len(canon)
+    flag = np.zeros(n, dtype=bool)
+    run_len = np.zeros(n, dtype=np.int64)
+    carried_runs = carried_runs or {}
+    if n == 0 or (not is_abort.any() and not carried_runs):
+        return flag, run_len, {}
+
+    group = canon["equipment"].astype(str).to_numpy() if "equipment" in canon else np.full(n, "", dtype=object)
+    group_codes, groups = pd.factorize(group)
+    order = np.lexsort((ts.to_numpy().view("int64"), group_codes)) # by equipment, then time (stable)
+    g = group_codes[order]
+    aborted = is_abort[order]
+    carried = np.array([carried_runs.get(str(k), 0) for k in groups], dtype=np.int64)[g]
+
+    new_group = np.r_[True, g[1:] != g[:-1]]
+    run_start = aborted & (new_group | ~np.r_[False, aborted[:-1]])
+    # Position within the abort run (0 for non-abort rows); a run opening a group extends the carried one
+    idx = np.arange(n)
+    start_pos = np.maximum.accumulate(np.where(run_start, idx, 0))
+    group_start = np.maximum.accumulate(np.where(new_group, idx, 0))
+    length = np.where(aborted, idx - start_pos + 1 + np.where(start_pos == group_start, carried, 0), 0)
+    before = np.r_[0, length[:-1]]
+    before[new_group] = carried[new_group]
+    last = np.r_[new_group[1:], True]
+    trailing = {str(groups[k]): int(v) for k, v in zip(g[last], length[last])}
+    candidates = ~aborted & (before >= ABORT_RUN_MIN)
+    if not candidates.any():
+        return flag, run_len, trailing
+
+    # Status: a status column if present, else "Status: X" / "Result: X" in the detail
+    rows = order[candidates]
+    if "status" in canon:
+        status = canon["status"].iloc[rows].astype(str)
+    else:
+        text = canon["detail"] if "detail" in canon else canon["action"]
+        status = text.iloc[rows].astype(str).str.extract(STATUS_IN_TEXT, expand=False).fillna("")
+    passed = status.str.match(PASS).to_numpy()
+    flag[rows[passed]] = True
+    run_len[rows[passed]] = before[candidates][passed]
+    return flag, run_len, trailing
+
+def prescreen(data, business_hours: tuple = BUSINESS_HOURS, carry: dict = None) -> PrescreenResult:
+    """
+    Runs every deterministic ALCOA+ rule over the whole log in one vectorized pass.
+    data is a DataFrame (any known column aliases) or free text (parsed line by line).
+    Rules whose columns are missing are skipped.
+    To screen a log in appended parts, pass the previous part's result.carry: rules that
+    look back (non-chronological timestamps, abort runs) then continue across parts.
+    """
+    carry = carry or {}
+    if isinstance(data, pd.DataFrame):
+        canon = canonical_frame(data)
+        columns = resolve_columns(data.columns)
+    else:
+        canon = parse_text_log(data or "")
+        columns = {c: c for c in canon.columns}
+    canon = canon.reset_index(drop=True)
+    n = len(canon)
+    flags = {}
+
+    action = canon.get("action")
+    if action is not None:
+        flags["data_deletion"] = _match(action, DELETION)
+        flags["audit_trail_change"] = _match(action, AUDIT_TRAIL_CHANGE)
+        if "detail" in canon and columns.get("detail") != columns.get("action"):
+            flags["audit_trail_change"] |= _match(canon["detail"], AUDIT_TRAIL_CHANGE)
+
+    if "user" in canon:
+        flags["generic_account"] = _match(canon["user"], GENERIC_ACCOUNT)
+
+    ts = None
+    if "timestamp" in canon:
+        ts = parse_timestamps(canon["timestamp"])
+        valid = ts.notna().to_numpy()
+        # Earlier than the latest timestamp seen so far (file order); NaT views as int64 min
+        values = ts.to_numpy().view("int64")
+        seen = carry.get("latest")
+        latest = np.maximum.accumulate(np.r_[np.iinfo("int64").min if seen is None else seen, values])
+        flags["non_chronological"] = valid & (values < latest[:-1])
+
+        hour = ts.dt.hour.to_numpy()
+        start, end = business_hours
+        off = valid & ((hour < start) | (hour >= end))
+        if WEEKEND_IS_OFF_HOURS:
+            off |= valid & (ts.dt.dayofweek.to_numpy() >= 5)
+        flags["off_hours"] = off
+
+    run_len, runs = None, dict(carry.get("abort_runs", {}))
+    if action is not None and ts is not None:
+        flags["abort_then_pass"], run_len, trailing = _abort_then_pass(canon, ts, _match(action, ABORT), runs)
+        runs.update(trailing)
+
+    ordered = [rule for rule in RULES if rule in flags]
+    flag_frame = pd.DataFrame({rule: flags[rule] for rule in ordered}, index=pd.RangeIndex(n))
+
+    parts = []
+    for rule in ordered:
+        rows = np.flatnonzero(flag_frame[rule].to_numpy())
+        if not len(rows):
+            continue
+        severity, principle, description = RULES[rule]
+        part = pd.DataFrame({"row": rows, "rule": rule, "severity": severity, "principle": principle,
+                             "description": description})
+        if rule == "abort_then_pass":
+            part["description"] = [f"{k} aborted runs, then a passing run" for k in run_len[rows]]
+        parts.append(part)
+    findings = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+        columns=["row", "rule", "severity", "principle", "description"])
+    if not findings.empty:
+        findings["severity"] = pd.Categorical(findings["severity"], categories=SEVERITY_ORDER, ordered=True)
+        findings = findings.sort_values(["severity", "row"], kind="stable", ignore_index=True)
+
+    stats = {
+        "rows": n,
+        "flagged_rows": int(flag_frame.to_numpy().any(axis=1).sum()) if ordered else 0,
+        "first": ts.min() if ts is not None else None,
+        "last": ts.max() if ts is not None else None,
+        "users": int(canon["user"].nunique()) if "user" in canon else None,
+    }
+    carry = {
+        "latest": int(latest[-1]) if ts is not None else carry.get("latest"),
+        "abort_runs": {k: v for k, v in runs.items() if v},
+    }
+    return PrescreenResult(flag_frame, findings, stats, columns, carry)
+
+def select_windows(result: PrescreenResult, radius: int = 2, max_per_rule: int = 25) -> np.ndarray:
+    """
+    Row positions to show the model: up to max_per_rule flagged rows per rule
+    (most severe rules first), each with radius rows of context either side.
+    """
+    n = len(result.flags)
+    keep = np.zeros(n, dtype=bool)
+    for rule in result.flags.columns:
+        rows = np.flatnonzero(result.flags[rule].to_numpy())[:max_per_rule]
+        for offset in range(-radius, radius + 1):
+            keep[np.clip(rows + offset, 0, n - 1)] = True
+    return np.flatnonzero(keep)
+
+def flagged_windows(result: PrescreenResult, masked, radius: int = 2, max_per_rule: int = 25,
+                    row_offset: int = 0) -> pd.DataFrame:
+    """
+    The selected windows of the anonymized log (DataFrame or text, row-aligned with the
+    screened data) with _row (1-based, shifted by row_offset) and _flags columns.
+    """
+    rows = select_windows(result, radius=radius, max_per_rule=max_per_rule)
+    labels = result.flags.iloc[rows]
+    hit = [",".join(labels.columns[mask]) or "context" for mask in labels.to_numpy()]
+
+    if isinstance(masked, pd.DataFrame):
+        window = masked.iloc[rows].reset_index(drop=True)
+    else:
+        lines = np.array(masked.splitlines(), dtype=object)
+        window = pd.DataFrame({"entry": lines[rows[rows < len(lines)]]})
+    window.insert(0, "_flags", hit[:len(window)])
+    window.insert(0, "_row", rows[:len(window)] + 1 + row_offset)
+    return window
+
+def build_prescreen_context(result: PrescreenResult, masked, token_budget: int, radius: int = 2,
+                            max_per_rule: int = 25) -> str:
+    """
+    Gemini context: summary statistics for the whole log plus only the flagged windows,
+    taken from the anonymized log (DataFrame or text, row-aligned with the screened data).
+    """
+    window = flagged_windows(result, masked, radius=radius, max_per_rule=max_per_rule)
+    header = (
+        "### DETERMINISTIC PRE-SCREEN (local rules over the full log)\n"
+        f"{result.summary_text()}\n\n"
+        f"### FLAGGED WINDOWS (anonymized; _row = 1-based row number, _flags = rules hit, "
+        f"±{radius} rows of context; at most {max_per_rule} examples per rule)\n"
+    )
+    packed = pack_context(window, token_budget=max(token_budget - len(header) // 4, 1000), collapse=False)
+    return header + packed.text
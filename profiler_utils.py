@@ -0,0 +1,115 @@
+import re
+import pandas as pd
+
+# Column roles and the cheapest masker that is still correct for each
+ROLE_ENUM = "enum"
+ROLE_TIMESTAMP = "timestamp"
+ROLE_IP = "ip"
+ROLE_EMAIL = "email"
+ROLE_NAME = "name"
+ROLE_TEXT = "text"
+
+ROLES = [ROLE_ENUM, ROLE_TIMESTAMP, ROLE_IP, ROLE_EMAIL, ROLE_NAME, ROLE_TEXT]
+
+ROLE_MASKER = {
+    ROLE_ENUM: "skip",
+    ROLE_TIMESTAMP: "skip",
+    ROLE_IP: "regex",
+    ROLE_EMAIL: "regex",
+    ROLE_NAME: "ner",
+    ROLE_TEXT: "ner",
+}
+
+# Full-value patterns. Values of a regex/skip column that don't match still go through NER.
+ROLE_PATTERNS = {
+    ROLE_TIMESTAMP: re.compile(
+        r"\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?(?:Z|[+-]\d{2}:?\d{2})?"
+        r"|\d{1,2}/\d{1,2}/\d{2,4}(?: \d{1,2}:\d{2}(?::\d{2})?(?: ?[AP]M)?)?"
+    ),
+    # No leading zeros: Presidio rejects those via ipaddress, so they must fall through to NER
+    ROLE_IP: re.compile(r"(?:(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)"),
+    ROLE_EMAIL: re.compile(r"[\w.!#$%&'*+/=?^`{|}~-]+@\w+(?:-+\w+)*(?:\.\w+(?:-+\w+)*)+"),
+}
+
+# Replacement tags, kept in sync with SecurityEngine operators
+ROLE_TAGS = {
+    ROLE_IP: "<IP_ADDRESS>",
+    ROLE_EMAIL: "<EMAIL>",
+}
+
+# Whole log lines and the templates mined from them (template_utils): never skipped,
+# however few distinct values they have
+FREE_TEXT_COLUMNS = ("Template", "Message")
+
+def profile_column(series: pd.Series, probe=None, sample_size: int = 500, enum_max: int = 50,
+                   match_ratio: float = 0.9) -> str:
+    """
+    Assigns a role to one column from a sample of its values.
+    probe(values) -> masked values is used to confirm that a low-cardinality column holds no PII.
+    """
+    values = series.dropna()
+    if values.empty:
+        return ROLE_ENUM
+
+    sample = values.astype(str)
+    if len(sample) > sample_size:
+        sample = sample.sample(sample_size, random_state=0)
+
+    for role in (ROLE_TIMESTAMP, ROLE_IP, ROLE_EMAIL):
+        if sample.str.fullmatch(ROLE_PATTERNS[role]).mean() >= match_ratio:
+            return role
+
+    # Low cardinality: check every distinct value once, then the column can be skipped
+    uniques = values.unique()
+    if probe is not None and len(uniques) <= enum_max:
+        raw = [str(v) for v in uniques]
+        if list(probe(raw)) == raw:
+            return ROLE_ENUM
+
+    words = sample.str.split().str.len().mean()
+    return ROLE_NAME if words <= 4 else ROLE_TEXT
+
+def text_columns(df: pd.DataFrame) -> list:
+    """String columns of df: object columns and categoricals of strings (template-mined or stored logs)."""
+    cols = list(df.select_dtypes(include=['object']).columns)
+    for col in df.select_dtypes(include=['category']).columns:
+        if not pd.api.types.is_numeric_dtype(df[col].cat.categories) and not pd.api.types.is_datetime64_any_dtype(df[col].cat.categories):
+            cols.append(col)
+    return [col for col in df.columns if col in cols]
+
+def profile_dataframe(df: pd.DataFrame, probe=None, sample_size: int = 500, enum_max: int = 50) -> dict:
+    """Returns a masking plan {column: role} for the string columns of df."""
+    obj_cols = text_columns(df)
+    return {col: ROLE_TEXT if col in FREE_TEXT_COLUMNS else
+            profile_column(df[col], probe=probe, sample_size=sample_size, enum_max=enum_max) for col in obj_cols}
+
+def recheck_plan(df: pd.DataFrame, plan: dict, probe, seen: dict, enum_max: int = 50) -> dict:
+    """
+    Re-checks the skipped (enum) columns of a plan profiled on part of the data.
+    Distinct values not yet in seen[column] go through probe; the column is moved to NER
+    as soon as one of them changes or it outgrows enum_max distinct values.
+    Returns the updated plan; seen is updated in place.
+    """
+    plan = dict(plan)
+    for col, role in plan.items():
+        if role != ROLE_ENUM or col not in df.columns:
+            continue
+        known = seen.setdefault(col, set())
+        new = [val for val in df[col].dropna().astype(str).unique() if val not in known]
+        if not new:
+            continue
+        if len(known) + len(new) > enum_max or list(probe(new)) != new:
+            words = pd.Series(new).str.split().str.len().mean()
+            plan[col] = ROLE_NAME if words <= 4 else ROLE_TEXT
+            seen.pop(col)
+        else:
+            known.update(new)
+    return plan
+
+def plan_to_frame(plan: dict) -> pd.DataFrame:
+    """Tabular view of a plan for display/editing."""
+    return pd.DataFrame({
+        "Column": list(plan.keys()),
+        "Role": list(plan.values()),
+        "Masker": [ROLE_MASKER.get(role, "ner") for role in plan.values()],
+    })
@@ -0,0 +1,500 @@
+import re
+import time
+import logging
+from collections import namedtuple
+from itertools import chain
+import numpy as np
+import pandas as pd
+from schema_utils import resolve_columns, parse_text_log
+from context_utils import pack_context
+
+logger = logging.getLogger(__name__)
+
+# Rows per index segment: add() splits larger inputs so tokenizing stays bounded and
+# later rows (stream chunks, tailed logs) are appended without touching earlier segments
+SEGMENT_ROWS = 100_000
+
+# BM25 parameters (Robertson/Sparck Jones defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Canonical fields whose values the question can name exactly ("HPLC-02", "Login")
+FILTER_FIELDS = ("user", "action", "equipment", "status")
+FIELD_NGRAM = 4 # longest value (in terms) matched against the question
+# Shortest plausible CSV row, to bound how many ranked rows a token budget can use
+MIN_ROW_CHARS = 32
+
+# Simple words and compounds ("hplc-02", "10.0.0.7", "22:00"); compounds are also indexed by their parts
+_PART = re.compile(r"[a-z0-9]+")
+_COMPOUND = re.compile(r"[a-z0-9]+(?:[-_.:/@][a-z0-9]+)+")
+_TERM = re.compile(r"[a-z0-9]+(?:[-_.:/@][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a about after all an and any are as at be been before between by can could did do does done during each entries
+entry event events for from had has have how i in is it its log logs me my no not of on or over row rows show since
+than that the their them then there these they this those to until was were what when where which who whom why will
+with within without you list find give tell any happened happen activity activities anything something
+""".split())
+
+# Times of day and dates in a question, with the word in front deciding the comparison
+_CLOCK = r"(\d{1,2})(?::(\d{2}))?\s*(am|pm)?"
+_DATE = r"(\d{4}-\d{2}-\d{2})"
+_OPS = r"(after|since|from|before|until|till|at|around|on)?\s*"
+_CLOCK_RANGE = re.compile(rf"\bbetween\s+{_CLOCK}\s+(?:and|to|-)\s+{_CLOCK}", re.IGNORECASE)
+_DATE_RANGE = re.compile(rf"\bbetween\s+{_DATE}\s+(?:and|to|-)\s+{_DATE}", re.IGNORECASE)
+_CLOCK_AT = re.compile(rf"\b{_OPS}(?<![\d-]){_CLOCK}(?![\d-])", re.IGNORECASE)
+_DATE_AT = re.compile(rf"\b{_OPS}{_DATE}", re.IGNORECASE)
+_TIME_ONLY = re.compile(r"^\s*\d{1,2}:\d{2}")
+_HAS_CLOCK = re.compile(r"\d{1,2}:\d{2}")
+_OFFSET = re.compile(r"(?:Z|[+-]\d{2}:?\d{2})$")
+
+_LOWER = {"after": ">", "since": ">=", "from": ">="}
+_UPPER = {"before": "<", "until": "<=", "till": "<="}
+
+Retrieval = namedtuple("Retrieval", ["rows", "matched", "terms", "filters", "seconds"])
+
+def analyze(text: str) -> list:
+    """Index terms of a text: lowercase words, plus compounds such as "hplc-02" kept whole."""
+    text = text.lower()
+    return _PART.findall(text) + _COMPOUND.findall(text)
+
+def _value_key(value) -> str:
+    """A field value as the question would spell it ("HPLC-02" -> "hplc-02", "QA Assurance" -> "qa assurance")."""
+    return " ".join(_TERM.findall(str(value).lower()))
+
+class _Column:
+    """One column of a segment, dictionary-encoded: codes per row into values (last value = missing)."""
+    __slots__ = ("codes", "values", "order", "starts", "counts", "_lookup")
+
+    def __init__(self, series: pd.Series):
+        codes, uniques = pd.factorize(series, sort=False)
+        self.codes = codes.astype(np.int32)
+        self.values = np.append(np.asarray(uniques, dtype=object), None)
+        self.codes[self.codes < 0] = len(self.values) - 1
+        # Rows grouped by value: rows of value v are order[starts[v]:starts[v] + counts[v]]
+        self.counts = np.bincount(self.codes, minlength=len(self.values))
+        self.order = np.argsort(self.codes, kind="stable").astype(np.int32)
+        self.starts = np.r_[0, np.cumsum(self.counts)[:-1]]
+        self._lookup = None
+
+    def rows_of(self, values: np.ndarray, weights: np.ndarray = None):
+        """Rows holding any of the given value codes (and each row's weight)."""
+        lengths = self.counts[values]
+        total = int(lengths.sum())
+        ends = np.cumsum(lengths)
+        positions = np.repeat(self.starts[values] - (ends - lengths), lengths) + np.arange(total)
+        rows = self.order[positions]
+        return rows, (np.repeat(weights, lengths) if weights is not None else None)
+
+    def code(self, value):
+        if self._lookup is None:
+            self._lookup = {v: i for i, v in enumerate(self.values[:-1])}
+        return self._lookup.get(value)
+
+class _Segment:
+    """
+    A block of consecutive rows: the rows themselves (dictionary-encoded columns), a BM25
+    inverted index over their terms, the canonical fields as column indexes, and time of
+    day / date per row.
+    """
+    def __init__(self, frame: pd.DataFrame, fields: pd.DataFrame, offset: int, skip: set = ()):
+        self.offset = offset
+        self.rows = len(frame)
+        self.names = list(frame.columns)
+        self.columns = [_Column(frame[name]) for name in self.names]
+        self.fields = {}
+        for field in fields.columns:
+            if field in FILTER_FIELDS:
+                self.fields[field] = _Column(fields[field])
+        self._index_terms(set(skip))
+        self.minute, self.day = _times(fields)
+
+    def _index_terms(self, skip: set):
+        """
+        Postings as (term, column, value, tf) sorted by term. Only distinct values are
+        tokenized, by whitespace, and each distinct word is analyzed once.
+        """
+        vocab, term_ids, col_ids, val_ids, tfs = {}, [], [], [], []
+        self.length = np.zeros(self.rows, dtype=np.float32)
+        self.chars = np.zeros(self.rows, dtype=np.int32)
+        for c, column in enumerate(self.columns):
+            text = [str(v) for v in column.values[:-1]]
+            chars = np.fromiter(map(len, text), dtype=np.int32, count=len(text)) + 1
+            self.chars += np.append(chars, 1)[column.codes]
+            if self.names[c] in skip or not text:
+                continue
+            words = [v.split() for v in text]
+            value_of_word = np.repeat(np.arange(len(text)), np.fromiter(map(len, words), dtype=np.int64, count=len(words)))
+            word_codes, distinct = pd.factorize(np.array(list(chain.from_iterable(words)), dtype=object))
+            if not len(distinct):
+                continue
+            # Terms of each distinct word, as ids in the segment vocabulary (CSR: word -> terms)
+            analyzed = [[vocab.setdefault(t, len(vocab)) for t in analyze(w)] for w in distinct]
+            per_word = np.fromiter(map(len, analyzed), dtype=np.int64, count=len(analyzed))
+            word_terms = np.fromiter(chain.from_iterable(analyzed), dtype=np.int64, count=int(per_word.sum()))
+            word_start = np.r_[0, np.cumsum(per_word)[:-1]]
+
+            n = per_word[word_codes]
+            total = int(n.sum())
+            ends = np.cumsum(n)
+            terms = word_terms[np.repeat(word_start[word_codes] - (ends - n), n) + np.arange(total)]
+            values = np.repeat(value_of_word, n)
+            ntok = np.bincount(values, minlength=len(column.values)).astype(np.float32)
+            self.length += ntok[column.codes]
+
+            pairs, counts = np.unique(terms * len(column.values) + values, return_counts=True)
+            term_ids.append(pairs // len(column.values))
+            val_ids.append((pairs % len(column.values)).astype(np.int32))
+            tfs.append(counts.astype(np.float32))
+            col_ids.append(np.full(len(pairs), c, dtype=np.int16))
+
+        self.vocab = {}
+        if not term_ids:
+            self.p_col, self.p_val, self.p_tf = np.zeros(0, np.int16), np.zeros(0, np.int32), np.zeros(0, np.float32)
+            return
+        term_ids = np.concatenate(term_ids)
+        order = np.argsort(term_ids, kind="stable")
+        self.p_col = np.concatenate(col_ids)[order]
+        self.p_val = np.concatenate(val_ids)[order]
+        self.p_tf = np.concatenate(tfs)[order]
+        bounds = np.r_[0, np.cumsum(np.bincount(term_ids, minlength=len(vocab)))]
+        self.vocab = {term: (int(bounds[i]), int(bounds[i + 1])) for term, i in vocab.items() if bounds[i + 1] > bounds[i]}
+
+    def doc_freq(self, term: str) -> int:
+        """Rows containing term (a row counted once per column it occurs in)."""
+        span = self.vocab.get(term)
+        if span is None:
+            return 0
+        cols, vals = self.p_col[span[0]:span[1]], self.p_val[span[0]:span[1]]
+        return int(sum(self.columns[c].counts[vals[cols == c]].sum() for c in np.unique(cols)))
+
+    def term_frequency(self, term: str, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Occurrences of term per row (or per given row), or None if it does not occur in this
+        segment. Without rows the postings are expanded; with rows only those rows are looked up.
+        """
+        span = self.vocab.get(term)
+        if span is None:
+            return None
+        cols, vals, tfs = (a[span[0]:span[1]] for a in (self.p_col, self.p_val, self.p_tf))
+        tf = np.zeros(self.rows if rows is None else len(rows), dtype=np.float32)
+        for c in np.unique(cols):
+            hit = cols == c
+            column = self.columns[c]
+            if rows is None:
+                at, weights = column.rows_of(vals[hit], tfs[hit])
+                tf += np.bincount(at, weights=weights, minlength=self.rows).astype(np.float32)
+            else:
+                per_value = np.zeros(len(column.values), dtype=np.float32)
+                per_value[vals[hit]] = tfs[hit]
+                tf += per_value[column.codes[rows]]
+        return tf
+
+    def frame(self, rows: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame({name: column.values[column.codes[rows]]
+                             for name, column in zip(self.names, self.columns)}).infer_objects()
+
+def _times(fields: pd.DataFrame):
+    """Minute of day and day number (days since 1970) per row; -1 where unknown."""
+    minute = np.full(len(fields), -1, dtype=np.int32)
+    day = np.full(len(fields), -1, dtype=np.int32)
+    for name in fields.columns:
+        if not str(name).startswith("timestamp"):
+            continue
+        column = _Column(fields[name])
+        # Wall-clock time as written: UTC offsets are dropped rather than converted
+        text = pd.Series(column.values[:-1], dtype=object).map(str).str.replace(_OFFSET, "", regex=True)
+        parsed = pd.to_datetime(text, format="ISO8601", errors="coerce")
+        retry = parsed.isna() & text.str.contains(r"\d", regex=True)
+        if retry.any():
+            parsed[retry] = pd.to_datetime(text[retry], format="mixed", errors="coerce")
+        has_clock = text.str.contains(_HAS_CLOCK).to_numpy()
+        time_only = text.str.contains(_TIME_ONLY).to_numpy()
+        ok = parsed.notna().to_numpy()
+        value_minute = np.where(ok & has_clock, parsed.dt.hour.fillna(0) * 60 + parsed.dt.minute.fillna(0), -1)
+        days = (parsed.dt.normalize() - pd.Timestamp(0)).dt.days.fillna(-1).to_numpy()
+        value_day = np.where(ok & ~time_only, days, -1)
+        value_minute = np.append(value_minute, -1).astype(np.int32)[column.codes]
+        value_day = np.append(value_day, -1).astype(np.int32)[column.codes]
+        minute = np.where(minute < 0, value_minute, minute)
+        day = np.where(day < 0, value_day, day)
+    return minute, day
+
+def _time_columns(columns) -> list:
+    """Every timestamp-like column (a Date and a Time column both count)."""
+    return [c for c in columns if resolve_columns([c]).get("timestamp") == c]
+
+def _canonical_fields(frame: pd.DataFrame) -> pd.DataFrame:
+    """Canonical filter fields of a frame, plus its timestamp-like columns as timestamp0, timestamp1..."""
+    resolved = resolve_columns(frame.columns)
+    out = {field: frame[resolved[field]] for field in FILTER_FIELDS if field in resolved}
+    for i, col in enumerate(_time_columns(frame.columns)):
+        out[f"timestamp{i}"] = frame[col]
+    return pd.DataFrame(out, index=frame.index)
+
+def _clock_minutes(hour: str, minute: str, meridiem: str) -> int:
+    h, m = int(hour), int(minute or 0)
+    if meridiem:
+        h = h % 12 + (12 if meridiem.lower() == "pm" else 0)
+    return (h % 24) * 60 + m
+
+def _compare(values: np.ndarray, op: str, bound: int) -> np.ndarray:
+    known = values >= 0
+    if op == ">":
+        return known & (values > bound)
+    if op == ">=":
+        return known & (values >= bound)
+    if op == "<":
+        return known & (values < bound)
+    if op == "<=":
+        return known & (values <= bound)
+    return known & (values == bound)
+
+def parse_time_filters(question: str):
+    """
+    Time-of-day and date conditions in a question ("after 22:00", "between 9pm and 6am",
+    "on 2026-01-05"). Returns ([(description, kind, test)], question without them), where
+    kind is "minute" or "day" and test maps the per-row values to a boolean mask.
+    """
+    filters = []
+    def take(m):
+        return " " * (m.end() - m.start())
+
+    def clock_range(m):
+        lo, hi = _clock_minutes(*m.group(1, 2, 3)), _clock_minutes(*m.group(4, 5, 6))
+        test = (lambda v, lo=lo, hi=hi: _compare(v, ">=", lo) & _compare(v, "<=", hi)) if lo <= hi else \
+               (lambda v, lo=lo, hi=hi: _compare(v, ">=", lo) | _compare(v, "<=", hi))
+        filters.append((f"time {m.group(0).strip()}", "minute", test))
+        return take(m)
+
+    def date_range(m):
+        lo, hi = (int((pd.Timestamp(d) - pd.Timestamp(0)).days) for d in m.group(1, 2))
+        filters.append((f"date {m.group(0).strip()}", "day",
+                        lambda v, lo=lo, hi=hi: _compare(v, ">=", lo) & _compare(v, "<=", hi)))
+        return take(m)
+
+    def clock_at(m):
+        op, hour, minute, meridiem = m.group(1, 2, 3, 4)
+        if minute is None and meridiem is None:
+            return m.group(0) # a bare number is not a time
+        bound = _clock_minutes(hour, minute, meridiem)
+        word = (op or "").lower()
+        if word in _LOWER:
+            test = lambda v, b=bound, o=_LOWER[word]: _compare(v, o, b)
+        elif word in _UPPER:
+            test = lambda v, b=bound, o=_UPPER[word]: _compare(v, o, b)
+        else: # "at 22:00": within that hour
+            test = lambda v, b=bound: _compare(v, ">=", b) & _compare(v, "<", b + 60)
+        filters.append((f"time {m.group(0).strip()}", "minute", test))
+        return take(m)
+
+    def date_at(m):
+        op, date = m.group(1, 2)
+        try:
+            bound = int((pd.Timestamp(date) - pd.Timestamp(0)).days)
+        except ValueError:
+            return m.group(0)
+        word = (op or "").lower()
+        o = _LOWER.get(word) or _UPPER.get(word) or "=="
+        filters.append((f"date {m.group(0).strip()}", "day", lambda v, b=bound, o=o: _compare(v, o, b)))
+        return take(m)
+
+    rest = _DATE_RANGE.sub(date_range, question)
+    rest = _DATE_AT.sub(date_at, rest)
+    rest = _CLOCK_RANGE.sub(clock_range, rest)
+    rest = _CLOCK_AT.sub(clock_at, rest)
+    return filters, rest
+
+class LogIndex:
+    """
+    Local retrieval index over an anonymized log, built incrementally with add(). Questions
+    are answered by search(): field values named in the question (user, equipment, action,
+    status) and time/date conditions filter rows through column indexes, and the remaining
+    words rank them with BM25. context() packs the best rows into a token budget.
+    """
+    def __init__(self, segment_rows: int = SEGMENT_ROWS):
+        self.segment_rows = segment_rows
+        self.segments = []
+        self.rows = 0
+        self.columns = None
+        self.keys = {field: {} for field in FILTER_FIELDS} # value key -> {values}
+
+    @property
+    def nbytes(self) -> int:
+        total = 0
+        for seg in self.segments:
+            arrays = [seg.p_col, seg.p_val, seg.p_tf, seg.length, seg.chars, seg.minute, seg.day]
+            for column in seg.columns + list(seg.fields.values()):
+                arrays += [column.codes, column.order, column.starts, column.counts]
+                total += sum(len(str(v)) + 49 for v in column.values[:1000]) * max(len(column.values) / 1000, 1)
+            total += sum(a.nbytes for a in arrays) + len(seg.vocab) * 120
+        return int(total)
+
+    def add(self, data) -> int:
+        """Appends rows (DataFrame, text, or a list of lines); returns the number added."""
+        if isinstance(data, pd.DataFrame):
+            frame, fields = data.reset_index(drop=True), None
+        else:
+            lines = data.splitlines() if isinstance(data, str) else [line.rstrip("\r\n") for line in data]
+            frame = pd.DataFrame({"entry": pd.Series(lines, dtype=object)})
+            # Free text: only the timestamp and user parsed from each line are usable as fields
+            fields = parse_text_log("\n".join(lines))[["timestamp", "user"]].rename(columns={"timestamp": "timestamp0"})
+        if self.columns is None:
+            self.columns = list(frame.columns)
+        elif list(frame.columns) != self.columns:
+            frame = frame.reindex(columns=self.columns)
+        if fields is None:
+            fields = _canonical_fields(frame)
+
+        start = time.perf_counter()
+        for lo in range(0, len(frame), self.segment_rows):
+            part = slice(lo, lo + self.segment_rows)
+            # Timestamps are searched through the time filters, not as words
+            seg = _Segment(frame.iloc[part], fields.iloc[part], self.rows, skip=_time_columns(self.columns))
+            for field, column in seg.fields.items():
+                keys = self.keys[field]
+                for value in column.values[:-1]:
+                    keys.setdefault(_value_key(value), set()).add(value)
+            self.segments.append(seg)
+            self.rows += seg.rows
+        logger.info(f"Indexed {len(frame):,} rows in {time.perf_counter() - start:.2f}s ({len(self.segments)} segments)")
+        return len(frame)
+
+    def _field_filters(self, question: str) -> list:
+        words = _TERM.findall(question.lower())
+        grams = {" ".join(words[i:i + n]) for n in range(1, FIELD_NGRAM + 1) for i in range(len(words) - n + 1)}
+        filters = []
+        for field, keys in self.keys.items():
+            values = set()
+            for gram in grams:
+                if gram not in STOPWORDS and not gram.isdigit():
+                    values |= keys.get(gram, set())
+            if values:
+                filters.append((field, values))
+        return filters
+
+    def search(self, question: str, limit: int = None, use_filters: bool = True) -> Retrieval:
+        """
+        Rows relevant to a question, best first (global 0-based row numbers), at most limit.
+        Rows must match every field value and time condition named in the question; among
+        them, rows are ranked by BM25 over its words (ties and word-less questions keep log
+        order). matched counts every qualifying row, not only those returned.
+        """
+        start = time.perf_counter()
+        time_filters, rest = parse_time_filters(question) if use_filters else ([], question)
+        field_filters = self._field_filters(rest) if use_filters else []
+        terms = list(dict.fromkeys(t for t in analyze(rest) if t not in STOPWORDS))
+
+        # BM25 over the whole index: document frequency and average length across segments
+        avgdl = max(sum(float(seg.length.sum()) for seg in self.segments) / max(self.rows, 1), 1.0)
+        df = {t: sum(seg.doc_freq(t) for seg in self.segments) for t in terms}
+        idf = {t: np.log(1 + (self.rows - n + 0.5) / (n + 0.5)) for t, n in df.items() if n}
+
+        rows, scores = [], []
+        for seg in self.segments:
+            mask = None
+            for field, values in field_filters:
+                column = seg.fields.get(field)
+                wanted = np.zeros(len(column.values) if column else 1, dtype=bool)
+                for code in (column.code(v) for v in values) if column else ():
+                    if code is not None:
+                        wanted[code] = True
+                hit = wanted[column.codes] if column else np.zeros(seg.rows, dtype=bool)
+                mask = hit if mask is None else mask & hit
+            for _, kind, test in time_filters:
+                hit = test(seg.minute if kind == "minute" else seg.day)
+                mask = hit if mask is None else mask & hit
+            if mask is None and not idf:
+                continue
+
+            # Named fields/times select rows and words only rank them; otherwise a row needs a matching word
+            hit = np.flatnonzero(mask) if mask is not None else None
+            score = np.zeros(seg.rows if hit is None else len(hit), dtype=np.float32)
+            length = seg.length if hit is None else seg.length[hit]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl)
+            for t, weight in idf.items():
+                f = seg.term_frequency(t, hit)
+                if f is not None:
+                    score += weight * f * (BM25_K1 + 1) / (f + norm)
+            if hit is None:
+                hit = np.flatnonzero(score)
+                score = score[hit]
+            rows.append(hit + seg.offset)
+            scores.append(score)
+
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        scores = np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+        matched = len(rows)
+        if idf and matched:
+            if limit is not None and matched > limit:
+                top = np.argpartition(-scores, limit - 1)[:limit]
+                rows, scores = rows[top], scores[top]
+            ranked = np.lexsort((rows, -scores))
+            rows = rows[ranked]
+        elif limit is not None:
+            rows = rows[:limit]
+        descriptions = [f"{field} = {', '.join(sorted(map(str, values)))}" for field, values in field_filters]
+        descriptions += [description for description, _, _ in time_filters]
+        return Retrieval(rows, matched, list(idf), descriptions, time.perf_counter() - start)
+
+    def row_chars(self, rows: np.ndarray) -> np.ndarray:
+        """CSV characters per row (for budgeting before materializing rows)."""
+        out = np.zeros(len(rows), dtype=np.int64)
+        offsets = np.array([seg.offset for seg in self.segments])
+        where = np.searchsorted(offsets, rows, side="right") - 1
+        for i, seg in enumerate(self.segments):
+            hit = where == i
+            if hit.any():
+                out[hit] = seg.chars[rows[hit] - seg.offset]
+        return out
+
+    def take(self, rows: np.ndarray) -> pd.DataFrame:
+        """The given rows (global row numbers, ascending) as a DataFrame."""
+        offsets = np.array([seg.offset for seg in self.segments])
+        where = np.searchsorted(offsets, rows, side="right") - 1
+        parts = [seg.frame(rows[where == i] - seg.offset) for i, seg in enumerate(self.segments) if (where == i).any()]
+        if not parts:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+
+    def context(self, question: str, token_budget: int):
+        """
+        Gemini context for one question: the most relevant rows that fit token_budget, in log
+        order with their 1-based row numbers. If no row meets every condition, the rows
+        matching most of the question's words are sent instead. Returns (text, summary).
+        """
+        limit = max(token_budget * 4 // MIN_ROW_CHARS, 1)
+        found = self.search(question, limit=limit)
+        note = "; ".join(found.filters + ([f"ranked by: {' '.join(found.terms)}"] if found.terms else []))
+        if not found.matched and found.filters:
+            relaxed = self.search(question, limit=limit, use_filters=False)
+            if relaxed.matched:
+                note = f"no row matches all of: {', '.join(found.filters)}; closest rows by words shown"
+                found = relaxed
+        rows = found.rows
+        if not found.matched:
+            # Nothing matched: the first rows, so the model still sees the log's shape
+            rows = np.arange(min(self.rows, limit))
+            note = "no rows matched the question; leading rows shown"
+
+        # Rough cut before packing: row text plus its _row number
+        cost = np.cumsum(self.row_chars(rows) + 8)
+        rows = np.sort(rows[:int(np.searchsorted(cost, token_budget * 4 * 0.9, side="right"))])
+        window = self.take(rows)
+        window.insert(0, "_row", rows + 1)
+        shown = f"{len(rows):,} of {found.matched:,} matching rows" if found.matched else f"first {len(rows):,} rows"
+        header = f"### RETRIEVED ROWS (anonymized; _row = 1-based row number; {shown} out of {self.rows:,}; {note})\n"
+        packed = pack_context(window, token_budget=max(token_budget - len(header) // 4, 1000), collapse=False)
+        shown = f"{packed.rows:,} of {found.matched:,} matching rows" if found.matched else "no matching rows"
+        summary = f"{shown} ({self.rows:,} indexed), ~{packed.tokens:,} tokens, search {found.seconds * 1000:.0f} ms"
+        return header + packed.text, summary
+
+def build_index(source, segment_rows: int = SEGMENT_ROWS) -> LogIndex:
+    """Index a log given whole (DataFrame or text) or as an iterable of chunks (DataFrames or lists of lines)."""
+    index = LogIndex(segment_rows)
+    if isinstance(source, (pd.DataFrame, str)):
+        index.add(source)
+    else:
+        for chunk in source:
+            index.add(chunk)
+    return index
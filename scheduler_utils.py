@@ -0,0 +1,338 @@
+import os
+import re
+import time
+import json
+import queue
+import random
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# Free-tier Flash defaults; override per deployment
+DEFAULT_RPM = 15
+DEFAULT_TPM = 1_000_000
+DEFAULT_MAX_CONCURRENCY = 4
+
+RETRYABLE_CODES = (429, 500, 503)
+
+_STREAM_DONE = object()
+# How often a running stream checks its cancel_event while waiting for the next chunk
+STREAM_CANCEL_POLL = 0.05
+
+def retry_after_seconds(exc):
+    """Server-requested delay from a Retry-After header or a RetryInfo detail, if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(float(value), 0.0)
+            except ValueError:
+                try:
+                    return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+                except (TypeError, ValueError):
+                    pass
+    details = getattr(exc, "details", None)
+    if details:
+        match = re.search(r'"retryDelay":\s*"(\d+(?:\.\d+)?)s"', json.dumps(details, default=str))
+        if match:
+            return float(match.group(1))
+    return None
+
+def is_retryable(exc) -> bool:
+    code = getattr(exc, "code", None)
+    if isinstance(code, int) and code in RETRYABLE_CODES:
+        return True
+    # google.api_core style exceptions
+    return type(exc).__name__ in ("ResourceExhausted", "ServiceUnavailable", "TooManyRequests")
+
+class TokenBucket:
+    """Refills per_minute units per minute up to a burst of per_minute."""
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount: float) -> float:
+        """Seconds until amount units are available (0 if now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def drain(self):
+        self._refill()
+        self.level = min(self.level, 0.0)
+
+class _Job:
+    __slots__ = ("user", "call", "tokens", "future", "enqueued", "attempts", "started")
+
+    def __init__(self, user, call, tokens):
+        self.user = user
+        self.call = call
+        self.tokens = tokens
+        self.future = concurrent.futures.Future()
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+        self.started = False
+
+class RateLimitScheduler:
+    """
+    Process-wide request scheduler for Gemini, shared by all Streamlit sessions.
+    Runs an asyncio loop on a background thread with:
+    - token buckets for requests/min and tokens/min,
+    - bounded concurrency,
+    - round-robin (fair) queuing between users,
+    - Retry-After-aware backoff that pauses the whole queue on 429.
+    Jobs are async callables; callers get a concurrent Future, an awaitable, or a chunk iterator.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_retries: int = 6, max_backoff: float = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._rpm_bucket = TokenBucket(rpm)
+        self._tpm_bucket = TokenBucket(tpm)
+        self._cooldown_until = 0.0
+
+        # Loop-thread state
+        self._queues = {}
+        self._order = deque()
+
+        # Counters (written on the loop thread, read anywhere)
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rate_limited = 0
+        self._waits = deque(maxlen=500)
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True, name="gemini-scheduler")
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self.loop).result()
+
+    @classmethod
+    def get(cls) -> "RateLimitScheduler":
+        """The shared scheduler, configured from GEMINI_RPM / GEMINI_TPM / GEMINI_MAX_CONCURRENCY."""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(
+                    rpm=int(os.getenv("GEMINI_RPM", DEFAULT_RPM)),
+                    tpm=int(os.getenv("GEMINI_TPM", DEFAULT_TPM)),
+                    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                )
+            return cls._instance
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _setup(self):
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self.loop.create_task(self._dispatch())
+
+    # --- Public API (thread-safe) ---
+
+    def submit(self, call, user: str = "default", tokens: int = 0) -> concurrent.futures.Future:
+        """Queues call (an async callable returning the result) and returns a Future."""
+        job = _Job(user, call, tokens)
+        self.loop.call_soon_threadsafe(self._enqueue, job, False)
+        return job.future
+
+    async def run(self, call, user: str = "default", tokens: int = 0):
+        """Awaitable form of submit for async callers on any event loop."""
+        return await asyncio.wrap_future(self.submit(call, user=user, tokens=tokens))
+
+    def stream(self, open_stream, user: str = "default", tokens: int = 0, cancel_event: threading.Event = None):
+        """
+        Iterates the chunks of an async stream. open_stream() must return an awaitable
+        resolving to an async iterator. The request only counts against the limits once;
+        it is retried only if it fails before the first chunk. Setting cancel_event
+        (or closing this iterator) stops consuming the stream and closes the connection
+        within STREAM_CANCEL_POLL seconds, even while waiting on a slow chunk.
+        """
+        chunks = queue.Queue()
+        cancel_event = cancel_event or threading.Event()
+
+        async def watch(task):
+            while not cancel_event.is_set():
+                await asyncio.sleep(STREAM_CANCEL_POLL)
+            task.cancel()
+
+        async def consume():
+            delivered = False
+            watcher = asyncio.ensure_future(watch(asyncio.current_task()))
+            try:
+                iterator = await open_stream()
+                try:
+                    async for chunk in iterator:
+                        if cancel_event.is_set():
+                            break
+                        delivered = True
+                        chunks.put(chunk)
+                finally:
+                    aclose = getattr(iterator, "aclose", None)
+                    if aclose is not None:
+                        await aclose()
+            except asyncio.CancelledError:
+                if not cancel_event.is_set():
+                    raise
+                # Cancelled by the caller: the connection is closed, nothing more is billed
+                self.cancelled += 1
+                return None
+            except Exception as e:
+                if cancel_event.is_set():
+                    self.cancelled += 1
+                    return None
+                if delivered:
+                    # Mid-stream failure: surface it rather than replaying chunks
+                    chunks.put(e)
+                    return None
+                raise
+            finally:
+                watcher.cancel()
+            return None
+
+        future = self.submit(consume, user=user, tokens=tokens)
+        future.add_done_callback(
+            lambda f: chunks.put(f.exception() if not f.cancelled() and f.exception() else _STREAM_DONE)
+        )
+        try:
+            while True:
+                item = chunks.get()
+                if item is _STREAM_DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            cancel_event.set()
+            future.cancel()
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rate_limited": self.rate_limited,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "cooldown": max(self._cooldown_until - time.monotonic(), 0.0),
+        }
+
+    # --- Loop thread ---
+
+    def _enqueue(self, job: _Job, front: bool):
+        q = self._queues.get(job.user)
+        if q is None:
+            q = self._queues[job.user] = deque()
+        if not q and job.user not in self._order:
+            self._order.append(job.user)
+        if front:
+            q.appendleft(job)
+        else:
+            q.append(job)
+        self.queued += 1
+        self._wakeup.set()
+
+    def _next_job(self):
+        """Round-robin over users with queued work."""
+        while self._order:
+            user = self._order.popleft()
+            q = self._queues[user]
+            job = q.popleft()
+            self.queued -= 1
+            if q:
+                self._order.append(user)
+            else:
+                del self._queues[user]
+            if job.future.cancelled():
+                continue
+            return job
+        return None
+
+    async def _wait_for_budget(self, tokens: int):
+        while True:
+            delay = max(
+                self._cooldown_until - time.monotonic(),
+                self._rpm_bucket.delay_for(1),
+                self._tpm_bucket.delay_for(tokens),
+            )
+            if delay <= 0:
+                self._rpm_bucket.take(1)
+                self._tpm_bucket.take(tokens)
+                return
+            await asyncio.sleep(delay)
+
+    async def _dispatch(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._slots.acquire()
+            await self._wait_for_budget(job.tokens)
+            if not job.started:
+                if not job.future.set_running_or_notify_cancel():
+                    self._slots.release()
+                    continue
+                job.started = True
+                self._waits.append(time.monotonic() - job.enqueued)
+            self.in_flight += 1
+            self.loop.create_task(self._execute(job))
+
+    async def _execute(self, job: _Job):
+        try:
+            result = await job.call()
+        except asyncio.CancelledError as e:
+            self.failed += 1
+            job.future.set_exception(e)
+        except Exception as e:
+            if is_retryable(e) and job.attempts < self.max_retries:
+                job.attempts += 1
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = min(self.max_backoff, 2 ** job.attempts) * random.uniform(0.5, 1.0)
+                if getattr(e, "code", None) == 429 or type(e).__name__ == "ResourceExhausted":
+                    # Quota is shared: hold every queued request, not just this one
+                    self.rate_limited += 1
+                    self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+                    self._rpm_bucket.drain()
+                logger.warning(f"Gemini request retry {job.attempts}/{self.max_retries} in {delay:.1f}s: {e}")
+                self.loop.call_later(delay, self._enqueue, job, True)
+            else:
+                self.failed += 1
+                job.future.set_exception(e)
+        else:
+            self.completed += 1
+            job.future.set_result(result)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
@@ -0,0 +1,65 @@
+import re
+import pandas as pd
+
+# Canonical audit-trail fields and the column names different systems use for them
+COLUMN_ALIASES = {
+    "timestamp": ["Timestamp", "DateTime", "Date_Time", "InjectionTime", "EventTime", "Time", "Date"],
+    "user": ["User_ID", "Operator", "User", "UserName", "Username", "Analyst", "Login"],
+    "action": ["Action_Type", "Event", "Action", "Activity", "AuditMsg"],
+    "equipment": ["Equipment_ID", "Equipment", "Instrument", "System", "SampleID"],
+    "status": ["Status", "Result", "Outcome"],
+    "detail": ["Detail", "Details", "Message", "Msg", "Comment", "AuditMsg"],
+    "department": ["Department", "Dept", "Site", "Area"],
+}
+
+CANONICAL_FIELDS = list(COLUMN_ALIASES)
+
+def _key(name) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+def resolve_columns(columns) -> dict:
+    """Maps canonical field -> actual column name for the fields present (case/punctuation-insensitive)."""
+    by_key = {}
+    for col in columns:
+        by_key.setdefault(_key(col), col)
+    resolved = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            col = by_key.get(_key(alias))
+            if col is not None:
+                resolved[field] = col
+                break
+    return resolved
+
+# Template-mined TXT logs (template_utils): line number, template and unmatched lines
+TEMPLATE_COLUMNS = ("Line", "Template", "Message")
+
+def context_columns(columns) -> list:
+    """
+    Columns the AI context, pre-screen windows and retrieval index read: every column named
+    like a canonical field plus the template columns, in their order. All columns if none match.
+    """
+    keys = {_key(alias) for aliases in COLUMN_ALIASES.values() for alias in aliases}
+    keys.update(_key(col) for col in TEMPLATE_COLUMNS)
+    picked = [col for col in columns if _key(col) in keys]
+    return picked or list(columns)
+
+def canonical_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """The canonical fields of df under their canonical names (missing fields are absent)."""
+    return pd.DataFrame({field: df[col] for field, col in resolve_columns(df.columns).items()}, index=df.index)
+
+# Free-text logs: "[2024-01-24 09:00:01] WARN: Failed password attempt for 'Park Ji-sung' ..."
+_LINE_TIMESTAMP = re.compile(r"^\s*\[?(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}(?::\d{2})?)\]?")
+_LINE_USER = re.compile(r"\bUser\b[:\s]+'?([^'\s(),]+(?: [^'\s(),.]+)?)'?")
+
+def parse_text_log(text: str) -> pd.DataFrame:
+    """One row per line with canonical timestamp/user/action/detail parsed where possible."""
+    lines = pd.Series(text.splitlines(), dtype=object)
+    stamp = lines.str.extract(_LINE_TIMESTAMP, expand=False)
+    rest = lines.str.replace(_LINE_TIMESTAMP, "", regex=True).str.strip()
+    return pd.DataFrame({
+        "timestamp": stamp,
+        "user": rest.str.extract(_LINE_USER, expand=False),
+        "action": rest,
+        "detail": rest,
+    })
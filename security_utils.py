@@ -1,24 +1,150 @@
-from presidio_analyzer import AnalyzerEngine
-from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.entities import OperatorConfig
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import numpy as np
 import pandas as pd
 import logging
+import os
+from cache_utils import MaskCache
+from profiler_utils import profile_dataframe, recheck_plan, text_columns, ROLE_MASKER, ROLE_PATTERNS, ROLE_TAGS, ROLE_EMAIL
+from telemetry_utils import span
+from ingest_utils import LEAN_CATEGORY_RATIO
+
+# Presidio and spaCy are imported when the engine is first built (see _build_analyzer):
+# importing them takes seconds and the login page doesn't need them.
 
 # Logger setup
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+PII_ENTITIES = ["PERSON", "PHONE_NUMBER", "EMAIL_ADDRESS", "IP_ADDRESS"]
+
+DEFAULT_BATCH_SIZE = 256
+
+
+# Bump when masking output changes for the same model/entities (invalidates cached masks)
+ANONYMIZER_VERSION = "2"
+
+# SPACY_MODEL picks the NER model; the smaller ones load faster and use less memory
+DEFAULT_SPACY_MODEL = "en_core_web_lg"
+SPACY_MODELS = ["en_core_web_lg", "en_core_web_md", "en_core_web_sm"]
+# Only the entity recognizer is used; these components are never loaded
+UNUSED_PIPES = ["parser", "senter", "tagger", "morphologizer", "attribute_ruler", "lemmatizer"]
+
+def spacy_model_name() -> str:
+    return os.getenv("SPACY_MODEL", DEFAULT_SPACY_MODEL)
+
+def _lower_lemma(doc):
+    """Stands in for the lemmatizer: Presidio's context words are matched against lemmas."""
+    for token in doc:
+        token.lemma_ = token.lower_
+    return doc
+
+def load_ner_pipeline(model: str = None):
+    """spaCy pipeline trimmed to what PII detection needs: tokenizer and NER."""
+    import spacy
+    from spacy.language import Language
+
+    nlp = spacy.load(model or spacy_model_name(), exclude=UNUSED_PIPES)
+    # The shared tok2vec only feeds the tagger/parser in the en_core_web models; NER has its own
+    if "tok2vec" in nlp.pipe_names and not nlp.get_pipe("tok2vec").listening_components:
+        nlp.remove_pipe("tok2vec")
+    if not Language.has_factory("lower_lemma"):
+        Language.component("lower_lemma", func=_lower_lemma)
+    nlp.add_pipe("lower_lemma", last=True)
+    return nlp
+
+def _build_analyzer(model: str = None):
+    """AnalyzerEngine over the trimmed pipeline with only the recognizers for PII_ENTITIES."""
+    from presidio_analyzer import AnalyzerEngine, RecognizerRegistry
+    from presidio_analyzer.nlp_engine import SpacyNlpEngine
+    from presidio_analyzer.predefined_recognizers import SpacyRecognizer, PhoneRecognizer, EmailRecognizer, IpRecognizer
+
+    model = model or spacy_model_name()
+    nlp_engine = SpacyNlpEngine(models=[{"lang_code": "en", "model_name": model}])
+    nlp_engine.nlp = {"en": load_ner_pipeline(model)}
+
+    registry = RecognizerRegistry(supported_languages=["en"])
+    for recognizer in (SpacyRecognizer(supported_entities=["PERSON"]), PhoneRecognizer(), EmailRecognizer(), IpRecognizer()):
+        registry.add_recognizer(recognizer)
+    return AnalyzerEngine(registry=registry, nlp_engine=nlp_engine, supported_languages=["en"])
+
+def _anonymize_chunk(texts: list, batch_size: int) -> list:
+    """Process pool worker: masks one chunk of values with this process's engine."""
+    return SecurityEngine()._batch_masks(texts, batch_size=batch_size)
+
 class SecurityEngine:
     _instance = None
+    _instance_lock = threading.Lock()
+    _warmup = None
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(SecurityEngine, cls).__new__(cls)
-            cls._instance.analyzer = AnalyzerEngine()
-            cls._instance.anonymizer = AnonymizerEngine()
-            logger.info("SecurityEngine initialized with Presidio Analyzer & Anonymizer")
+            with cls._instance_lock:
+                if cls._instance is None: # built by another thread (warm-up) while we waited
+                    from presidio_anonymizer import AnonymizerEngine
+                    from presidio_anonymizer.entities import OperatorConfig
+                    with span("engine.load", model=spacy_model_name()):
+                        instance = super(SecurityEngine, cls).__new__(cls)
+                        instance.analyzer = _build_analyzer()
+                        instance.anonymizer = AnonymizerEngine()
+                        instance.operators = {
+                            "PERSON": OperatorConfig("replace", {"new_value": "<PERSON>"}),
+                            "PHONE_NUMBER": OperatorConfig("replace", {"new_value": "<PHONE>"}),
+                            "EMAIL_ADDRESS": OperatorConfig("replace", {"new_value": "<EMAIL>"}),
+                            "IP_ADDRESS": OperatorConfig("replace", {"new_value": "<IP_ADDRESS>"}),
+                        }
+                        instance.cache = instance._build_cache()
+                    cls._instance = instance
+                    logger.info(f"SecurityEngine initialized with Presidio Analyzer & Anonymizer ({spacy_model_name()})")
         return cls._instance
 
+    @classmethod
+    def is_ready(cls) -> bool:
+        return cls._instance is not None
+
+    @classmethod
+    def warm_up(cls):
+        """Builds the engine on a background thread so the first upload doesn't wait for the model."""
+        with cls._instance_lock:
+            if cls._instance is not None or cls._warmup is not None:
+                return
+
+            def run():
+                try:
+                    cls().analyzer.analyze(text="Warm-up for John Smith", entities=PII_ENTITIES, language="en")
+                except Exception as e:
+                    logger.warning(f"SecurityEngine warm-up failed: {e}")
+
+            cls._warmup = threading.Thread(target=run, name="pii-warmup", daemon=True)
+            cls._warmup.start()
+
+    def model_version(self) -> str:
+        """Identifies masking behaviour: spaCy model, entity set and anonymizer version."""
+        nlp = getattr(self.analyzer.nlp_engine, "nlp", None) or {}
+        meta = nlp["en"].meta if "en" in nlp else {}
+        model = f"{meta.get('lang', 'en')}_{meta.get('name', 'unknown')}-{meta.get('version', '0')}"
+        return f"{model}|{','.join(PII_ENTITIES)}|v{ANONYMIZER_VERSION}"
+
+    def _build_cache(self):
+        """Persistent mask cache; disabled with PII_MASK_CACHE=0 or if the cache dir isn't writable."""
+        if os.getenv("PII_MASK_CACHE", "1") == "0":
+            return None
+        try:
+            return MaskCache(namespace=self.model_version())
+        except Exception as e:
+            logger.warning(f"Mask cache disabled: {e}")
+            return None
+
+    def _apply_masks(self, text: str, results) -> str:
+        """Replaces analyzer hits in text with entity tags."""
+        anonymized_result = self.anonymizer.anonymize(
+            text=text,
+            analyzer_results=results,
+            operators=self.operators
+        )
+        return anonymized_result.text
+
     def anonymize_text(self, text: str) -> str:
         """
         Analyzes and anonymizes PII in the given text using Presidio.
@@ -26,41 +152,208 @@ class SecurityEngine:
         if not isinstance(text, str) or not text:
             return text
 
+        if self.cache is not None:
+            cached = self.cache.get(text)
+            if cached is not None:
+                return cached
+
         try:
             # Analyze
-            results = self.analyzer.analyze(text=text, entities=["PERSON", "PHONE_NUMBER", "EMAIL_ADDRESS", "IP_ADDRESS"], language='en')
-            
+            results = self.analyzer.analyze(text=text, entities=PII_ENTITIES, language='en')
+
             # Anonymize with replacement tags
-            anonymized_result = self.anonymizer.anonymize(
-                text=text,
-                analyzer_results=results,
-                operators={
-                    "PERSON": OperatorConfig("replace", {"new_value": "<PERSON>"}),
-                    "PHONE_NUMBER": OperatorConfig("replace", {"new_value": "<PHONE>"}),
-                    "EMAIL_ADDRESS": OperatorConfig("replace", {"new_value": "<EMAIL>"}),
-                    "IP_ADDRESS": OperatorConfig("replace", {"new_value": "<IP_ADDRESS>"}),
-                }
-            )
-            return anonymized_result.text
+            masked = self._apply_masks(text, results)
         except Exception as e:
             logger.error(f"Error anonymizing text: {e}")
             return text
 
-    def anonymize_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.cache is not None:
+            self.cache.put(text, masked)
+        return masked
+
+    def _batch_masks(self, texts: list, batch_size: int = DEFAULT_BATCH_SIZE) -> list:
+        """
+        Masks a list of non-empty strings through nlp.pipe.
+        Entries that fail to analyze come back as None so they are never cached.
+        """
+        if not texts:
+            return []
+        try:
+            from presidio_analyzer import BatchAnalyzerEngine
+            batch_analyzer = BatchAnalyzerEngine(analyzer_engine=self.analyzer)
+            all_results = batch_analyzer.analyze_iterator(
+                texts, language='en', batch_size=batch_size, entities=PII_ENTITIES
+            )
+        except Exception as e:
+            logger.error(f"Batch analysis failed: {e}")
+            return [None] * len(texts)
+
+        out = []
+        for text, results in zip(texts, all_results):
+            try:
+                out.append(self._apply_masks(text, results))
+            except Exception as e:
+                logger.error(f"Error anonymizing text: {e}")
+                out.append(None)
+        return out
+
+    def anonymize_values(self, values: list, batch_size: int = DEFAULT_BATCH_SIZE, n_process: int = 1,
+                         masks: dict = None) -> list:
+        """
+        Anonymizes many values, spreading batches over a process pool when n_process > 1.
+        Cached values skip NER; new masks are added to the cache.
+        masks ({value: mask}, shared across calls such as the chunks of one stream) is
+        consulted before the cache and gets every new mask, so it works with the cache off.
+        """
+        values = list(values)
+        with span("anonymize.values", values=len(values), n_process=n_process) as sp:
+            return self._anonymize_values(values, batch_size, n_process, sp, masks)
+
+    def _anonymize_values(self, values: list, batch_size: int, n_process: int, sp, masks: dict = None) -> list:
+        todo = list(dict.fromkeys(v for v in values if isinstance(v, str) and v))
+        known = {v: masks[v] for v in todo if v in masks} if masks else {}
+        todo = [v for v in todo if v not in known]
+        done = self.cache.get_many(todo) if self.cache is not None else {}
+        todo = [v for v in todo if v not in done]
+        sp.set(unique=len(todo) + len(done) + len(known), cache_hits=len(done), reused=len(known))
+
+        if n_process <= 1 or len(todo) < batch_size * 2:
+            masked = self._batch_masks(todo, batch_size=batch_size)
+        else:
+            # Several chunks per worker so a slow chunk doesn't leave other cores idle
+            n_chunks = min(n_process * 4, -(-len(todo) // batch_size))
+            step = -(-len(todo) // n_chunks)
+            chunks = [todo[i:i + step] for i in range(0, len(todo), step)]
+
+            # fork lets workers inherit the already loaded spaCy model instead of reloading it
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("fork" if "fork" in methods else None)
+            with ProcessPoolExecutor(max_workers=n_process, mp_context=ctx) as pool:
+                masked = [v for chunk in pool.map(_anonymize_chunk, chunks, [batch_size] * len(chunks)) for v in chunk]
+
+        fresh = {v: m for v, m in zip(todo, masked) if m is not None}
+        if self.cache is not None:
+            self.cache.put_many(fresh)
+        done.update(fresh)
+        if masks is not None:
+            masks.update(done)
+        done.update(known)
+        # Same contract as anonymize_text: failures and non-strings come back unchanged
+        return [done.get(v, v) if isinstance(v, str) else v for v in values]
+
+    def profile_dataframe(self, df: pd.DataFrame, sample_size: int = 500) -> dict:
+        """
+        Builds a masking plan {column: role} so structured columns can skip NER.
+        """
+        probe = lambda vals: self.anonymize_values(vals)
+        with span("anonymize.profile", rows=len(df), columns=len(df.columns)):
+            return profile_dataframe(df, probe=probe, sample_size=sample_size)
+
+    def recheck_plan(self, df: pd.DataFrame, plan: dict, seen: dict) -> dict:
+        """
+        Keeps a plan profiled on earlier rows safe for df: new values of skipped
+        columns are probed and a column holding PII is moved to NER (see profiler_utils.recheck_plan).
+        """
+        probe = lambda vals: self.anonymize_values(vals)
+        with span("anonymize.recheck", rows=len(df)):
+            return recheck_plan(df, plan, probe, seen)
+
+    def _mask_uniques(self, unique_vals, role: str, batch_size: int, n_process: int, masks: dict = None) -> list:
+        """Masks the distinct values of one column with the masker chosen for its role."""
+        raw = [str(val) for val in unique_vals]
+        pattern = ROLE_PATTERNS.get(role)
+        hits = [False] * len(raw)
+        if pattern is not None and ROLE_MASKER.get(role) != "ner":
+            hits = pd.Series(raw, dtype=object).str.fullmatch(pattern).tolist()
+            if role == ROLE_EMAIL:
+                from presidio_analyzer.predefined_recognizers import EmailRecognizer
+                validator = EmailRecognizer()
+                hits = [hit and validator.validate_result(val) for hit, val in zip(hits, raw)]
+
+        # Values the pattern doesn't cover still get the full analyzer
+        rest = [val for val, hit in zip(raw, hits) if not hit]
+        if batch_size is None:
+            rest_masked = iter([masks[val] if masks and val in masks else self.anonymize_text(val) for val in rest])
+        else:
+            rest_masked = iter(self.anonymize_values(rest, batch_size=batch_size, n_process=n_process, masks=masks))
+
+        tag = ROLE_TAGS.get(role)
+        return [(tag or val) if hit else next(rest_masked) for val, hit in zip(raw, hits)]
+
+    def anonymize_dataframe(self, df: pd.DataFrame, batch_size: int = None, n_process: int = 1,
+                            plan: dict = None, lean: bool = False, masks: dict = None) -> pd.DataFrame:
         """
         Anonymizes string columns in a Pandas DataFrame.
+        batch_size=None keeps the per-value path; otherwise unique values are sent
+        through the NLP pipeline in batches over n_process worker processes.
+        plan ({column: role}, see profile_dataframe) picks a cheaper masker per column;
+        columns missing from the plan get full NER.
+        Columns that are not masked share their data with df instead of being copied.
+        lean=True returns low-cardinality masked columns as categoricals (same values).
+        masks: {value: mask} reused across calls (see anonymize_values).
+        """
+        with span("anonymize.dataframe", rows=len(df), columns=len(df.columns), lean=lean):
+            df_masked = df.copy(deep=False)
+            plan = plan or {}
+
+            # Select string columns (object type, or categoricals of strings)
+            obj_cols = text_columns(df_masked)
+
+            for col in obj_cols:
+                role = plan.get(col)
+                if ROLE_MASKER.get(role) == "skip" and role not in ROLE_PATTERNS:
+                    logger.info(f"Skipping column: {col} ({role})")
+                    continue
+
+                logger.info(f"Anonymizing column: {col}" + (f" ({role})" if role else ""))
+                with span("anonymize.column", column=str(col), role=role, rows=len(df_masked)) as sp:
+                    if lean:
+                        df_masked[col] = self._mask_categorical(df_masked[col], role, batch_size, n_process, sp, masks)
+                        continue
+                    # Unique values optimization: Anonymize unique values map, then replace
+                    # This is much faster than applying to every row if there are duplicates
+                    unique_vals = df_masked[col].dropna().unique()
+                    sp.set(unique=len(unique_vals))
+                    masked = self._mask_uniques(unique_vals, role, batch_size, n_process, masks)
+                    if masked == list(unique_vals):
+                        continue # nothing to mask: the column stays shared with df
+                    val_map = dict(zip(unique_vals, masked))
+                    df_masked[col] = df_masked[col].map(val_map)
+
+            return df_masked
+
+    def _mask_categorical(self, column: pd.Series, role: str, batch_size: int, n_process: int, sp,
+                          masks: dict = None) -> pd.Series:
+        """
+        Masks a column through its codes: only the distinct values (the categories of a
+        categorical) are rewritten. Low-cardinality results stay categorical; a column
+        with nothing to mask is returned as it is.
         """
-        df_masked = df.copy()
-        
-        # Select string columns (object type)
-        obj_cols = df_masked.select_dtypes(include=['object']).columns
-        
-        for col in obj_cols:
-            logger.info(f"Anonymizing column: {col}")
-            # Unique values optimization: Anonymize unique values map, then replace
-            # This is much faster than applying to every row if there are duplicates
-            unique_vals = df_masked[col].dropna().unique()
-            val_map = {val: self.anonymize_text(str(val)) for val in unique_vals}
-            df_masked[col] = df_masked[col].map(val_map)
-            
-        return df_masked
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            column = column.cat.remove_unused_categories()
+            codes, unique_vals = column.cat.codes.to_numpy(), column.cat.categories
+        else:
+            codes, unique_vals = pd.factorize(column)
+        sp.set(unique=len(unique_vals))
+        pattern = ROLE_PATTERNS.get(role)
+        if pattern is not None and role not in ROLE_TAGS and isinstance(unique_vals.dtype, pd.StringDtype):
+            # Values that fit the pattern (e.g. timestamps) are kept: matching them on the
+            # column's own storage avoids a Python string per value. The vectorized match is
+            # ASCII-only, so anything it rejects still gets the full check below.
+            todo = ~np.asarray(unique_vals.str.fullmatch(pattern.pattern), dtype=bool)
+            if not todo.any():
+                return column
+            masked = np.array(unique_vals, dtype=object)
+            masked[todo] = self._mask_uniques(unique_vals[todo], role, batch_size, n_process, masks)
+            masked = list(masked)
+        else:
+            masked = self._mask_uniques(unique_vals, role, batch_size, n_process, masks)
+        if masked == list(unique_vals):
+            return column
+        # Different values often share a mask (<PERSON>): merge them into one category
+        mask_codes, categories = pd.factorize(pd.Series(masked, dtype=object))
+        codes = np.where(codes >= 0, mask_codes[codes], -1)
+        if len(categories) > LEAN_CATEGORY_RATIO * len(column):
+            values = pd.Series(categories.take(np.maximum(codes, 0)), index=column.index, name=column.name, dtype="str")
+            return values.where(codes >= 0)
+        return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=column.index, name=column.name)
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import uuid
+import logging
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+from cache_utils import CACHE_DIR, _ensure_dir
+from memo_utils import memo_key
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_MB = 4096
+# String columns with at most this share of distinct values are dictionary-encoded;
+# free text that is mostly unique would only pay for the extra indices
+DICTIONARY_MAX_RATIO = 0.5
+_META_KEY = b"audit.meta"
+
+def store_enabled() -> bool:
+    """MASKED_STORE=0 turns the on-disk store off (e.g. for benchmarks)."""
+    return os.getenv("MASKED_STORE", "1") != "0"
+
+def store_version(engine_version: str, plan: dict = None, mode: str = "dataframe", lean: bool = False) -> str:
+    """
+    Masking configuration a stored log depends on: anonymizer/model version, column plan,
+    mode ("dataframe" for tables; text masked "text" as a whole by the app or "lines" one
+    by one by the batch CLI) and lean (tables masked into categoricals).
+    """
+    return memo_key(engine_version, plan or {}, mode, *(["lean"] if lean else []))[:16]
+
+def _to_arrow(df: pd.DataFrame) -> pa.Table:
+    arrays, names = [], []
+    for col in df.columns:
+        series = df[col]
+        try:
+            arr = pa.array(series, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed object columns (e.g. numbers next to masked strings): keep them as text
+            arr = pa.array(series.map(lambda v: v if v is None or isinstance(v, str) else str(v)), from_pandas=True)
+        if pa.types.is_string(arr.type) or pa.types.is_large_string(arr.type):
+            distinct = series.nunique(dropna=True)
+            if len(series) and distinct <= DICTIONARY_MAX_RATIO * len(series):
+                arr = arr.dictionary_encode()
+        arrays.append(arr)
+        names.append(str(col))
+    return pa.Table.from_arrays(arrays, names=names)
+
+class MaskedStore:
+    """
+    Anonymized logs on disk as uncompressed Arrow IPC (Feather v2) files, one per
+    (source content hash, masking version). Reopening memory-maps the file, so only the
+    pages of the columns/rows actually read are touched. Raw (unmasked) data is never stored.
+    """
+    def __init__(self, root: str = None, max_bytes: int = None):
+        self.root = root or os.path.join(CACHE_DIR, "masked")
+        if max_bytes is None:
+            max_bytes = int(os.getenv("MASKED_STORE_MB", DEFAULT_STORE_MB)) * 2**20
+        self.max_bytes = max_bytes
+
+    def path(self, source_hash: str, version: str) -> str:
+        return os.path.join(self.root, source_hash[:2], f"{source_hash}-{version}.arrow")
+
+    def exists(self, source_hash: str, version: str) -> bool:
+        return os.path.exists(self.path(source_hash, version))
+
+    def save(self, source_hash: str, version: str, data, **meta) -> str:
+        """Stores a masked DataFrame or masked text (one row per line); returns the file path."""
+        if isinstance(data, pd.DataFrame):
+            table = _to_arrow(data.reset_index(drop=True))
+            meta["data_type"] = "dataframe"
+        else:
+            lines = pd.Series(data.split("\n"), dtype=object)
+            table = _to_arrow(pd.DataFrame({"line": lines}))
+            meta["data_type"] = "text"
+        meta.update(source_hash=source_hash, version=version, rows=table.num_rows, created=time.time())
+        table = table.replace_schema_metadata({_META_KEY: json.dumps(meta, default=str).encode()})
+
+        path = self.path(source_hash, version)
+        _ensure_dir(os.path.dirname(path))
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        feather.write_feather(table, tmp, compression="uncompressed")
+        os.replace(tmp, path)
+        self.prune()
+        return path
+
+    def open(self, source_hash: str, version: str, columns: list = None) -> pa.Table:
+        """Memory-mapped table (zero-copy), optionally only some columns; None if not stored."""
+        path = self.path(source_hash, version)
+        try:
+            table = feather.read_table(path, columns=columns, memory_map=True)
+        except FileNotFoundError:
+            return None
+        except (pa.ArrowInvalid, OSError) as e:
+            logger.warning(f"Discarding unreadable masked log {path}: {e}")
+            self._remove(path)
+            return None
+        os.utime(path) # recency for prune
+        return table
+
+    def columns(self, source_hash: str, version: str) -> list:
+        """Column names of a stored log (from the memory-mapped schema), or None if not stored."""
+        table = self.open(source_hash, version)
+        return None if table is None else table.column_names
+
+    @staticmethod
+    def metadata(table: pa.Table) -> dict:
+        raw = (table.schema.metadata or {}).get(_META_KEY)
+        return json.loads(raw) if raw else {}
+
+    def load(self, source_hash: str, version: str, columns: list = None, rows=None):
+        """
+        The stored masked log as it was saved (DataFrame, or text for text logs), or None.
+        columns limits which columns are read; rows (positions) which rows are materialized.
+        Dictionary-encoded columns come back as pandas categoricals.
+        """
+        table = self.open(source_hash, version, columns=columns)
+        if table is None:
+            return None
+        meta = self.metadata(table)
+        if rows is not None:
+            table = table.take(pa.array(rows, type=pa.int64()))
+        if meta.get("data_type") == "text":
+            return "\n".join(table.column("line").to_pylist())
+        return table.to_pandas()
+
+    def evict(self, source_hash: str) -> int:
+        """Removes every stored version of one source."""
+        folder = os.path.join(self.root, source_hash[:2])
+        removed = 0
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                if name.startswith(f"{source_hash}-"):
+                    removed += self._remove(os.path.join(folder, name))
+        return removed
+
+    def _files(self) -> list:
+        out = []
+        if not os.path.isdir(self.root):
+            return out
+        for folder in os.listdir(self.root):
+            base = os.path.join(self.root, folder)
+            if os.path.isdir(base):
+                for name in os.listdir(base):
+                    if name.endswith(".arrow"):
+                        path = os.path.join(base, name)
+                        try:
+                            st = os.stat(path)
+                        except FileNotFoundError: # pruned by another process
+                            continue
+                        out.append((st.st_mtime, st.st_size, path))
+        return out
+
+    def prune(self):
+        """Drops least recently used files until the store fits max_bytes."""
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            total -= size if self._remove(path) else 0
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except OSError:
+            return 0
+
+    def clear(self):
+        for _, _, path in self._files():
+            self._remove(path)
+
+    def stats(self) -> dict:
+        files = self._files()
+        return {"files": len(files), "bytes": sum(size for _, size, _ in files)}
@@ -0,0 +1,118 @@
+"""
+Tail-mode audit: follows append-only audit trails and reviews only what was appended.
+
+Each file keeps a watermark (byte offset, checked against digests of the first bytes and
+of the bytes just before it) in the state directory. Every cycle parses, masks and
+pre-screens the complete lines written since the last cycle, appends them to the masked
+copy and the findings, and asks Gemini to update the report with the new rows only, so
+a cycle costs about the same however long the log already is. A rotated, truncated or
+rewritten file is reviewed again from the start. Reports are written to the output directory.
+
+Usage:
+    python tail_audit.py logs/audit_trail.csv --interval 60
+    python tail_audit.py "logs/*.txt" --once --no-ai
+"""
+import argparse
+import logging
+import os
+import time
+
+from batch_audit import find_inputs
+from context_utils import DEFAULT_CONTEXT_TOKENS
+from tail_utils import TailAuditor, TAIL_DIR, TAIL_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+def render_report(auditor: TailAuditor) -> str:
+    stats = auditor.stats()
+    frame = auditor.summary_frame()
+    lines = [
+        f"# Tail Audit Review: {os.path.basename(auditor.source)}",
+        "",
+        f"- Source: `{auditor.source}`",
+        f"- Rows reviewed: {stats['rows']:,} (up to byte {auditor.state['offset']:,}), flagged rows: {stats['flagged_rows']:,}",
+        f"- Time span: {stats['first']} to {stats['last']}",
+        f"- Masked copy: `{auditor.masked_path}`",
+        "",
+        "## Deterministic Pre-screen",
+        "",
+        frame.to_markdown(index=False) if not frame.empty else "No rules applicable to this file.",
+        "",
+        "## AI Review",
+        "",
+        auditor.report or "_Not run yet (--no-ai, or no rows)._",
+        "",
+    ]
+    if auditor.pending_rows and auditor.report:
+        lines.insert(-2, f"_{auditor.pending_rows:,} rows appended since this review are not covered yet._\n")
+    return "\n".join(lines)
+
+def run_cycle(paths: list, auditors: dict, out_dir: str, ai_engine=None, state_dir: str = None,
+              context_tokens: int = DEFAULT_CONTEXT_TOKENS, progress=print) -> dict:
+    """One pass over every path; returns rows ingested per path."""
+    ingested = {}
+    for path in paths:
+        auditor = auditors.get(path)
+        if auditor is None:
+            auditor = auditors[path] = TailAuditor(path, state_dir=state_dir)
+        try:
+            with open(path, "rb") as f:
+                cycle = auditor.cycle(f)
+        except Exception as e:
+            progress(f"failed: {os.path.basename(path)} ({type(e).__name__}: {e})")
+            continue
+        ingested[path] = cycle.new_rows
+        if cycle.reset:
+            progress(f"{os.path.basename(path)}: no longer matches its watermark, reviewed from the start")
+        if not cycle.new_rows and not cycle.reset:
+            continue
+        note = ""
+        if ai_engine is not None:
+            t = time.perf_counter()
+            report = auditor.update_summary(ai_engine, token_budget=context_tokens)
+            note = f", AI update failed ({report})" if report.startswith("Error") else f", AI {time.perf_counter() - t:.2f}s"
+        report_path = os.path.join(out_dir, f"{os.path.splitext(os.path.basename(path))[0]}_tail.md")
+        tmp = report_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(render_report(auditor))
+        os.replace(tmp, report_path)
+        progress(f"{os.path.basename(path)}: +{cycle.new_rows:,} rows ({cycle.rows:,} total), "
+                 f"+{cycle.new_findings:,} findings in {cycle.seconds:.2f}s{note}")
+    return ingested
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="CSV/TXT files, directories or glob patterns (re-expanded every cycle)")
+    parser.add_argument("--out", default="audit_reports", help="Output directory for the per-file reports")
+    parser.add_argument("--state", default=TAIL_DIR, help="Watermarks, masked copies and findings")
+    parser.add_argument("--interval", type=float, default=30.0, help="Seconds between cycles")
+    parser.add_argument("--once", action="store_true", help="Run a single cycle and exit")
+    parser.add_argument("--context-tokens", type=int, default=DEFAULT_CONTEXT_TOKENS)
+    parser.add_argument("--no-ai", action="store_true", help="Pre-screen only, no Gemini calls")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    os.makedirs(args.out, exist_ok=True)
+
+    ai_engine = None
+    if not args.no_ai:
+        from ai_utils import AIEngine
+        if not os.getenv("GEMINI_API_KEY"):
+            raise SystemExit("GEMINI_API_KEY is not set (use --no-ai for pre-screen-only reports)")
+        ai_engine = AIEngine(user_id="tail")
+
+    auditors = {}
+    try:
+        while True:
+            paths = [p for p in find_inputs(args.inputs) if p.rsplit(".", 1)[-1].lower() in TAIL_EXTENSIONS]
+            if not paths and args.once:
+                raise SystemExit("No CSV/TXT logs found")
+            run_cycle(paths, auditors, args.out, ai_engine=ai_engine, state_dir=args.state,
+                      context_tokens=args.context_tokens)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
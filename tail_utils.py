@@ -0,0 +1,318 @@
+import io
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import namedtuple
+import pandas as pd
+from cache_utils import CACHE_DIR
+from context_utils import pack_context, DEFAULT_CONTEXT_TOKENS
+from ingest_utils import file_extension
+from prescreen_utils import prescreen, flagged_windows, summary_text, RULES
+from schema_utils import parse_text_log
+from security_utils import SecurityEngine, DEFAULT_BATCH_SIZE
+from telemetry_utils import span
+
+logger = logging.getLogger(__name__)
+
+TAIL_DIR = os.getenv("TAIL_STATE_DIR", os.path.join(CACHE_DIR, "tail"))
+TAIL_EXTENSIONS = ("csv", "txt")
+# Bytes hashed at the start of the log and just before the watermark to recognise the same file
+ANCHOR_BYTES = 4096
+STATE_VERSION = 2 # 2: pre-screen carry holds microseconds
+
+# new_rows: rows masked this cycle; rows: total reviewed; reset: the log no longer matched its watermark
+TailCycle = namedtuple("TailCycle", ["new_rows", "rows", "new_findings", "reset", "seconds", "timings"])
+
+def _digest(fileobj, start: int, end: int) -> str:
+    fileobj.seek(start)
+    return hashlib.sha256(fileobj.read(end - start)).hexdigest()
+
+def _write_json_atomic(path: str, payload: dict):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+def _append_csv(path: str, frame: pd.DataFrame) -> int:
+    """Appends rows (with a header if the file is new) and returns the file size."""
+    header = not os.path.exists(path) or os.path.getsize(path) == 0
+    frame.to_csv(path, mode="a", header=header, index=False)
+    return os.path.getsize(path)
+
+class TailAuditor:
+    """
+    Follows one append-only log (CSV or TXT) across runs. A watermark (byte offset plus
+    digests of the first bytes and of the bytes just before it) records how far the log
+    has been reviewed; each cycle masks and pre-screens only the complete lines appended
+    since, appends them to a masked copy and the findings, and leaves them for the next
+    incremental AI update. A log that no longer matches its watermark (rotated, truncated
+    or rewritten) is reviewed again from the start.
+    """
+    def __init__(self, source: str, fmt: str = None, state_dir: str = None, engine: SecurityEngine = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, n_process: int = 1):
+        self.source = source
+        self.format = fmt or file_extension(source)
+        if self.format not in TAIL_EXTENSIONS:
+            raise ValueError(f"Tail mode supports {', '.join(TAIL_EXTENSIONS).upper()} logs, not '{self.format}'")
+        self.dir = os.path.join(state_dir or TAIL_DIR, hashlib.sha256(source.encode()).hexdigest()[:16])
+        os.makedirs(self.dir, exist_ok=True)
+        self._engine = engine
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.state = self._load()
+
+    @property
+    def engine(self) -> SecurityEngine:
+        if self._engine is None:
+            self._engine = SecurityEngine()
+        return self._engine
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    @property
+    def masked_path(self) -> str:
+        return self.path(f"masked.{self.format}")
+
+    def _fresh(self) -> dict:
+        return {
+            "version": STATE_VERSION, "source": self.source, "format": self.format, "engine": None,
+            "offset": 0, "head": None, "anchor": None, "header": None, "plan": None, "seen": {}, "carry": None,
+            "rows": 0, "flagged_rows": 0, "counts": {}, "first": None, "last": None, "users": [],
+            "masked_bytes": 0, "findings_bytes": 0, "pending_bytes": 0,
+            "reviewed_rows": 0, "reviewed_bytes": 0,
+        }
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path("state.json"), encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        if state is None or state.get("version") != STATE_VERSION:
+            self._clear_files()
+            return self._fresh()
+        # Output appended after the last saved state (a crash mid-cycle) is cut off and redone
+        for name, key in ((os.path.basename(self.masked_path), "masked_bytes"), ("findings.csv", "findings_bytes"),
+                          ("pending.csv", "pending_bytes")):
+            path = self.path(name)
+            if os.path.exists(path) and os.path.getsize(path) > state[key]:
+                with open(path, "r+b") as f:
+                    f.truncate(state[key])
+        return state
+
+    def _save(self):
+        _write_json_atomic(self.path("state.json"), self.state)
+
+    def _clear_files(self):
+        for name in os.listdir(self.dir):
+            os.remove(self.path(name))
+
+    def reset(self):
+        """Forgets the watermark and every output; the next cycle starts from the beginning."""
+        self._clear_files()
+        self.state = self._fresh()
+
+    def _matches(self, fileobj, size: int) -> bool:
+        offset = self.state["offset"]
+        if size < offset:
+            return False
+        head = _digest(fileobj, 0, min(offset, ANCHOR_BYTES))
+        anchor = _digest(fileobj, max(offset - ANCHOR_BYTES, 0), offset)
+        return head == self.state["head"] and anchor == self.state["anchor"]
+
+    def cycle(self, fileobj) -> TailCycle:
+        """Masks and pre-screens what was appended to fileobj (a seekable binary file) since the last cycle."""
+        start = time.perf_counter()
+        timings = {}
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        reset = self.state["offset"] > 0 and not self._matches(fileobj, size)
+        if not reset and self.state["engine"] not in (None, self.engine.model_version()):
+            reset = True # masks from another model would not line up with the new ones
+        if reset:
+            logger.info(f"{self.source} no longer matches its watermark; reviewing it from the start")
+            self.reset()
+
+        offset = self.state["offset"]
+        fileobj.seek(offset)
+        data = fileobj.read(size - offset)
+        # Complete lines only: a line still being written waits for the next cycle
+        data = data[:data.rfind(b"\n") + 1]
+        if not data:
+            if reset:
+                self._save()
+            return TailCycle(0, self.state["rows"], 0, reset, time.perf_counter() - start, timings)
+
+        with span("tail.cycle", format=self.format, bytes=len(data)) as sp:
+            new_rows, new_findings = self._ingest(data, timings)
+            sp.set(rows=new_rows)
+
+        end = offset + len(data)
+        self.state.update(
+            offset=end,
+            head=_digest(fileobj, 0, min(end, ANCHOR_BYTES)),
+            anchor=_digest(fileobj, max(end - ANCHOR_BYTES, 0), end),
+            engine=self.engine.model_version(),
+        )
+        self._save()
+        return TailCycle(new_rows, self.state["rows"], new_findings, reset, time.perf_counter() - start, timings)
+
+    def _ingest(self, data: bytes, timings: dict):
+        state = self.state
+        t = time.perf_counter()
+        if self.format == "csv":
+            if state["header"] is None:
+                header, _, data = data.partition(b"\n")
+                state["header"] = header.decode("utf-8")
+            frame = pd.read_csv(io.BytesIO(state["header"].encode("utf-8") + b"\n" + data)) if data.strip() else None
+            screened = frame
+        else:
+            lines = data.decode("utf-8", errors="replace").splitlines()
+            frame = pd.DataFrame({"entry": lines})
+            screened = "\n".join(lines)
+        timings["parse"] = time.perf_counter() - t
+        if frame is None or frame.empty:
+            return 0, 0
+
+        t = time.perf_counter()
+        if self.format == "csv":
+            if state["plan"] is None:
+                state["plan"] = self.engine.profile_dataframe(frame)
+            # New values of skipped columns are probed every cycle (PII may appear later)
+            seen = {col: set(values) for col, values in state["seen"].items()}
+            state["plan"] = self.engine.recheck_plan(frame, state["plan"], seen)
+            state["seen"] = {col: sorted(values) for col, values in seen.items()}
+            masked = self.engine.anonymize_dataframe(frame, batch_size=self.batch_size, n_process=self.n_process,
+                                                     plan=state["plan"])
+        else:
+            masked = pd.DataFrame({"entry": self.engine.anonymize_values(lines, batch_size=self.batch_size,
+                                                                         n_process=self.n_process)})
+        timings["mask"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        screen = prescreen(screened, carry=state["carry"])
+        offset = state["rows"]
+        findings = screen.findings.assign(row=screen.findings["row"] + offset)
+        windows = flagged_windows(screen, masked if self.format == "csv" else "\n".join(masked["entry"]), row_offset=offset)
+        timings["prescreen"] = time.perf_counter() - t
+
+        state["masked_bytes"] = _append_csv(self.masked_path, masked) if self.format == "csv" else self._append_lines(masked["entry"])
+        if not findings.empty:
+            state["findings_bytes"] = _append_csv(self.path("findings.csv"), findings)
+        if not windows.empty:
+            state["pending_bytes"] = _append_csv(self.path("pending.csv"), windows)
+
+        self._merge_stats(screen, frame if self.format == "csv" else parse_text_log(screened))
+        state["carry"] = screen.carry
+        state["rows"] += len(frame)
+        return len(frame), len(findings)
+
+    def _append_lines(self, lines) -> int:
+        with open(self.masked_path, "a", encoding="utf-8", newline="\n") as f:
+            f.writelines(f"{line}\n" for line in lines)
+        return os.path.getsize(self.masked_path)
+
+    def _merge_stats(self, screen, canon_source):
+        state = self.state
+        state["flagged_rows"] += screen.stats["flagged_rows"]
+        for rule in screen.flags.columns:
+            state["counts"][rule] = state["counts"].get(rule, 0) + int(screen.flags[rule].sum())
+        for key, pick in (("first", min), ("last", max)):
+            value = screen.stats[key]
+            if value is not None and not pd.isna(value):
+                known = state[key]
+                state[key] = str(value if known is None else pick(pd.Timestamp(known), value))
+        user = screen.columns.get("user")
+        if user is not None:
+            # Distinct users are counted by digest so no name is written to the state file
+            digests = set(state["users"])
+            digests.update(hashlib.sha256(str(u).encode()).hexdigest()[:16] for u in canon_source[user].dropna().unique())
+            state["users"] = sorted(digests)
+
+    def stats(self) -> dict:
+        state = self.state
+        return {"rows": state["rows"], "flagged_rows": state["flagged_rows"], "first": state["first"],
+                "last": state["last"], "users": len(state["users"]) if state["users"] else None}
+
+    def summary_frame(self) -> pd.DataFrame:
+        """Per-rule row counts over everything reviewed so far."""
+        counts = self.state["counts"]
+        rows = [(rule, *RULES[rule][:2], counts[rule]) for rule in RULES if rule in counts]
+        return pd.DataFrame(rows, columns=["Rule", "Severity", "Principle", "Rows"])
+
+    def findings(self) -> pd.DataFrame:
+        """Every finding so far; row is the 0-based row in the whole log."""
+        path = self.path("findings.csv")
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return pd.DataFrame(columns=["row", "rule", "severity", "principle", "description"])
+        return pd.read_csv(path)
+
+    @property
+    def report(self) -> str:
+        path = self.path("report.md")
+        if not os.path.exists(path):
+            return ""
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    @property
+    def pending_rows(self) -> int:
+        """Rows reviewed locally but not yet by the AI."""
+        return self.state["rows"] - self.state["reviewed_rows"]
+
+    def update_context(self, token_budget: int = DEFAULT_CONTEXT_TOKENS) -> str:
+        """
+        Gemini context for an incremental update: pre-screen statistics for the whole log,
+        then the flagged windows and the rows appended since the last AI review.
+        """
+        state = self.state
+        header = (
+            f"### DETERMINISTIC PRE-SCREEN (local rules over the full log)\n"
+            f"{summary_text(self.stats(), state['counts'])}\n\n"
+            f"### NEW ENTRIES SINCE THE LAST REVIEW: rows {state['reviewed_rows'] + 1:,} to {state['rows']:,} "
+            "(anonymized; _row = 1-based row number)\n"
+        )
+        budget = max(token_budget - len(header) // 4, 1000)
+        parts = [header]
+        if state["pending_bytes"]:
+            windows = pd.read_csv(self.path("pending.csv"))
+            packed = pack_context(windows, token_budget=budget // 2, collapse=False)
+            parts.append(f"#### Flagged windows (_flags = rules hit, ±2 rows of context)\n{packed.text}\n")
+            budget -= packed.tokens
+        with open(self.masked_path, "rb") as f:
+            if self.format == "csv":
+                header = f.readline()
+                f.seek(max(state["reviewed_bytes"], f.tell()))
+                new = pd.read_csv(io.BytesIO(header + f.read()))
+            else:
+                f.seek(state["reviewed_bytes"])
+                new = pd.DataFrame({"entry": f.read().decode("utf-8").splitlines()})
+        new.insert(0, "_row", range(state["reviewed_rows"] + 1, state["reviewed_rows"] + 1 + len(new)))
+        packed = pack_context(new, token_budget=max(budget, 1000), collapse=False)
+        parts.append(f"#### Appended rows ({packed.summary()})\n{packed.text}")
+        return "\n".join(parts)
+
+    def update_summary(self, ai_engine, token_budget: int = DEFAULT_CONTEXT_TOKENS) -> str:
+        """
+        Revises the AI report with the rows appended since it was written (one request whose
+        size depends on the new rows, not on the whole log). Returns the report; nothing
+        changes if there are no new rows or the request failed.
+        """
+        if not self.pending_rows:
+            return self.report
+        with span("tail.update", rows=self.pending_rows):
+            report = ai_engine.update_analysis(self.report, self.update_context(token_budget))
+        if report.startswith("Error"):
+            return report
+        tmp = self.path("report.md.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(report)
+        os.replace(tmp, self.path("report.md"))
+        if os.path.exists(self.path("pending.csv")):
+            os.remove(self.path("pending.csv"))
+        self.state.update(reviewed_rows=self.state["rows"], reviewed_bytes=self.state["masked_bytes"], pending_bytes=0)
+        self._save()
+        return report
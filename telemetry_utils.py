@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import threading
+import itertools
+from collections import deque
+
+try:
+    import resource # POSIX only
+except ImportError:
+    resource = None
+
+# Recent spans kept for the sidebar panel / JSONL export
+DEFAULT_MAX_SPANS = 5000
+# Numeric span attributes summed into Prometheus counters
+COUNTED_ATTRS = ("rows", "bytes", "values", "retries", "prompt_tokens", "output_tokens")
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process (0 where unavailable)."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class _NoopSpan:
+    """Returned while telemetry is off: entering, leaving and set() do nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+_NOOP = _NoopSpan()
+
+class Span:
+    __slots__ = ("telemetry", "name", "attrs", "span_id", "parent_id", "start", "wall_start", "duration", "error")
+
+    def __init__(self, telemetry, name: str, attrs: dict):
+        self.telemetry = telemetry
+        self.name = name
+        self.attrs = attrs
+        self.span_id = next(telemetry._ids)
+        self.parent_id = None
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs):
+        """Adds attributes known only once the work is done (rows, tokens, ...)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = self.telemetry._stack()
+        self.parent_id = stack[-1].span_id if stack else None
+        stack.append(self)
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        stack = self.telemetry._stack()
+        if self in stack: # generators may close spans out of order
+            stack.remove(self)
+        self.telemetry._record(self)
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.wall_start,
+            "seconds": self.duration,
+            "error": self.error,
+            "peak_rss": self.attrs.pop("_peak_rss", None),
+            **self.attrs,
+        }
+
+class Telemetry:
+    """
+    Process-wide span recorder for pipeline stages (parse, anonymize, LLM, upload).
+    Off by default (AUDIT_TELEMETRY=1 or the sidebar toggle turns it on); while off,
+    span() returns a shared no-op object, so instrumented code pays one attribute check.
+    Keeps the most recent spans plus per-name totals for Prometheus export.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, enabled: bool = False, max_spans: int = DEFAULT_MAX_SPANS):
+        self.enabled = enabled
+        self.spans = deque(maxlen=max_spans)
+        self.totals = {} # name -> {"count", "errors", "seconds", "max_seconds", <counted attrs>}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+
+    @classmethod
+    def get(cls) -> "Telemetry":
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(enabled=os.getenv("AUDIT_TELEMETRY", "0") == "1")
+            return cls._instance
+
+    def span(self, name: str, **attrs):
+        """Context manager timing one stage; attributes can be added with .set() inside."""
+        if not self.enabled:
+            return _NOOP
+        return Span(self, name, attrs)
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, span: Span):
+        span.attrs["_peak_rss"] = peak_rss_bytes()
+        record = span.to_dict()
+        with self._lock:
+            self.spans.append(record)
+            total = self.totals.setdefault(span.name, {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0})
+            total["count"] += 1
+            total["errors"] += span.error is not None
+            total["seconds"] += span.duration
+            total["max_seconds"] = max(total["max_seconds"], span.duration)
+            for attr in COUNTED_ATTRS:
+                value = record.get(attr)
+                if isinstance(value, (int, float)):
+                    total[attr] = total.get(attr, 0) + value
+
+    def recent(self, limit: int = None) -> list:
+        with self._lock:
+            spans = list(self.spans)
+        return spans[-limit:] if limit else spans
+
+    def summary(self) -> list:
+        """One row per span name: count, total/avg/max seconds and counted attributes."""
+        with self._lock:
+            totals = {name: dict(t) for name, t in self.totals.items()}
+        rows = []
+        for name, t in sorted(totals.items(), key=lambda kv: -kv[1]["seconds"]):
+            rows.append({"span": name, **t, "avg_seconds": t["seconds"] / t["count"]})
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.totals.clear()
+
+    def to_jsonl(self) -> str:
+        return "".join(json.dumps(span, default=str) + "\n" for span in self.recent())
+
+    def to_prometheus(self, prefix: str = "audit") -> str:
+        """Totals in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, key):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for row in summary:
+                if key in row:
+                    label = row["span"].replace("\\", "\\\\").replace('"', '\\"')
+                    lines.append(f'{prefix}_{name}{{span="{label}"}} {row[key]}')
+
+        metric("span_seconds_total", "counter", "Wall time spent in each span.", "seconds")
+        metric("span_seconds_max", "gauge", "Longest single span.", "max_seconds")
+        metric("span_count_total", "counter", "Completed spans.", "count")
+        metric("span_errors_total", "counter", "Spans that raised.", "errors")
+        for attr in COUNTED_ATTRS:
+            metric(f"span_{attr}_total", "counter", f"Sum of the {attr} attribute.", attr)
+        lines.append(f"# HELP {prefix}_peak_rss_bytes Peak resident set size of the process.")
+        lines.append(f"# TYPE {prefix}_peak_rss_bytes gauge")
+        lines.append(f"{prefix}_peak_rss_bytes {peak_rss_bytes()}")
+        return "\n".join(lines) + "\n"
+
+def span(name: str, **attrs):
+    """Shortcut for Telemetry.get().span(...)."""
+    return (Telemetry._instance or Telemetry.get()).span(name, **attrs)
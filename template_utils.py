@@ -0,0 +1,384 @@
+import re
+import logging
+from array import array
+import numpy as np
+import pandas as pd
+from profiler_utils import ROLE_PATTERNS, ROLE_TIMESTAMP, ROLE_IP, ROLE_EMAIL
+
+logger = logging.getLogger(__name__)
+
+# Drain-style log template mining: lines are routed through a prefix tree (token count,
+# then the first DEPTH tokens) to a short list of clusters, and joined to the most
+# similar one when at least SIMILARITY of its constant tokens agree. Positions that
+# differ become variables; runs of variables collapse into one named slot.
+WILDCARD = "<*>"
+SIMILARITY = 0.5
+DEPTH = 2
+MAX_CHILDREN = 100
+# Templates matching fewer lines go to a catch-all "Message" row (their constants would
+# otherwise be a few lines verbatim, PII included)
+MIN_TEMPLATE_LINES = 5
+# Below this share of lines covered by real templates the log is not templated enough
+MIN_COVERAGE = 0.9
+
+# Recently matched templates tried (as regexes) before tokenizing a line
+FAST_PATH_CLUSTERS = 4
+
+MESSAGE = "Message"
+RESERVED_COLUMNS = ("Line", "Template")
+
+# Values recognised before tokenizing so they stay one (variable) token
+_TYPED = {"Timestamp": ROLE_PATTERNS[ROLE_TIMESTAMP], "IP": ROLE_PATTERNS[ROLE_IP], "Email": ROLE_PATTERNS[ROLE_EMAIL]}
+_TOKEN = re.compile(
+    "|".join(rf"(?P<{name}>(?<![\w.@])(?:{p.pattern})(?![\w@]|\.\w))" for name, p in _TYPED.items())
+    + r"|(?P<word>[\w@+-]+(?:[./][\w@+-]+)*)|(?P<punct>\S)"
+)
+_HAS_DIGIT = re.compile(r"\d")
+_WORD = re.compile(r"\w")
+
+# Slot named after the constant word in front of it ("performed <*> on <*>")
+SLOT_NAMES = {
+    "user": "User", "userid": "User", "operator": "User", "by": "User", "for": "User",
+    "performed": "Action", "action": "Action", "event": "Action",
+    "on": "Equipment", "equipment": "Equipment", "instrument": "Equipment",
+    "details": "Details", "detail": "Details", "msg": "Details", "message": "Details", "comment": "Details",
+    "sev": "Severity", "severity": "Severity", "level": "Severity",
+    "status": "Status", "result": "Status",
+    "from": "Source", "ip": "IP",
+}
+
+def tokenize(line: str) -> list:
+    """[(text, kind, whitespace_before, start, end)]; kind is a _TYPED name, "word" or "punct"."""
+    tokens, last = [], 0
+    for m in _TOKEN.finditer(line):
+        start = m.start()
+        tokens.append((m.group(), m.lastgroup, start > last and line[last:start].isspace(), start, m.end()))
+        last = m.end()
+    return tokens
+
+class _Cluster:
+    __slots__ = ("tokens", "kinds", "gaps", "size", "sample", "_regex")
+
+    def __init__(self, tokens: list, sample: str):
+        self.sample = sample # first line, to test whether a broader template covers this shape
+        self.tokens = [WILDCARD if kind in _TYPED else text for text, kind, _, _, _ in tokens]
+        self.kinds = [{kind} if kind in _TYPED else set() for _, kind, _, _, _ in tokens]
+        self.gaps = [gap for _, _, gap, _, _ in tokens]
+        self.size = 1
+        self._regex = None
+
+    def similarity(self, tokens: list) -> float:
+        same = sum(t == c for c, (t, _, _, _, _) in zip(self.tokens, tokens) if c != WILDCARD)
+        return same / len(tokens)
+
+    def merge(self, tokens: list):
+        for i, (text, kind, gap, _, _) in enumerate(tokens):
+            if self.tokens[i] != WILDCARD and self.tokens[i] != text:
+                self.tokens[i] = WILDCARD
+                self._regex = None
+            if kind in _TYPED:
+                self.kinds[i].add(kind)
+            if self.gaps[i] != gap:
+                self.gaps[i] = None # sometimes separated, sometimes not
+                self._regex = None
+        self.size += 1
+
+    def regex(self):
+        """Current template as a regex, or None while it is too unspecific to trust."""
+        if self._regex is None:
+            elements = self.elements()
+            constants = sum(kind == "c" for kind, _, _ in elements)
+            self._regex = _pattern(elements) if constants >= 2 and WILDCARD in self.tokens else False
+        return self._regex or None
+
+    def elements(self) -> list:
+        """Constants and slots (runs of variables collapsed): ("c", text, gap) / ("s", kinds, gap)."""
+        out = []
+        for token, kinds, gap in zip(self.tokens, self.kinds, self.gaps):
+            if token != WILDCARD:
+                out.append(("c", token, gap))
+            elif out and out[-1][0] == "s":
+                out[-1] = ("s", out[-1][1] | frozenset(kinds or {"word"}), out[-1][2])
+            else:
+                out.append(("s", frozenset(kinds or {"word"}), gap))
+        return out
+
+def _merge_elements(a: list, b: list) -> list:
+    """Generalizes two equally long element lists; differing positions become slots."""
+    out = []
+    for x, y in zip(a, b):
+        gap = x[2] if x[2] == y[2] else None
+        if x[0] == y[0] == "c" and x[1] == y[1]:
+            out.append(("c", x[1], gap))
+            continue
+        kinds = (x[1] if x[0] == "s" else frozenset({"word"})) | (y[1] if y[0] == "s" else frozenset({"word"}))
+        if out and out[-1][0] == "s":
+            out[-1] = ("s", out[-1][1] | kinds, out[-1][2])
+        else:
+            out.append(("s", kinds, gap))
+    return out
+
+def _element_similarity(a: list, b: list) -> float:
+    return sum(x[0] == y[0] == "c" and x[1] == y[1] for x, y in zip(a, b)) / max(len(a), 1)
+
+def _same(x, y) -> bool:
+    return x[0] == y[0] and (x[0] == "s" or x[1] == y[1])
+
+def _align(a: list, b: list, similarity: float):
+    """
+    Merged elements if a and b agree everywhere except one stretch (e.g. a one-word and
+    a three-word action); None if they don't line up well enough.
+    """
+    if len(a) == len(b):
+        return _merge_elements(a, b) if _element_similarity(a, b) >= similarity else None
+    short = min(len(a), len(b))
+    p = 0
+    while p < short and _same(a[p], b[p]):
+        p += 1
+    q = 0
+    while q < short - p and _same(a[-1 - q], b[-1 - q]):
+        q += 1
+    if p + q < 2 or (p + q) / max(len(a), len(b)) < similarity:
+        return None
+    middle = a[p:len(a) - q] + b[p:len(b) - q]
+    kinds = frozenset().union(*(x[1] if x[0] == "s" else {"word"} for x in middle))
+    gap = a[p][2] if p < len(a) - q else b[p][2]
+    out = [*a[:p], ("s", kinds, gap)]
+    for x in a[len(a) - q:]:
+        if x[0] == "s" and out[-1][0] == "s":
+            out[-1] = ("s", out[-1][1] | x[1], out[-1][2])
+        else:
+            out.append(x)
+    if p and out[p - 1][0] == "s": # slot run across the prefix boundary
+        out[p - 1:p + 1] = [("s", out[p - 1][1] | out[p][1], out[p - 1][2])]
+    return out
+
+def _user_slots(elements: list) -> list:
+    """
+    Constant words right after a user keyword ("User:Alice Wong") become a slot: an
+    identifier that repeats in every line of a template must not end up in its text.
+    """
+    out, after_user = [], False
+    for kind, value, gap in elements:
+        if kind == "c" and after_user and _WORD.search(value) and value.lower() not in SLOT_NAMES:
+            if out[-1][0] == "s":
+                out[-1] = ("s", out[-1][1] | {"word"}, out[-1][2])
+            else:
+                out.append(("s", frozenset({"word"}), gap))
+            continue
+        if not (kind == "c" and value in (":", "=") and after_user):
+            after_user = kind == "c" and SLOT_NAMES.get(value.lower()) == "User"
+        out.append((kind, value, gap))
+    return out
+
+def _pattern(elements: list):
+    """Anchored regex for a template: constants literal, one lazy group per slot."""
+    pattern = [r"^\s*"]
+    for i, (kind, value, gap) in enumerate(elements):
+        if i:
+            pattern.append(r"\s+" if gap else (r"\s*" if gap is None else ""))
+        pattern.append(re.escape(value) if kind == "c" else "(.+?)")
+    pattern.append(r"\s*$")
+    return re.compile("".join(pattern))
+
+class LogTemplate:
+    """A final template: display text, slot (column) names and the regex that extracts them."""
+    def __init__(self, elements: list, lines: int):
+        elements = _user_slots(elements)
+        self.lines = lines
+        self.names = []
+        parts, previous_words = [], []
+        for i, (kind, value, gap) in enumerate(elements):
+            space = "" if i == 0 else (" " if gap else "")
+            if kind == "c":
+                parts.append(space + value)
+                if _WORD.search(value):
+                    previous_words.append(value)
+                continue
+            name = self._slot_name(value, previous_words)
+            self.names.append(name)
+            parts.append(f"{space}<{name}>")
+            previous_words = []
+        self.text = "".join(parts)
+        self.constants = len(elements) - len(self.names)
+        self.regex = _pattern(elements)
+
+    def _slot_name(self, kinds: frozenset, previous_words: list) -> str:
+        typed = kinds & set(_TYPED)
+        if len(kinds) == 1 and typed:
+            name = next(iter(typed))
+        elif previous_words:
+            word = previous_words[-1]
+            name = SLOT_NAMES.get(word.lower(), word[:1].upper() + word[1:])
+        else:
+            name = "Field"
+        if name in RESERVED_COLUMNS or name == MESSAGE:
+            name += "_"
+        base, n = name, 2
+        while name in self.names:
+            name, n = f"{base}_{n}", n + 1
+        return name
+
+class TemplateMiner:
+    """
+    Learns templates from a stream of lines (first pass), then matches lines against the
+    final templates (second pass). Memory is the templates plus one cluster id per line.
+    """
+    def __init__(self, similarity: float = SIMILARITY, depth: int = DEPTH, max_children: int = MAX_CHILDREN,
+                 fast_path: int = FAST_PATH_CLUSTERS):
+        self.similarity = similarity
+        self.depth = depth
+        self.max_children = max_children
+        self.fast_path = fast_path
+        self.clusters = []
+        self.tree = {} # token count -> prefix -> [cluster id]
+        self._recent = [] # most recently matched clusters first
+
+    def _prefix(self, tokens: list) -> tuple:
+        return tuple(WILDCARD if kind in _TYPED or _HAS_DIGIT.search(text) else text
+                     for text, kind, _, _, _ in tokens[:self.depth])
+
+    def add(self, line: str) -> int:
+        """Assigns the line to a cluster (updating its template); -1 for blank lines."""
+        # Fast path: a line that already fits a recent template (slots absorb any
+        # number of tokens) joins it without tokenizing
+        for i, cid in enumerate(self._recent):
+            regex = self.clusters[cid].regex()
+            if regex is not None and regex.match(line):
+                self.clusters[cid].size += 1
+                if i:
+                    self._recent.insert(0, self._recent.pop(i))
+                return cid
+
+        tokens = tokenize(line)
+        if not tokens:
+            return -1
+        children = self.tree.setdefault(len(tokens), {})
+        prefix = self._prefix(tokens)
+        if prefix not in children and len(children) >= self.max_children:
+            prefix = (WILDCARD,) * len(prefix)
+        bucket = children.setdefault(prefix, [])
+
+        best, best_sim = None, -1.0
+        for cid in bucket:
+            sim = self.clusters[cid].similarity(tokens)
+            if sim > best_sim:
+                best, best_sim = cid, sim
+        if best is not None and best_sim >= self.similarity:
+            self.clusters[best].merge(tokens)
+        else:
+            best = len(self.clusters)
+            self.clusters.append(_Cluster(tokens, line))
+            bucket.append(best)
+        if best in self._recent:
+            self._recent.remove(best)
+        self._recent.insert(0, best)
+        del self._recent[self.fast_path:]
+        return best
+
+    def finalize(self) -> tuple:
+        """
+        Merges clusters whose collapsed templates still line up (the same line shape with
+        details or actions of different lengths). Returns (templates, cluster id -> template index).
+        """
+        groups = [(c.elements(), [cid], c.size, c.sample) for cid, c in enumerate(self.clusters)]
+        merged = True
+        while merged:
+            merged = False
+            groups.sort(key=lambda g: -g[2])
+            out = []
+            for elements, members, size, sample in groups:
+                for i, (other, other_members, other_size, other_sample) in enumerate(out):
+                    aligned = _align(other, elements, self.similarity)
+                    if aligned is not None:
+                        out[i] = (aligned, other_members + members, other_size + size, other_sample)
+                        merged = True
+                        break
+                else:
+                    out.append((elements, members, size, sample))
+            groups = out
+
+        templates, index = [], {}
+        for elements, members, size, sample in sorted(groups, key=lambda g: -g[2]):
+            # Shapes a larger template already covers (a slot where this one has constants,
+            # e.g. a three-word action) join it
+            host = next((i for i, t in enumerate(templates) if t.constants and t.regex.match(sample)), None)
+            if host is not None:
+                templates[host].lines += size
+                for cid in members:
+                    index[cid] = host
+                continue
+            template = LogTemplate(elements, size)
+            for cid in members:
+                index[cid] = len(templates)
+            templates.append(template)
+        return templates, index
+
+class _Column:
+    """Dictionary-encoded column filled sparsely: distinct values plus (row, code) pairs."""
+    __slots__ = ("values", "rows", "codes")
+
+    def __init__(self):
+        self.values = {}
+        self.rows = array("q")
+        self.codes = array("i")
+
+    def add(self, row: int, value: str):
+        code = self.values.get(value)
+        if code is None:
+            code = self.values[value] = len(self.values)
+        self.rows.append(row)
+        self.codes.append(code)
+
+    def categorical(self, n: int) -> pd.Categorical:
+        codes = np.full(n, -1, dtype=np.int32)
+        codes[np.frombuffer(self.rows, dtype=np.int64)] = np.frombuffer(self.codes, dtype=np.int32)
+        return pd.Categorical.from_codes(codes, categories=list(self.values))
+
+def mine_lines(open_lines, min_coverage: float = MIN_COVERAGE, miner: TemplateMiner = None):
+    """
+    Structured frame for a templated text log, or None if it isn't templated enough.
+    open_lines() must return a fresh iterator over the lines each time (it is read twice).
+
+    One row per non-blank line: Line (1-based number in the file), Template, and one
+    column per named slot (User, IP, Action, Details, ...). String columns are
+    categoricals, so memory grows with the distinct values rather than the file size.
+    """
+    miner = miner or TemplateMiner()
+    assigned = array("i")
+    for line in open_lines():
+        assigned.append(miner.add(line.rstrip("\r\n")))
+    if not miner.clusters:
+        return None
+
+    templates, index = miner.finalize()
+    covered = sum(t.lines for t in templates if t.lines >= MIN_TEMPLATE_LINES)
+    lines = sum(t.lines for t in templates)
+    if covered < min_coverage * lines:
+        logger.info(f"Not template-mining: {covered}/{lines} lines in repeated templates")
+        return None
+
+    line_numbers = array("q")
+    template_col, columns = _Column(), {}
+    row = 0
+    for number, (line, cid) in enumerate(zip(open_lines(), assigned), start=1):
+        if cid < 0:
+            continue
+        line = line.rstrip("\r\n")
+        template = templates[index[cid]]
+        match = template.regex.match(line) if template.lines >= MIN_TEMPLATE_LINES else None
+        if match is None:
+            template_col.add(row, f"<{MESSAGE}>")
+            columns.setdefault(MESSAGE, _Column()).add(row, line.strip())
+        else:
+            template_col.add(row, template.text)
+            for name, value in zip(template.names, match.groups()):
+                columns.setdefault(name, _Column()).add(row, value)
+        line_numbers.append(number)
+        row += 1
+
+    frame = pd.DataFrame({"Line": np.frombuffer(line_numbers, dtype=np.int64), "Template": template_col.categorical(row)})
+    for name, column in columns.items():
+        frame[name] = column.categorical(row)
+    logger.info(f"Template-mined {row} lines into {len(template_col.values)} templates, {len(columns)} fields")
+    return frame
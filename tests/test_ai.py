@@ -0,0 +1,105 @@
+import threading
+import types
+import pandas as pd
+import pytest
+from ai_utils import AIEngine, chunk_log, estimate_tokens
+from cache_utils import ResponseCache
+
+class FakeGemini:
+    """Stands in for AIEngine._generate_content_with_retry and records every call."""
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt, context):
+        with self.lock:
+            self.calls.append((prompt, context))
+        if "PART RESULT" in context:
+            return types.SimpleNamespace(text=f"REPORT over {context.count('PART RESULT')} parts")
+        return types.SimpleNamespace(text=f"finding: {context.splitlines()[0]}")
+
+@pytest.fixture
+def ai_engine(monkeypatch, tmp_path):
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    engine = AIEngine()
+    engine.cache = ResponseCache(cache_dir=str(tmp_path))
+    engine.fake = FakeGemini()
+    monkeypatch.setattr(engine, "_generate_content_with_retry", engine.fake)
+    return engine
+
+def test_chunk_log_text_covers_every_line():
+    text = "".join(f"line {i} some audit event\n" for i in range(1000))
+    chunks = list(chunk_log(text, chunk_tokens=500))
+    assert len(chunks) > 1
+    assert "".join(chunks) == text
+    assert all(estimate_tokens(c) <= 500 for c in chunks)
+
+def test_chunk_log_dataframe_repeats_header():
+    df = pd.DataFrame({"User_ID": [f"<PERSON>{i}" for i in range(300)], "Action_Type": ["Login"] * 300})
+    chunks = list(chunk_log(df, chunk_tokens=400))
+    assert len(chunks) > 1
+    assert all(c.splitlines()[1] == "User_ID,Action_Type" for c in chunks)
+    assert [line for c in chunks for line in c.splitlines()[2:]] == df.to_csv(index=False).splitlines()[1:]
+    assert all(estimate_tokens(c) <= 400 for c in chunks)
+    # Chunks of a chunked read are numbered by their place in the whole log
+    frames = [df.iloc[:150], df.iloc[150:]]
+    firsts = [c.splitlines()[0].split("rows ")[1].split(",")[0] for c in chunk_log(frames, chunk_tokens=400)]
+    assert firsts[0].startswith("1-") and firsts[-1].endswith("-300")
+
+def test_chunk_log_dataframe_uses_compact_context_encoding():
+    df = pd.read_csv("test_data_large/mock_audit_log_07_QA_Assurance.csv")
+    chunks = list(chunk_log(df, chunk_tokens=2000))
+    assert "# Action_Type: " in chunks[0] # dictionary legend, as in pack_context
+    assert sum(estimate_tokens(c) for c in chunks) < estimate_tokens(df.to_markdown(index=False))
+
+def test_mapreduce_covers_whole_log(ai_engine):
+    text = "".join(f"[2025-01-01 00:00:{i % 60:02d}] User:<PERSON> performed Delete File (row {i})\n" for i in range(2000))
+    progress = []
+    report = ai_engine.analyze_log_mapreduce(text, chunk_tokens=2000, max_concurrency=3,
+                                             progress_callback=lambda done, sub, fin: progress.append(done))
+
+    map_calls = [c for c in ai_engine.fake.calls if "PART RESULT" not in c[1]]
+    assert len(map_calls) > 1
+    assert sorted(line for c in map_calls for line in c[1].splitlines()) == sorted(text.splitlines())
+    assert progress[-1] == len(map_calls)
+    assert report.startswith("REPORT")
+
+def test_reduce_terminates_when_every_partial_is_oversized(ai_engine, monkeypatch):
+    # Each merged report is as large as a partial (~1.5k tokens against a 2k budget)
+    in_flight, peak = [0], [0]
+    barrier = threading.Barrier(2, timeout=5)
+    def fake(prompt, context):
+        with ai_engine.fake.lock:
+            ai_engine.fake.calls.append((prompt, context))
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        if context.count("PART RESULT") == 2 and "consolidated" in prompt:
+            barrier.wait() # merges of one level are in flight together
+        with ai_engine.fake.lock:
+            in_flight[0] -= 1
+        return types.SimpleNamespace(text="x" * 6000)
+    monkeypatch.setattr(ai_engine, "_generate_content_with_retry", fake)
+
+    partials = [f"part {i} " + "y" * 6000 for i in range(8)]
+    report = ai_engine._reduce(partials, "", chunk_tokens=2000, use_cache=False, refresh=False, max_concurrency=4)
+    assert report == "x" * 6000
+    assert len(ai_engine.fake.calls) == 4 + 2 + 1
+    assert peak[0] >= 2
+
+def test_response_cache_hit_and_refresh(ai_engine):
+    first = ai_engine.analyze_log("| User | Action |\n| <PERSON> | Delete File |")
+    assert not ai_engine.last_cache_hit
+
+    second = ai_engine.analyze_log("| User | Action |\n| <PERSON> | Delete File |")
+    assert ai_engine.last_cache_hit
+    assert second == first
+    assert len(ai_engine.fake.calls) == 1
+
+    # A different question is a different request
+    ai_engine.analyze_log("| User | Action |\n| <PERSON> | Delete File |", user_query="Who deleted files?")
+    assert not ai_engine.last_cache_hit
+
+    ai_engine.analyze_log("| User | Action |\n| <PERSON> | Delete File |", refresh=True)
+    assert not ai_engine.last_cache_hit
+    assert len(ai_engine.fake.calls) == 3
+    assert ai_engine.cache.stats()["hits"] == 1
@@ -0,0 +1,55 @@
+import json
+import shutil
+import types
+import pytest
+from security_utils import SecurityEngine
+from ai_utils import AIEngine
+import batch_audit
+
+MOCK_FILES = [
+    "test_data_large/mock_audit_log_03_Warehouse.csv",
+    "test_data_large/mock_audit_log_06_Warehouse.txt",
+    "test_data/production_batch.xlsx",
+]
+
+@pytest.fixture(scope="module")
+def security_engine():
+    return SecurityEngine()
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    calls = []
+    def generate(self, prompt, context):
+        calls.append(context)
+        return types.SimpleNamespace(text="#### 1. Compliance Summary\n- Assessment: COMPLIANT")
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setenv("AI_RESPONSE_CACHE", "0")
+    monkeypatch.setenv("MASKED_STORE", "0")
+    monkeypatch.setattr(AIEngine, "_response_cache_ready", True)
+    monkeypatch.setattr(AIEngine, "_response_cache", None)
+    monkeypatch.setattr(AIEngine, "_generate_content_with_retry", generate)
+    return calls
+
+def test_batch_writes_reports_and_resumes(security_engine, fake_gemini, tmp_path):
+    src = tmp_path / "logs"
+    src.mkdir()
+    for path in MOCK_FILES:
+        shutil.copy(path, src)
+    out = tmp_path / "reports"
+
+    # workers=1 still goes through the pool path; the engine is inherited by the worker
+    stats = batch_audit.run_batch(batch_audit.find_inputs([str(src)]), str(out), workers=1, progress=lambda m: None)
+    assert stats["processed"] == 3 and stats["failed"] == 0 and stats["rows"] > 0
+    assert len(fake_gemini) == 3 and all("DETERMINISTIC PRE-SCREEN" in c for c in fake_gemini)
+
+    entries = [json.loads(line) for line in (out / batch_audit.MANIFEST).read_text().splitlines()]
+    assert {e["status"] for e in entries} == {"ok"}
+    for e in entries:
+        assert "Compliance Summary" in (out / e["report"]).read_text()
+    assert "mock_audit_log_03_Warehouse.csv" in (out / batch_audit.SUMMARY).read_text()
+
+    # Resume: unchanged files are skipped, a changed file is redone
+    with open(src / "mock_audit_log_06_Warehouse.txt", "a", encoding="utf-8") as f:
+        f.write("[2026-01-02 03:04:05] [Sev: INFO] User:admin (10.0.0.1) performed Delete File on GC-05. Details: x.\n")
+    stats = batch_audit.run_batch(batch_audit.find_inputs([str(src)]), str(out), workers=1, progress=lambda m: None)
+    assert stats["skipped"] == 2 and stats["processed"] == 1 and len(fake_gemini) == 4
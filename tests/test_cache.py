@@ -0,0 +1,61 @@
+import sqlite3
+import time
+from cache_utils import MaskCache, DiskLRU
+
+def test_mask_cache_roundtrip_and_counters(tmp_path):
+    cache = MaskCache(namespace="en_core_web_lg-3.8.0|PERSON|v1", cache_dir=str(tmp_path))
+    cache.put_many({"Alice Smith": "<PERSON>", "Login": "Login"})
+
+    assert cache.get_many(["Alice Smith", "Login", "Bob Jones"]) == {"Alice Smith": "<PERSON>", "Login": "Login"}
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+    # A fresh process (new in-memory LRU) is served from disk
+    reopened = MaskCache(namespace="en_core_web_lg-3.8.0|PERSON|v1", cache_dir=str(tmp_path))
+    assert reopened.get("Alice Smith") == "<PERSON>"
+
+    # Another model/entity set never sees these entries
+    other = MaskCache(namespace="en_core_web_sm-3.8.0|PERSON|v1", cache_dir=str(tmp_path))
+    assert other.get("Alice Smith") is None
+
+def test_mask_cache_never_writes_raw_values(tmp_path):
+    cache = MaskCache(namespace="ns", cache_dir=str(tmp_path))
+    cache.put("Alice Smith from 10.0.0.1", "<PERSON> from <IP_ADDRESS>")
+
+    # Main database plus WAL/SHM side files
+    raw = b"".join(p.read_bytes() for p in tmp_path.iterdir())
+    conn = sqlite3.connect(str(tmp_path / "mask_cache.sqlite"))
+    keys = [row[0] for row in conn.execute("SELECT key FROM entries")]
+    assert b"Alice" not in raw
+    assert all("Alice" not in k for k in keys)
+
+def test_mask_cache_stores_unchanged_values_as_a_marker(tmp_path):
+    # Lines with nothing detected (or PII the model missed) must not be written as they are
+    lines = ["2024-01-01 User qa_lead reviewed batch B-17", "missed name Jane Roe"]
+    MaskCache(namespace="ns", cache_dir=str(tmp_path)).put_many({line: line for line in lines})
+
+    raw = b"".join(p.read_bytes() for p in tmp_path.iterdir())
+    values = [row[0] for row in sqlite3.connect(str(tmp_path / "mask_cache.sqlite")).execute("SELECT value FROM entries")]
+    assert all(line.encode() not in raw for line in lines) and b"Jane" not in raw
+    assert values == ["", ""]
+    assert MaskCache(namespace="ns", cache_dir=str(tmp_path)).get_many(lines) == {line: line for line in lines}
+
+    # Entries from before the marker (raw values) are dropped when the file is opened
+    DiskLRU(str(tmp_path / "mask_cache.sqlite"), version=0).put("legacy", "raw line")
+    assert MaskCache(namespace="ns", cache_dir=str(tmp_path)).disk.get("legacy") is None
+
+def test_disk_lru_evicts_by_size(tmp_path):
+    store = DiskLRU(str(tmp_path / "lru.sqlite"), max_bytes=1000)
+    for i in range(50):
+        store.put(f"key{i:03d}", "x" * 100)
+
+    assert store.size_bytes <= 1000
+    assert store.get("key049") is not None
+    assert store.get("key000") is None
+
+def test_disk_lru_ttl_expires_entries(tmp_path):
+    store = DiskLRU(str(tmp_path / "ttl.sqlite"), ttl=0.05)
+    store.put("k", "v")
+    assert store.get("k") == "v"
+    time.sleep(0.1)
+    assert store.get("k") is None
@@ -0,0 +1,131 @@
+import io
+import os
+import json
+import hashlib
+import pytest
+from fake_supabase_server import start_server
+from cloud_utils import CloudManager, VAULT_BUCKET, content_object_name, pointer_object_name
+
+KEY = "fake.fake.fake"
+
+@pytest.fixture
+def supabase():
+    server, state, url = start_server()
+    yield state, url
+    server.shutdown()
+
+def test_upload_resumes_after_interruption(supabase, tmp_path):
+    state, url = supabase
+    spool = str(tmp_path / "spool.sqlite")
+    data = os.urandom(10 * 1024 + 100)
+    cloud = CloudManager(url, KEY, spool_path=spool, chunk_bytes=1024, start_worker=False)
+    assert cloud.backup_file(io.BytesIO(data), "log.csv", owner="qa@example.com")[0]
+
+    # Connection drops after the third chunk
+    patch = cloud.http.patch
+    def flaky_patch(*args, **kwargs):
+        if state.patches == 3:
+            state.fail_next(1)
+        return patch(*args, **kwargs)
+    cloud.http.patch = flaky_patch
+    assert not cloud.process_once()
+    assert cloud.stats()["uploads_pending"] == 2 and state.patches == 3
+    cloud.close()
+
+    # "Restarted" process picks the upload up from the spool at the server's offset
+    restarted = CloudManager(url, KEY, spool_path=spool, chunk_bytes=1024, start_worker=False)
+    restarted.spool.update_upload(1, next_try=0)
+    assert restarted.flush(timeout=10)
+    digest = hashlib.sha256(data).hexdigest()
+    assert state.objects[(VAULT_BUCKET, content_object_name(digest))] == data
+    pointer = state.objects[(VAULT_BUCKET, pointer_object_name("qa@example.com", "log.csv"))]
+    assert json.loads(pointer)["sha256"] == digest
+    assert state.bytes_received == len(data) + len(pointer)
+    assert os.listdir(restarted.spool.blob_dir) == []
+    restarted.close()
+
+def test_chat_logs_are_batched_and_survive_outage(supabase, tmp_path):
+    state, url = supabase
+    spool = str(tmp_path / "spool.sqlite")
+    cloud = CloudManager(url, KEY, spool_path=spool)
+    state.offline = True
+    for i in range(120):
+        assert cloud.log_chat("tester", f"question {i}", "answer")[0]
+    assert not cloud.flush(timeout=0.5)
+    cloud.close()
+    assert cloud.stats()["chats_pending"] == 120
+
+    state.offline = False
+    state.inserts = 0
+    restarted = CloudManager(url, KEY, spool_path=spool)
+    assert restarted.flush(timeout=10)
+    assert [r["question"] for r in state.rows["chat_logs"]] == [f"question {i}" for i in range(120)]
+    assert state.inserts == 3 # batches of 50
+    restarted.close()
+
+def test_identical_content_is_sent_once(supabase, tmp_path):
+    state, url = supabase
+    cloud = CloudManager(url, KEY, spool_path=str(tmp_path / "spool.sqlite"), start_worker=False)
+    data = b"Timestamp,User\n2024-01-01,alice\n" * 500
+    for owner, name in [("a@x.com", "log.csv"), ("b@x.com", "renamed.csv"), ("a@x.com", "log.csv")]:
+        assert cloud.backup_file(io.BytesIO(data), name, owner=owner)[0]
+    assert cloud.flush(timeout=5)
+    content = [k for k in state.objects if k[1].startswith("objects/")]
+    assert content == [(VAULT_BUCKET, content_object_name(hashlib.sha256(data).hexdigest()))]
+    assert cloud.stats()["bytes_saved"] == 2 * len(data)
+
+    # Changed content under an old name: new object, pointer moves to it
+    changed = data + b"2024-01-02,mallory\n"
+    cloud.backup_file(io.BytesIO(changed), "log.csv", owner="a@x.com")
+    assert cloud.flush(timeout=5)
+    pointer = json.loads(state.objects[(VAULT_BUCKET, pointer_object_name("a@x.com", "log.csv"))])
+    assert pointer["sha256"] == hashlib.sha256(changed).hexdigest()
+    assert state.objects[(VAULT_BUCKET, pointer["object"])] == changed
+    cloud.close()
+
+def test_duplicate_content_is_never_spooled(supabase, tmp_path):
+    state, url = supabase
+    cloud = CloudManager(url, KEY, spool_path=str(tmp_path / "spool.sqlite"), start_worker=False)
+    data = b"Timestamp,User\n2024-01-01,alice\n" * 500
+    cloud.backup_file(io.BytesIO(data), "log.csv")
+    spooled = []
+    spool_blob = cloud.spool.spool_blob
+    def spy(fileobj):
+        blob = spool_blob(fileobj)
+        spooled.append(blob[2])
+        return blob
+    cloud.spool.spool_blob = spy
+    cloud.backup_file(io.BytesIO(data), "copy.csv")
+    assert len(spooled) == 1 and spooled[0] < len(data) # the pointer only, not a raw copy of the upload
+    cloud.close()
+
+def test_concurrent_backups_queue_content_once(supabase, tmp_path):
+    state, url = supabase
+    cloud = CloudManager(url, KEY, spool_path=str(tmp_path / "spool.sqlite"), start_worker=False)
+    cloud.spool.has_digest = lambda digest: False # both sessions pass the check before either queues
+    data = b"same upload from two sessions" * 100
+    results = [cloud.backup_file(io.BytesIO(data), f"log{i}.csv") for i in range(2)]
+    assert [ok for ok, _ in results] == [True, True]
+    assert "queued" in results[0][1] and "already in vault" in results[1][1]
+    assert cloud.stats()["uploads_pending"] == 3 # one content upload, two pointers
+    assert len(os.listdir(cloud.spool.blob_dir)) == 3 # the losing session's blob was removed
+    cloud.close()
+
+def test_remote_index_skips_transfer(supabase, tmp_path):
+    state, url = supabase
+    data = b"already stored elsewhere"
+    state.objects[(VAULT_BUCKET, content_object_name(hashlib.sha256(data).hexdigest()))] = data
+    cloud = CloudManager(url, KEY, spool_path=str(tmp_path / "spool.sqlite"), start_worker=False)
+    cloud.backup_file(io.BytesIO(data), "dup.csv")
+    assert cloud.flush(timeout=5)
+    pointer = state.objects[(VAULT_BUCKET, pointer_object_name("shared", "dup.csv"))]
+    assert state.bytes_received == len(pointer) and cloud.stats()["dedup_hits"] == 1
+    # Now known locally: the next backup doesn't even queue the content
+    cloud.backup_file(io.BytesIO(data), "again.csv")
+    assert cloud.stats()["uploads_pending"] == 1 and cloud.stats()["dedup_hits"] == 2
+    cloud.close()
+
+def test_not_configured():
+    cloud = CloudManager(url="", key="", start_worker=False)
+    assert cloud.upload_file(b"x", "a.csv") == (False, "Supabase Configuration Missing.")
+    assert cloud.flush() and cloud.stats() == {}
@@ -0,0 +1,48 @@
+import pandas as pd
+from ai_utils import estimate_tokens
+from context_utils import pack_context, RUN_COLUMN
+
+def _log(rows=3000):
+    return pd.DataFrame({
+        "Timestamp": [f"2025-03-01T{(i // 60) % 24:02d}:{i % 60:02d}:00" for i in range(rows)],
+        "User_ID": [f"<PERSON>{i % 7}" for i in range(rows)],
+        "Action_Type": [["Login", "Audit Trail Review", "Delete File"][(i // 3) % 3] for i in range(rows)],
+        "Detail": [f"Event {i} executed on HPLC-01" for i in range(rows)],
+    })
+
+def test_pack_fills_budget_without_exceeding_it():
+    df = _log()
+    for budget in (2000, 10000):
+        packed = pack_context(df, token_budget=budget)
+        assert packed.tokens <= budget
+        assert packed.tokens > budget * 0.9
+        assert 0 < packed.rows < len(df)
+        assert len(packed.text.splitlines()) == packed.lines + 1 + 1 + len(packed.dictionary_columns)
+
+    everything = pack_context(df, token_budget=10**6)
+    assert everything.rows == len(df) and not everything.truncated
+    assert everything.tokens < estimate_tokens(df.to_markdown(index=False)) * 0.7
+
+def test_dictionary_and_runs_decode_to_original_rows():
+    actions = ["Abort"] * 5 + ["Start Sequence", "Login", "Abort", "Login", "Data Save", "Login", "Login"]
+    df = pd.DataFrame({
+        "Timestamp": [f"2025-03-01T08:{i // 60:02d}:{i % 60:02d}" for i in range(240)],
+        "User_ID": ["<PERSON>"] * 240,
+        "Action_Type": actions * 20,
+    })
+    packed = pack_context(df, token_budget=10**6)
+    assert packed.rows == 240 and packed.lines == 140
+    assert "Action_Type" in packed.dictionary_columns
+
+    lines = packed.text.splitlines()
+    legend = dict(entry.split("=", 1) for entry in next(l for l in lines if l.startswith("# Action_Type:"))[len("# Action_Type: "):].split("; "))
+    table = pd.read_csv(pd.io.common.StringIO("\n".join(l for l in lines if not l.startswith("#"))))
+    decoded = table["Action_Type"].map(legend).repeat(table[RUN_COLUMN]).tolist()
+    assert decoded == df["Action_Type"].tolist()
+    assert table["Timestamp"][0] == "2025-03-01T08:00:00~2025-03-01T08:00:04"
+
+def test_pack_text_collapses_repeats():
+    text = "".join(["Login failed for <PERSON>\n"] * 50 + [f"line {i}\n" for i in range(10)])
+    packed = pack_context(text, token_budget=10**4)
+    assert packed.rows == 60 and packed.lines == 11
+    assert "[x50]" in packed.text
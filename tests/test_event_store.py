@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+from ai_utils import estimate_tokens
+from event_store_utils import EventStore, event_frame
+from security_utils import SecurityEngine
+
+QC_LAB = "test_data_large/mock_audit_log_04_QC_Lab.csv" # Operator / Event / DateTime
+QA = "test_data_large/mock_audit_log_07_QA_Assurance.csv" # User_ID / Action_Type / Timestamp
+WAREHOUSE_TXT = "test_data_large/mock_audit_log_06_Warehouse.txt"
+
+@pytest.fixture(scope="module")
+def security_engine():
+    return SecurityEngine()
+
+@pytest.fixture
+def store():
+    store = EventStore()
+    store.add("qc.csv", pd.read_csv(QC_LAB))
+    store.add("qa.csv", pd.read_csv(QA), chunk_rows=40) # several insert chunks
+    store.add("wh.txt", open(WAREHOUSE_TXT, encoding="utf-8").read())
+    yield store
+    store.close()
+
+def test_files_map_to_one_indexed_table(store):
+    sources = store.sources().set_index("name")
+    assert sources.loc["qc.csv", "columns"]["user"] == "Operator"
+    assert sources.loc["qa.csv", "columns"]["user"] == "User_ID"
+    assert sources.loc["qa.csv", "columns"]["action"] == "Action_Type"
+    assert store.rows == sources["rows"].sum() == len(pd.read_csv(QC_LAB)) + len(pd.read_csv(QA)) + 250
+    assert store.add("qa.csv", pd.read_csv(QA)) == 0 # already stored
+
+    # One user across exports, in time order, equals filtering each file by hand
+    qc, qa = pd.read_csv(QC_LAB), pd.read_csv(QA)
+    user = store.shared_values("user").iloc[0]
+    assert user.files >= 2
+    events = store.query({"user": user.value})
+    assert len(events) == user.events
+    assert (events["source"] == "qc.csv").sum() == (qc["Operator"] == user.value).sum()
+    assert (events["source"] == "qa.csv").sum() == (qa["User_ID"] == user.value).sum()
+    assert events["timestamp"].is_monotonic_increasing
+
+    day = store.query({"user": user.value}, start="2026-01-03", end="2026-01-04")
+    assert day["timestamp"].str.startswith("2026-01-03").all()
+    plan = store._conn.execute('EXPLAIN QUERY PLAN SELECT * FROM events WHERE "user" = ? ORDER BY "timestamp"', ("x",)).fetchall()
+    assert "USING INDEX events_user" in plan[0][-1] and "TEMP B-TREE" not in str(plan)
+
+    store.remove(store.sources().set_index("name").loc["qa.csv", "digest"])
+    assert list(store.sources()["name"]) == ["qc.csv", "wh.txt"]
+    assert (store.query({"user": user.value})["source"] != "qa.csv").all()
+
+def test_concurrent_add_of_the_same_file_is_ignored(store):
+    rows = store.rows
+    store.has = lambda digest: False # another session added it after this one checked
+    assert store.add("qa.csv", pd.read_csv(QA)) == 0
+    assert store.rows == rows and list(store.sources()["name"]).count("qa.csv") == 1
+
+def test_event_frame_combines_date_and_time_and_keeps_other_columns():
+    frame = pd.DataFrame({"Date": ["2026-01-02", "bad"], "Time": ["23:15:00", "x"], "User": ["qa1", None], "Lot": ["L1", "L2"]})
+    events, mapping = event_frame(frame)
+    assert mapping["timestamp"] == "Date + Time"
+    assert events["timestamp"].tolist() == ["2026-01-02T23:15:00", None]
+    assert events["user"].tolist() == ["qa1", None]
+    assert '"Lot":"L1"' in events.loc[0, "extra"]
+
+def test_question_context_selects_named_values(store):
+    user = store.shared_values("user").iloc[0].value
+    text, summary = store.context(f"What did {user} do on 2026-01-03?", token_budget=3000)
+    assert estimate_tokens(text) <= 3000
+    assert f"user = {user}" in summary and "2026-01-03 <= timestamp" in summary
+    assert "3 files" in text and "Operator" in text and "User_ID" in text
+
+    _, summary = store.context(f"{user} on 2031-05-05", token_budget=3000)
+    assert "no event matches, showing every file instead" in summary
+
+def test_uploads_are_masked_before_they_are_stored(security_engine, tmp_path):
+    store = EventStore(str(tmp_path / "events.sqlite"))
+    with open(QA, "rb") as f:
+        rows = store.add_upload("qa.csv", f, security_engine, digest="qa", chunk_rows=100)
+    assert rows == len(pd.read_csv(QA))
+    masked = security_engine.anonymize_dataframe(pd.read_csv(QA, dtype=str))
+    stored = store.query().sort_values("row")
+    assert stored["user"].tolist() == masked["User_ID"].tolist()
+    store.close()
+    assert (tmp_path / "events.sqlite").exists() # a named database is kept
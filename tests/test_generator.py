@@ -0,0 +1,39 @@
+import pandas as pd
+from pypdf import PdfReader
+from generate_large_test_data import generate_chunks, generate_file, VIOLATIONS, LINES_PER_PAGE
+from prescreen_utils import prescreen
+
+def test_chunks_are_deterministic_and_bounded():
+    first = list(generate_chunks(2500, density=0.05, seed=7, chunk_rows=1000))
+    again = pd.concat([f for f, _ in generate_chunks(2500, density=0.05, seed=7, chunk_rows=1000)], ignore_index=True)
+    assert [len(f) for f, _ in first] == [1000, 1000, 500]
+    pd.testing.assert_frame_equal(pd.concat([f for f, _ in first], ignore_index=True), again)
+
+def test_clean_baseline_has_no_findings():
+    frame, violation = next(generate_chunks(3000, density=0.0, seed=1))
+    assert not violation.any()
+    assert prescreen(frame).stats["flagged_rows"] == 0
+
+def test_injected_violations_match_prescreen(tmp_path):
+    frame, violation = next(generate_chunks(20_000, density=0.03, seed=3))
+    flags = prescreen(frame).flags
+    for rule in ["data_deletion", "audit_trail_change", "abort_then_pass", "generic_account", "off_hours"]:
+        assert (flags[rule].to_numpy() == (violation == rule)).all(), rule
+    # Early-morning entries usually also land before the preceding row
+    extra = flags["non_chronological"].to_numpy() & (violation != "non_chronological")
+    assert flags["non_chronological"][violation == "non_chronological"].all()
+    assert set(violation[extra]) == {"off_hours"}
+
+    info = generate_file(str(tmp_path / "log.csv"), "csv", 20_000, density=0.03, seed=3)
+    assert info["violations"] == {rule: int((violation == rule).sum()) for rule in VIOLATIONS}
+    assert len(pd.read_csv(tmp_path / "log.csv")) == 20_000
+
+def test_streaming_pdf_is_readable(tmp_path):
+    path = tmp_path / "log.pdf"
+    info = generate_file(str(path), "pdf", LINES_PER_PAGE * 3, density=0.05, seed=5)
+    reader = PdfReader(str(path))
+    assert len(reader.pages) == 4 # title line pushes the last row onto a new page
+    text = "\n".join(page.extract_text() for page in reader.pages)
+    result = prescreen(text)
+    assert result.stats["rows"] == info["rows"] + 1
+    assert result.flags["data_deletion"].sum() == info["violations"]["data_deletion"]
@@ -0,0 +1,200 @@
+import io
+import os
+import sys
+import json
+import subprocess
+import numpy as np
+import pandas as pd
+import pytest
+from security_utils import SecurityEngine
+from ingest_utils import (
+    iter_text_chunks, stream_anonymize, load_upload, read_pdf_text, iter_excel_chunks, excel_sheets, read_preview,
+    DEFAULT_CHUNK_ROWS
+)
+import ingest_utils
+
+@pytest.fixture(scope="module")
+def security_engine():
+    return SecurityEngine()
+
+def test_iter_text_chunks_keeps_lines_and_file_open():
+    buf = io.BytesIO("a\nb\r\nc".encode("utf-8"))
+    chunks = list(iter_text_chunks(buf, chunk_lines=2))
+    assert chunks == [["a\n", "b\r\n"], ["c"]]
+    assert not buf.closed
+
+def test_stream_csv_matches_in_memory(security_engine, tmp_path):
+    csv = "User,Action,IP\n" + "".join(f"Alice Smith,Login,10.0.0.{i}\n" for i in range(30))
+    in_memory, _ = load_upload("log.csv", io.BytesIO(csv.encode()))
+    expected = security_engine.anonymize_dataframe(in_memory)
+
+    result = stream_anonymize("log.csv", io.BytesIO(csv.encode()), security_engine,
+                              chunk_rows=7, preview_rows=5, context_rows=12, output_dir=str(tmp_path))
+
+    assert result.rows == 30
+    assert result.chunks == 5
+    assert len(result.preview_original) == 5
+    assert len(result.context) == 12
+    pd.testing.assert_frame_equal(pd.read_csv(result.output_path), expected)
+
+def test_stream_rechecks_skipped_columns_on_later_chunks(security_engine, tmp_path):
+    # "Note" looks like a clean enum in the first chunk; an email only appears in chunk 2
+    csv = "User,Note\n" + "".join(f"u{i % 3},ok\n" for i in range(10)) + "u1,mail john.smith@example.com\nu2,ok\n"
+    result = stream_anonymize("log.csv", io.BytesIO(csv.encode()), security_engine,
+                              chunk_rows=10, output_dir=str(tmp_path))
+    assert result.chunks == 2
+    assert result.plan["Note"] != "enum"
+    masked = pd.read_csv(result.output_path)
+    assert "john.smith@example.com" not in masked.to_csv()
+    assert masked.loc[10, "Note"] == "mail <EMAIL>"
+
+def test_stream_reuses_masks_across_chunks_with_cache_off(security_engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(security_engine, "cache", None)
+    sent = []
+    batch_masks = security_engine._batch_masks
+    monkeypatch.setattr(security_engine, "_batch_masks", lambda texts, **kw: sent.extend(texts) or batch_masks(texts, **kw))
+    csv = "User,IP\n" + "".join(f"Alice Smith,10.0.0.{i}\n" for i in range(9))
+    result = stream_anonymize("log.csv", io.BytesIO(csv.encode()), security_engine, chunk_rows=3,
+                              plan={"User": "name", "IP": "text"}, output_dir=str(tmp_path))
+    assert result.chunks == 3
+    assert sent.count("Alice Smith") == 1
+    assert pd.read_csv(result.output_path).equals(security_engine.anonymize_dataframe(pd.read_csv(io.StringIO(csv))))
+
+def _workbook() -> io.BytesIO:
+    from openpyxl import Workbook
+    wb = Workbook()
+    wb.active.title = "Summary"
+    wb.active.append(["Batch", "Result"])
+    wb.active.append(["B-1", "Pass"])
+    ws = wb.create_sheet("AuditTrail")
+    ws.append(["User", "Action", None, "Action", "Value"])
+    for i in range(25):
+        ws.append([f"Alice Smith {i}", "Login", None, "Review", i])
+    ws.append([None] * 5)
+    ws.append(["Bob Jones", "Logout", "x", "Sign", 2.5])
+    ws.append([None] * 5) # trailing blank rows are dropped, like pandas does
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf
+
+@pytest.mark.parametrize("engine", ["openpyxl", "calamine"])
+def test_excel_streaming_reader_matches_pandas(monkeypatch, engine):
+    if engine == "calamine" and ingest_utils.CalamineWorkbook is None:
+        pytest.skip("python-calamine not installed")
+    monkeypatch.setenv("EXCEL_ENGINE", engine)
+    buf = _workbook()
+    assert excel_sheets(buf) == ["Summary", "AuditTrail"]
+
+    expected = pd.read_excel(buf, sheet_name="AuditTrail")
+    assert [len(c) for c in iter_excel_chunks(buf, chunk_rows=10, sheet="AuditTrail")] == [10, 10, 7]
+    pd.testing.assert_frame_equal(ingest_utils.read_excel(buf, sheet="AuditTrail", chunk_rows=10), expected)
+
+    subset, data_type = load_upload("log.xlsx", buf, sheet="AuditTrail", columns=["User", "Action.1"])
+    assert data_type == "dataframe"
+    pd.testing.assert_frame_equal(subset, expected[["User", "Action.1"]])
+    # The first sheet by default
+    assert list(load_upload("log.xlsx", buf)[0].columns) == ["Batch", "Result"]
+
+def test_stream_xlsx_matches_in_memory(security_engine, tmp_path):
+    buf = _workbook()
+    in_memory, _ = load_upload("log.xlsx", buf, sheet="AuditTrail", columns=["User", "Value"])
+    expected = security_engine.anonymize_dataframe(in_memory)
+
+    result = stream_anonymize("log.xlsx", buf, security_engine, chunk_rows=7, sheet="AuditTrail",
+                              columns=["User", "Value"], output_dir=str(tmp_path))
+
+    assert result.rows == 27
+    assert result.chunks == 4
+    pd.testing.assert_frame_equal(pd.read_csv(result.output_path), expected, check_dtype=False)
+
+def test_parallel_pdf_matches_sequential(monkeypatch):
+    import pypdf
+    path = "test_data_large/mock_audit_log_02_Production.pdf"
+    expected = "".join(page.extract_text() + "\n" for page in pypdf.PdfReader(path).pages)
+
+    # Force the process pool even for a small document
+    monkeypatch.setattr(ingest_utils, "PDF_PARALLEL_MIN_PAGES", 1)
+    with open(path, "rb") as f:
+        assert read_pdf_text(f, max_workers=2) == expected
+
+def _wide_log(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    names = [f"{first} {last}" for first in ["Alice", "Bob", "Carol", "David", "Erin"] for last in ["Smith", "Jones", "White", "Brown"]]
+    return pd.DataFrame({
+        "Timestamp": (pd.Timestamp("2026-01-01") + pd.to_timedelta(np.arange(rows) * 7, "s")).astype(str),
+        "User": rng.choice(names, rows),
+        "Reviewer": rng.choice(names, rows),
+        "Email": rng.choice([f"user{i}@lab.example.com" for i in range(40)], rows),
+        "Client_IP": rng.choice([f"10.0.{i // 200}.{i % 200 + 1}" for i in range(400)], rows),
+        "Equipment": rng.choice([f"HPLC-{i:02d}" for i in range(40)], rows),
+        "Action": rng.choice(["Login", "Data Save", "Delete File", "Audit Trail Review"], rows),
+        "Status": rng.choice(["Success", "Failed"], rows),
+        "Comment": rng.choice([f"Reviewed by {n} for release" for n in names], rows),
+        "Batch": rng.integers(0, 1000, rows),
+    })
+
+WIDE_PLAN = {"Timestamp": "timestamp", "User": "name", "Reviewer": "name", "Email": "email", "Client_IP": "ip",
+             "Equipment": "enum", "Action": "enum", "Status": "enum", "Comment": "text"}
+
+def test_lean_load_matches_whole_read():
+    df = _wide_log(DEFAULT_CHUNK_ROWS * 2 + 123)
+    df.loc[DEFAULT_CHUNK_ROWS + 5, "Equipment"] = "GC-99" # a category first seen in a later chunk
+    df.loc[7, "Status"] = None
+    data = df.to_csv(index=False).encode()
+
+    expected, _ = load_upload("log.csv", io.BytesIO(data))
+    lean, data_type = load_upload("log.csv", io.BytesIO(data), lean=True)
+    assert data_type == "dataframe"
+    assert isinstance(lean["Equipment"].dtype, pd.CategoricalDtype) and not isinstance(lean["Timestamp"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(lean.astype(expected.dtypes.to_dict()), expected)
+    assert lean.memory_usage(deep=True).sum() < expected.memory_usage(deep=True).sum() / 2
+
+    # The Original view reads only the first rows from the bytes
+    pd.testing.assert_frame_equal(read_preview("log.csv", io.BytesIO(data), rows=5), expected.head(5))
+    assert read_preview("log.txt", io.BytesIO(b"a\nb\nc\n"), rows=2) == "a\nb\n"
+
+# Peak RSS of parsing and masking one upload, in a fresh process per mode
+_PEAK_SCRIPT = """
+import json, sys
+import pandas as pd
+from ingest_utils import load_upload
+from security_utils import SecurityEngine
+def peak_rss_bytes(): # of this process only (getrusage also counts the parent's RSS before exec)
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM"))
+path, lean, plan = sys.argv[1], sys.argv[2] == "lean", json.loads(sys.argv[3])
+engine = SecurityEngine()
+engine.anonymize_dataframe(pd.read_csv(path, nrows=2000), plan=plan, batch_size=256)
+with open("/proc/self/clear_refs", "w") as f:
+    f.write("5") # reset the peak, so model loading doesn't count
+start = peak_rss_bytes()
+with open(path, "rb") as f:
+    data, _ = load_upload(path, f, lean=lean)
+masked = engine.anonymize_dataframe(data, plan=plan, batch_size=256, lean=lean)
+print(json.dumps({"peak": peak_rss_bytes() - start, "held": int(masked.memory_usage(deep=True).sum())}))
+"""
+
+def test_lean_mode_holds_less_memory(security_engine):
+    data = _wide_log(20_000).to_csv(index=False).encode()
+    full, _ = load_upload("log.csv", io.BytesIO(data))
+    lean, _ = load_upload("log.csv", io.BytesIO(data), lean=True)
+    masked = security_engine.anonymize_dataframe(full, plan=WIDE_PLAN, batch_size=256)
+    lean_masked = security_engine.anonymize_dataframe(lean, plan=WIDE_PLAN, batch_size=256, lean=True)
+    pd.testing.assert_frame_equal(lean_masked.astype(masked.dtypes.to_dict()), masked)
+    assert lean_masked.memory_usage(deep=True).sum() < masked.memory_usage(deep=True).sum() / 3
+
+# Opt-in: builds a 300k-row log and loads the NER model in two fresh processes
+@pytest.mark.skipif(not os.getenv("RUN_MEMORY_TESTS"), reason="set RUN_MEMORY_TESTS=1 to measure peak RSS")
+@pytest.mark.skipif(not os.path.exists("/proc/self/clear_refs"), reason="needs a resettable peak RSS (Linux)")
+def test_lean_mode_lowers_peak_memory(tmp_path):
+    path = tmp_path / "wide.csv"
+    _wide_log(300_000).to_csv(path, index=False)
+
+    usage = {}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for mode in ("full", "lean"):
+        out = subprocess.run([sys.executable, "-c", _PEAK_SCRIPT, str(path), mode, json.dumps(WIDE_PLAN)], cwd=root,
+                             env={**os.environ, "PII_MASK_CACHE": "0"}, capture_output=True, text=True, check=True)
+        usage[mode] = json.loads(out.stdout.strip().splitlines()[-1])
+    assert usage["lean"]["peak"] < 0.7 * usage["full"]["peak"]
+    assert usage["lean"]["held"] < usage["full"]["held"] / 3
@@ -0,0 +1,43 @@
+import io
+import pandas as pd
+from memo_utils import ArtifactCache, Memo, content_hash, memo_key
+
+def test_memo_computes_each_stage_once():
+    memo = Memo()
+    memo.shared = ArtifactCache() # isolated from other tests
+    calls = []
+    parse = lambda: calls.append("parse") or pd.DataFrame({"a": range(10)})
+
+    first = memo("parse", "hash1", "csv", parse)
+    again = memo("parse", "hash1", "csv", parse)
+    assert again is first and calls == ["parse"]
+
+    # Another session with the same upload reuses the process-wide artifact
+    other = Memo()
+    other.shared = memo.shared
+    assert other("parse", "hash1", "csv", parse) is first and calls == ["parse"]
+
+    # Different config or content is a different artifact
+    memo("parse", "hash1", "txt", parse)
+    memo("parse", "hash2", "csv", parse)
+    assert len(calls) == 3
+
+    memo.evict("hash1")
+    memo("parse", "hash1", "csv", parse)
+    assert len(calls) == 4
+
+def test_artifact_cache_is_bounded():
+    cache = ArtifactCache(max_items=10, max_bytes=1000)
+    for i in range(5):
+        cache.put(f"k{i}", "x" * 300)
+    assert cache.stats()["bytes"] <= 1000
+    assert "k4" in cache and "k0" not in cache
+
+    cache.get("k2") # recently used survives
+    cache.put("k5", "x" * 300)
+    assert "k2" in cache and "k3" not in cache
+
+def test_keys_are_stable():
+    assert content_hash(io.BytesIO(b"a,b\n1,2\n")) == content_hash(io.BytesIO(b"a,b\n1,2\n"))
+    assert memo_key("anonymize", "h", ("v1", {"a": "name", "b": "enum"})) != memo_key("anonymize", "h", ("v1", {"a": "enum", "b": "enum"}))
+    assert memo_key("context", "h", {"x": 1, "y": 2}) == memo_key("context", "h", {"y": 2, "x": 1})
@@ -0,0 +1,89 @@
+import glob
+import pandas as pd
+import pytest
+from prescreen_utils import prescreen, select_windows, build_prescreen_context, BUSINESS_HOURS
+from schema_utils import resolve_columns
+
+# Mock logs written by generate_large_test_data.py (both column naming variants)
+MOCK_CSVS = sorted(glob.glob("test_data_large/mock_audit_log_*.csv"))
+
+@pytest.mark.parametrize("path", MOCK_CSVS[:4])
+def test_rules_match_row_by_row_reference(path):
+    df = pd.read_csv(path)
+    cols = resolve_columns(df.columns)
+    assert {"timestamp", "user", "action", "equipment", "detail"} <= set(cols)
+
+    flags = prescreen(df).flags
+    ts = pd.to_datetime(df[cols["timestamp"]])
+    latest, non_chrono, off_hours = None, [], []
+    for t in ts:
+        non_chrono.append(latest is not None and t < latest)
+        latest = t if latest is None else max(latest, t)
+        off_hours.append(not (BUSINESS_HOURS[0] <= t.hour < BUSINESS_HOURS[1]) or t.dayofweek >= 5)
+    assert flags["non_chronological"].tolist() == non_chrono
+    assert flags["off_hours"].tolist() == off_hours
+    assert flags["data_deletion"].tolist() == (df[cols["action"]] == "Delete File").tolist()
+
+def _injected_log():
+    df = pd.read_csv(MOCK_CSVS[0]).head(40).copy()
+    cols = resolve_columns(df.columns)
+    ts, user, action, equip, detail = (cols[k] for k in ("timestamp", "user", "action", "equipment", "detail"))
+    df[ts] = pd.date_range("2026-01-05 08:00", periods=40, freq="min").strftime("%Y-%m-%dT%H:%M:%S")
+    df[action] = "Data Save"
+    df[equip] = "GC-05"
+    df[detail] = "Data Save executed on GC-05. Status: Fail. Msg: ok."
+    df.loc[3, user] = "Admin"
+    df.loc[[10, 11, 12], action] = "Abort"
+    df.loc[13, detail] = "Start Sequence executed on GC-05. Status: Success. Msg: rerun."
+    df.loc[20, action] = "Audit Trail Config: disabled"
+    df.loc[30, ts] = "2026-01-05T07:00:00"
+    return df
+
+def test_injected_violations_are_flagged():
+    df = _injected_log()
+    result = prescreen(df)
+    found = {rule: sorted(result.findings.loc[result.findings["rule"] == rule, "row"]) for rule in result.flags.columns}
+    assert found["generic_account"] == [3]
+    assert found["abort_then_pass"] == [13]
+    assert found["audit_trail_change"] == [20]
+    assert found["non_chronological"] == [30]
+    assert result.findings["severity"].iloc[0] == "Critical"
+
+    assert result.findings.loc[result.findings["rule"] == "abort_then_pass", "description"].item().startswith("3 aborted")
+
+    # Only flagged rows (±1) reach the model, plus whole-log statistics
+    windows = select_windows(result, radius=1)
+    assert {2, 3, 4, 12, 13, 14, 29, 30, 31} <= set(windows) and 0 not in windows
+    context = build_prescreen_context(result, df, token_budget=4000, radius=1)
+    assert "Rows scanned: 40" in context and "abort_then_pass" in context
+
+def test_appended_parts_screen_like_the_whole_log():
+    df = _injected_log()
+    whole = prescreen(df).findings[["row", "rule"]]
+    # Cuts inside the abort run and right before the out-of-order row
+    parts, carry = [], None
+    for lo, hi in [(0, 11), (11, 13), (13, 30), (30, 40)]:
+        result = prescreen(df.iloc[lo:hi], carry=carry)
+        parts.append(result.findings[["row", "rule"]].assign(row=lambda f: f["row"] + lo))
+        carry = result.carry
+    split = pd.concat(parts)
+    key = lambda f: sorted(map(tuple, f.to_numpy().tolist()))
+    assert key(split) == key(whole)
+    assert {"abort_then_pass", "non_chronological"} <= set(split["rule"])
+
+def test_carry_compares_parts_parsed_at_different_precisions():
+    # Whole seconds parse as microseconds and nanosecond stamps as nanoseconds
+    first = pd.DataFrame({"Timestamp": ["2026-01-02 10:00:00"], "User": ["qa1"], "Action": ["Login"]})
+    later = pd.DataFrame({"Timestamp": ["2026-01-02 09:00:00.123456789"], "User": ["qa1"], "Action": ["Login"]})
+    sentinel = first.assign(Timestamp="9999-12-31 00:00:00")
+    assert prescreen(sentinel).flags["non_chronological"].tolist() == [False]
+    carry = prescreen(first).carry
+    assert prescreen(later, carry=carry).flags["non_chronological"].tolist() == [True]
+    carry = prescreen(later).carry
+    assert prescreen(first, carry=carry).flags["non_chronological"].tolist() == [False]
+
+def test_text_log_is_parsed():
+    with open("test_data/raw_log.txt", encoding="utf-8") as f:
+        result = prescreen(f.read())
+    assert result.stats["rows"] > 0 and result.stats["first"] is not None
+    assert "timestamp" in result.columns
@@ -0,0 +1,36 @@
+import pandas as pd
+from profiler_utils import profile_dataframe, ROLE_ENUM, ROLE_TIMESTAMP, ROLE_IP, ROLE_EMAIL, ROLE_NAME, ROLE_TEXT
+
+def _mock_log(rows=250):
+    # Same schema as generate_large_test_data.py
+    return pd.DataFrame({
+        "Timestamp": [f"2025-03-{(i % 28) + 1:02d}T{i % 24:02d}:15:00" for i in range(rows)],
+        "User_ID": [f"operator{i}" for i in range(rows)],
+        "Full_Name": [f"Person Number{i}" for i in range(rows)],
+        "IP_Address": [f"10.0.{i // 250}.{i % 250}" for i in range(rows)],
+        "Equipment_ID": [["HPLC-01", "GC-05", "Balance-03"][i % 3] for i in range(rows)],
+        "Action_Type": [["Login", "Abort", "Delete File"][i % 3] for i in range(rows)],
+        "Department": [["QC Lab", "Production"][i % 2] for i in range(rows)],
+        "Detail": [f"Abort executed on HPLC-01. Status: Fail. Msg: sample sentence number {i}." for i in range(rows)],
+    })
+
+def test_profile_assigns_roles():
+    identity_probe = lambda vals: list(vals)
+    plan = profile_dataframe(_mock_log(), probe=identity_probe)
+
+    assert plan["Timestamp"] == ROLE_TIMESTAMP
+    assert plan["IP_Address"] == ROLE_IP
+    assert plan["Equipment_ID"] == ROLE_ENUM
+    assert plan["Action_Type"] == ROLE_ENUM
+    assert plan["Department"] == ROLE_ENUM
+    assert plan["User_ID"] == ROLE_NAME
+    assert plan["Full_Name"] == ROLE_NAME
+    assert plan["Detail"] == ROLE_TEXT
+
+def test_low_cardinality_with_pii_is_not_skipped():
+    df = pd.DataFrame({"Operator": ["Alice Smith", "Bob Jones"] * 50, "Mail": ["a.b@example.com"] * 100})
+    masking_probe = lambda vals: ["<PERSON>" if " " in v else v for v in vals]
+    plan = profile_dataframe(df, probe=masking_probe)
+
+    assert plan["Operator"] == ROLE_NAME
+    assert plan["Mail"] == ROLE_EMAIL
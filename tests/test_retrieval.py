@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from ai_utils import estimate_tokens
+from retrieval_utils import LogIndex, build_index
+
+def _log(rows=2000):
+    return pd.DataFrame({
+        "Timestamp": [f"2026-01-{1 + i // 480:02d}T{(i // 20) % 24:02d}:{(i * 3) % 60:02d}:00" for i in range(rows)],
+        "User_ID": [f"<PERSON>{i % 5}" if i % 7 else "labadmin" for i in range(rows)],
+        "Equipment_ID": [["HPLC-01", "HPLC-02", "GC-05"][i % 3] for i in range(rows)],
+        "Action_Type": [["Login", "Data Save", "Delete File", "Audit Trail Review"][(i // 3) % 4] for i in range(rows)],
+        "Detail": [f"Run {i} finished" + (" with checksum mismatch" if i % 97 == 0 else "") for i in range(rows)],
+    })
+
+def test_search_applies_fields_times_and_ranks_words():
+    df = _log()
+    index = build_index(df)
+
+    found = index.search("What did labadmin do on HPLC-02 after 22:00?")
+    expected = df.index[(df["User_ID"] == "labadmin") & (df["Equipment_ID"] == "HPLC-02")
+                        & (df["Timestamp"].str[11:16] > "22:00")]
+    assert sorted(found.rows) == list(expected)
+    assert found.matched == len(expected)
+    assert "user = labadmin" in found.filters and "equipment = HPLC-02" in found.filters
+
+    # Overnight window wraps around midnight; a date narrows it to one day
+    night = index.search("delete file between 22:00 and 02:00 on 2026-01-02")
+    hours = df.loc[night.rows, "Timestamp"].str[11:13].astype(int)
+    assert len(night.rows) and ((hours >= 22) | (hours <= 2)).all()
+    assert (df.loc[night.rows, "Timestamp"].str[:10] == "2026-01-02").all()
+    assert (df.loc[night.rows, "Action_Type"] == "Delete File").all()
+
+    # Without named fields, rows need a matching word and are ranked by BM25
+    mismatch = index.search("checksum mismatch", limit=5)
+    assert len(mismatch.rows) == 5 and all(i % 97 == 0 for i in mismatch.rows)
+    assert mismatch.matched == len(range(0, len(df), 97))
+    ranked = index.search("labadmin checksum", limit=3)
+    assert all(i % 97 == 0 and i % 7 == 0 for i in ranked.rows) # the named user filters, the word ranks
+
+def test_incremental_segments_match_single_build():
+    df = _log()
+    whole = build_index(df)
+    parts = LogIndex(segment_rows=300)
+    for lo in range(0, len(df), 700):
+        parts.add(df.iloc[lo:lo + 700])
+    assert parts.rows == len(df) and len(parts.segments) > 3
+
+    for question in ["labadmin GC-05 Login", "checksum mismatch before 06:00", "Audit Trail Review on 2026-01-03"]:
+        a, b = whole.search(question), parts.search(question)
+        assert a.matched == b.matched
+        assert list(a.rows) == list(b.rows)
+    pd.testing.assert_frame_equal(parts.take(np.array([5, 299, 300, 1999])), df.iloc[[5, 299, 300, 1999]].reset_index(drop=True))
+
+def test_context_fits_budget_with_row_numbers():
+    df = _log(20000)
+    index = build_index(df)
+    text, summary = index.context("labadmin Delete File on HPLC-01", token_budget=3000)
+    assert estimate_tokens(text) <= 3000
+    assert "_row" in text and "matching rows" in summary
+
+    # No row meets every condition: fall back to word matches
+    text, _ = index.context("labadmin on 2030-01-01", token_budget=3000)
+    assert "no row matches all of" in text and "labadmin" in text
+
+    lines = "\n".join(f"[2026-01-05 {h:02d}:15:00] INFO: User:{'admin' if h == 23 else 'qa1'} (10.0.0.{h}) exported batch {h}" for h in range(24))
+    found = build_index(lines).search("what did admin do after 22:00?")
+    assert list(found.rows) == [23]
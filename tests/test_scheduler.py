@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+import types
+from scheduler_utils import RateLimitScheduler, TokenBucket, retry_after_seconds
+
+class QuotaError(Exception):
+    """Mimics google.genai errors.ClientError for a 429 with Retry-After."""
+    def __init__(self, retry_after):
+        super().__init__("429 RESOURCE_EXHAUSTED")
+        self.code = 429
+        self.response = types.SimpleNamespace(headers={"retry-after": str(retry_after)})
+        self.details = None
+
+def test_token_bucket_delay():
+    bucket = TokenBucket(60) # 1 per second
+    for _ in range(60):
+        bucket.take(1)
+    assert 0.5 < bucket.delay_for(1) <= 1.0
+
+def test_round_robin_between_users():
+    scheduler = RateLimitScheduler(rpm=10_000, max_concurrency=1)
+    order = []
+    gate = threading.Event()
+
+    def job(user, i):
+        async def call():
+            if not gate.is_set():
+                await asyncio.get_running_loop().run_in_executor(None, gate.wait)
+            order.append(user)
+            return i
+        return call
+
+    # User A floods the queue first; B and C must not wait behind all of A's requests
+    futures = [scheduler.submit(job("A", i), user="A") for i in range(6)]
+    futures += [scheduler.submit(job(u, 0), user=u) for u in ("B", "C")]
+    time.sleep(0.1)
+    gate.set()
+    for f in futures:
+        f.result(timeout=5)
+    assert set(order[:4]) == {"A", "B", "C"}
+    assert scheduler.stats()["completed"] == 8
+
+def test_retry_after_is_honoured():
+    scheduler = RateLimitScheduler(rpm=10_000, max_concurrency=2)
+    attempts = []
+
+    async def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise QuotaError(0.3)
+        return "ok"
+
+    assert scheduler.submit(flaky).result(timeout=5) == "ok"
+    assert attempts[1] - attempts[0] >= 0.3
+    assert scheduler.stats()["rate_limited"] == 1
+    assert retry_after_seconds(QuotaError(2)) == 2.0
+
+def test_ai_engine_against_fake_server(monkeypatch):
+    from fake_gemini_server import start_server
+    from ai_utils import AIEngine
+
+    server, state, url = start_server(rpm=2, window=0.5, latency=0.0, reply="FAKE REPORT")
+    try:
+        monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+        monkeypatch.setenv("GEMINI_BASE_URL", url)
+        # Allow more than the server does, so the scheduler has to back off on 429
+        monkeypatch.setattr(RateLimitScheduler, "_instance", RateLimitScheduler(rpm=10_000, max_concurrency=4))
+        engine = AIEngine(user_id="tester")
+        engine.cache = None
+
+        futures = [engine.submit_generate("prompt", f"context {i}") for i in range(5)]
+        assert [f.result(timeout=30).text for f in futures] == ["FAKE REPORT"] * 5
+        assert state.rejected > 0
+        assert "".join(engine.stream_generate("prompt", "context")) == "FAKE REPORT"
+    finally:
+        server.shutdown()
+
+def test_analysis_stream_cancels_mid_answer(monkeypatch, tmp_path):
+    from fake_gemini_server import start_server
+    from ai_utils import AIEngine
+    from cache_utils import ResponseCache
+
+    reply = "".join(f"finding {i:02d}. " for i in range(40))
+    # 40 chunks over 4 seconds: a cancelled stream must end long before the answer would
+    server, state, url = start_server(rpm=0, latency=4.0, stream_chunks=40, reply=reply)
+    try:
+        monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+        monkeypatch.setenv("GEMINI_BASE_URL", url)
+        scheduler = RateLimitScheduler(rpm=10_000, max_concurrency=4)
+        monkeypatch.setattr(RateLimitScheduler, "_instance", scheduler)
+        engine = AIEngine(user_id="tester")
+        engine.cache = ResponseCache(cache_dir=str(tmp_path))
+
+        cancel = threading.Event()
+        parts = []
+        for text in engine.analyze_log_stream("masked log", cancel_event=cancel):
+            parts.append(text)
+            if len(parts) == 2:
+                cancel.set()
+                cancelled_at = time.perf_counter()
+        assert time.perf_counter() - cancelled_at < 1.0
+        assert len(parts) <= 3 and reply.startswith("".join(parts))
+        stats = engine.last_stream
+        assert stats["cancelled"] and 0 < stats["ttft"] < stats["seconds"] < 2.0
+        deadline = time.monotonic() + 5
+        while state.cancelled == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert state.cancelled == 1 and state.completed == 0
+        assert scheduler.stats()["cancelled"] == 1
+
+        # Partial answers are not cached; a complete one is, and is then replayed in one piece
+        monkeypatch.setattr(state, "latency", 0.2)
+        assert "".join(engine.analyze_log_stream("masked log")) == reply
+        assert not engine.last_cache_hit and not engine.last_stream["cancelled"]
+        assert list(engine.analyze_log_stream("masked log")) == [reply]
+        assert engine.last_cache_hit
+    finally:
+        server.shutdown()
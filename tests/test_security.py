@@ -1,6 +1,7 @@
 import pytest
+import numpy as np
 import pandas as pd
-from security_utils import SecurityEngine
+from security_utils import SecurityEngine, PII_ENTITIES, DEFAULT_SPACY_MODEL, _build_analyzer
 
 @pytest.fixture(scope="module")
 def security_engine():
@@ -40,3 +41,92 @@ def test_anonymize_dataframe(security_engine):
     # Note: Presidio might flag common words if they look like names, but "Login" should stand unless context implies otherwise.
     # Actually, "Login" is usually safe.
     assert masked_df["Action"].iloc[0] == "Login"
+
+def test_anonymize_dataframe_batched_matches_per_value(security_engine):
+    data = {
+        "User": ["Alice Smith", "Bob Jones", "Alice Smith", None],
+        "Detail": ["Login by Carol White from 10.0.0.9", "Data Save", "Abort", "Mail bob@example.com"],
+    }
+    df = pd.DataFrame(data)
+
+    per_value = security_engine.anonymize_dataframe(df)
+    batched = security_engine.anonymize_dataframe(df, batch_size=2, n_process=1)
+
+    pd.testing.assert_frame_equal(per_value, batched)
+
+def test_anonymize_dataframe_process_pool_matches_single_process(security_engine, monkeypatch):
+    import security_utils
+    pools = []
+    class SpyPool(security_utils.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(kwargs.get("max_workers"))
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(security_utils, "ProcessPoolExecutor", SpyPool)
+    monkeypatch.setattr(security_engine, "cache", None) # every value goes through NER
+
+    names = ["Alice Smith", "Bob Jones", "Carol White", "Dan Brown", "Eve Adams"]
+    df = pd.DataFrame({
+        "Detail": [f"Login by {names[i % 5]} from 10.0.{i // 250}.{i % 250} (event {i})" for i in range(300)],
+        "Action": ["Login", "Logout", "Data Save"] * 100,
+    })
+    single = security_engine.anonymize_dataframe(df, batch_size=16, n_process=1)
+    assert pools == []
+    pooled = security_engine.anonymize_dataframe(df, batch_size=16, n_process=2)
+    assert pools == [2] # 300 unique details > 2 batches: the pool path ran
+    pd.testing.assert_frame_equal(pooled, single)
+
+def test_engine_loads_only_what_masking_needs(security_engine):
+    nlp = security_engine.analyzer.nlp_engine.nlp["en"]
+    assert not set(nlp.pipe_names) & {"parser", "tagger", "lemmatizer", "senter", "attribute_ruler"}
+    entities = {e for r in security_engine.analyzer.registry.recognizers for e in r.supported_entities}
+    assert {"PERSON", "PHONE_NUMBER", "EMAIL_ADDRESS", "IP_ADDRESS"} <= entities
+    assert len(security_engine.analyzer.registry.recognizers) == 4
+
+    # Context words still work without the lemmatizer
+    masked = security_engine.anonymize_text("Call phone number 212-555-0143 for John Smith.")
+    assert "<PHONE>" in masked and "<PERSON>" in masked
+
+def test_trimmed_pipeline_masks_like_full_pipeline(security_engine):
+    # The lowercase stand-in lemmas must give Presidio's context enhancer the same results
+    spacy = pytest.importorskip("spacy")
+    if not spacy.util.is_package(DEFAULT_SPACY_MODEL):
+        pytest.skip(f"{DEFAULT_SPACY_MODEL} not installed")
+    from presidio_analyzer import AnalyzerEngine
+    full = AnalyzerEngine(supported_languages=["en"]) # default: every component of en_core_web_lg
+    trimmed = _build_analyzer(DEFAULT_SPACY_MODEL)
+
+    def mask(analyzer, text):
+        return security_engine._apply_masks(text, analyzer.analyze(text=text, entities=PII_ENTITIES, language="en"))
+
+    with open("test_data/raw_log.txt", encoding="utf-8") as f:
+        text = f.read()
+    assert mask(trimmed, text) == mask(full, text)
+    lines = [line for line in text.splitlines() if line.strip()]
+    assert [mask(trimmed, line) for line in lines] == [mask(full, line) for line in lines]
+
+def test_anonymize_dataframe_masks_categorical_columns(security_engine):
+    df = pd.DataFrame({"User": pd.Categorical(["Alice Smith", "Bob Jones", "Alice Smith"]),
+                       "IP": pd.Categorical(["10.0.0.1", "10.0.0.2", "10.0.0.1"])})
+    masked = security_engine.anonymize_dataframe(df, batch_size=2)
+    assert (masked["User"] == "<PERSON>").all()
+    assert (masked["IP"] == "<IP_ADDRESS>").all()
+
+def test_lean_anonymize_matches_and_shares_untouched_columns(security_engine):
+    df = pd.DataFrame({
+        "Timestamp": [f"2026-01-02 10:{i % 60:02d}:00" for i in range(40)],
+        "User": ["Alice Smith", "Bob Jones", None, "Alice Smith"] * 10,
+        "IP": pd.Categorical(["10.0.0.1", "10.0.0.2", "10.0.0.1", "10.0.0.3"] * 10),
+        "Action": ["Login", "Logout"] * 20,
+        "Count": range(40),
+    })
+    plan = {"Timestamp": "timestamp", "User": "name", "IP": "ip", "Action": "enum"}
+    expected = security_engine.anonymize_dataframe(df, batch_size=8, plan=plan)
+    lean = security_engine.anonymize_dataframe(df, batch_size=8, plan=plan, lean=True)
+
+    pd.testing.assert_frame_equal(lean.astype(expected.dtypes.to_dict()), expected)
+    assert isinstance(lean["User"].dtype, pd.CategoricalDtype) and len(lean["User"].cat.categories) == 1
+    assert list(lean["IP"].cat.categories) == ["<IP_ADDRESS>"]
+    # Columns with nothing to mask are the input's own data, not copies
+    for masked in (expected, lean):
+        assert np.shares_memory(masked["Count"].to_numpy(), df["Count"].to_numpy())
+        assert masked["Timestamp"].dtype == df["Timestamp"].dtype
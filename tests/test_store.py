@@ -0,0 +1,65 @@
+import os
+import pandas as pd
+from store_utils import MaskedStore, store_version
+from schema_utils import context_columns
+
+def test_masked_store_round_trip(tmp_path):
+    store = MaskedStore(root=str(tmp_path))
+    df = pd.DataFrame({
+        "User": ["<PERSON>", "<PERSON>", "admin", None] * 50,
+        "Action": [f"Changed value {i}" for i in range(200)],
+        "Count": range(200),
+    })
+    version = store_version("v1", {"User": "person"})
+    assert store.load("abc123", version) is None
+
+    store.save("abc123", version, df, source="log.csv")
+    loaded = store.load("abc123", version)
+    assert list(loaded.columns) == list(df.columns)
+    assert loaded["User"].dtype == "category" # low-cardinality text is dictionary-encoded
+    assert loaded.astype(object).where(loaded.notna(), None).equals(df.astype(object).where(df.notna(), None))
+    assert MaskedStore.metadata(store.open("abc123", version))["source"] == "log.csv"
+
+    # Only the requested columns and rows are materialized
+    part = store.load("abc123", version, columns=["Action"], rows=[0, 199])
+    assert list(part.columns) == ["Action"] and part["Action"].tolist() == ["Changed value 0", "Changed value 199"]
+
+    # The app and batch CLI read back only the columns their context builders use
+    assert context_columns(["Lot", "User", "Action", "Count"]) == ["User", "Action"]
+    assert context_columns(["Line", "Template", "User", "IP"]) == ["Line", "Template", "User"]
+    assert context_columns(["a", "b"]) == ["a", "b"]
+    assert store.columns("abc123", version) == ["User", "Action", "Count"]
+    assert store.columns("missing", version) is None
+    # Lean runs (categorical output) are stored apart from full runs
+    assert store_version("v1", {"User": "person"}, lean=True) != version
+
+    text = "line <PERSON>\n\nlast line"
+    store.save("def456", store_version("v1", mode="text"), text)
+    assert store.load("def456", store_version("v1", mode="text")) == text
+
+def test_masked_store_invalidation_and_pruning(tmp_path):
+    store = MaskedStore(root=str(tmp_path))
+    df = pd.DataFrame({"a": [f"row {i}" for i in range(1000)]})
+    old = store_version("v1", {"a": "text"})
+    store.save("abc123", old, df)
+
+    # A different model, plan or masking mode is a different stored log
+    assert store_version("v2", {"a": "text"}) != old
+    assert store_version("v1", {"a": "skip"}) != old
+    assert store_version("v1", {"a": "text"}, mode="lines") != old
+    assert store.load("abc123", store_version("v2", {"a": "text"})) is None
+    assert store.evict("abc123") == 1 and store.load("abc123", old) is None
+
+    # Unreadable files are dropped, not raised
+    store.save("abc123", old, df)
+    with open(store.path("abc123", old), "wb") as f:
+        f.write(b"not arrow")
+    assert store.load("abc123", old) is None and not store.exists("abc123", old)
+
+    # Least recently used files go first once over the size limit
+    for i, name in enumerate(["aa1", "bb2", "cc3"]):
+        path = store.save(name, old, df)
+        os.utime(path, (i, i))
+    store.max_bytes = sum(os.path.getsize(store.path(name, old)) for name in ["bb2", "cc3"])
+    store.prune()
+    assert not store.exists("aa1", old) and store.exists("bb2", old) and store.exists("cc3", old)
@@ -0,0 +1,111 @@
+import types
+import pandas as pd
+import pytest
+from security_utils import SecurityEngine
+from ai_utils import AIEngine
+from prescreen_utils import prescreen
+from tail_utils import TailAuditor
+
+MOCK_CSV = "test_data_large/mock_audit_log_03_Warehouse.csv"
+MOCK_TXT = "test_data_large/mock_audit_log_06_Warehouse.txt"
+
+@pytest.fixture(scope="module")
+def security_engine():
+    return SecurityEngine()
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    calls = []
+    def generate(self, prompt, context):
+        calls.append((prompt, context))
+        return types.SimpleNamespace(text=f"#### 1. Compliance Summary\n- Review {len(calls)}")
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(AIEngine, "_response_cache_ready", True)
+    monkeypatch.setattr(AIEngine, "_response_cache", None)
+    monkeypatch.setattr(AIEngine, "_generate_content_with_retry", generate)
+    return calls
+
+def _grow(path, data: bytes, cuts):
+    """Appends data to path in pieces, yielding after each (cuts may fall mid-line)."""
+    done = 0
+    for cut in cuts:
+        with open(path, "ab") as f:
+            f.write(data[done:cut])
+        done = cut
+        yield
+
+@pytest.mark.parametrize("source", [MOCK_CSV, MOCK_TXT])
+def test_cycles_ingest_only_appended_rows(security_engine, tmp_path, source):
+    data = open(source, "rb").read()
+    log = tmp_path / f"live.{source.rsplit('.', 1)[-1]}"
+    auditor = TailAuditor(str(log), state_dir=str(tmp_path / "state"), engine=security_engine)
+    cycles = []
+    for _ in _grow(log, data, [len(data) // 3, len(data) // 3 + 7, 2 * len(data) // 3, len(data)]):
+        with open(log, "rb") as f:
+            cycles.append(auditor.cycle(f))
+    assert cycles[1].new_rows == 0 # a half-written line waits
+    assert not any(c.reset for c in cycles)
+
+    if source.endswith(".csv"):
+        expected = pd.read_csv(source)
+        assert len(pd.read_csv(auditor.masked_path)) == len(expected)
+    else:
+        expected = data.decode("utf-8").splitlines()
+        assert open(auditor.masked_path, encoding="utf-8").read().count("\n") == len(expected)
+        expected = "\n".join(expected)
+    assert sum(c.new_rows for c in cycles) == cycles[-1].rows == auditor.stats()["rows"]
+    # Row-local rules give the same findings as screening the whole file at once
+    whole = prescreen(expected).findings
+    for rule in ("data_deletion", "off_hours", "generic_account"):
+        assert sorted(auditor.findings().query("rule == @rule")["row"]) == sorted(whole.query("rule == @rule")["row"])
+
+    # A fresh process resumes from the watermark; a rewritten file starts over
+    resumed = TailAuditor(str(log), state_dir=str(tmp_path / "state"), engine=security_engine)
+    with open(log, "rb") as f:
+        assert resumed.cycle(f).new_rows == 0
+    log.write_bytes(data[: len(data) // 2].replace(b"2026", b"2027", 1) + data[len(data) // 2:])
+    with open(log, "rb") as f:
+        cycle = resumed.cycle(f)
+    assert cycle.reset and cycle.rows == auditor.stats()["rows"]
+
+def test_ai_update_sends_only_new_rows(security_engine, fake_gemini, tmp_path):
+    data = open(MOCK_CSV, "rb").read()
+    lines = data.splitlines(keepends=True)
+    log = tmp_path / "live.csv"
+    auditor = TailAuditor(str(log), state_dir=str(tmp_path / "state"), engine=security_engine)
+    engine = AIEngine(user_id="tail")
+
+    for _ in _grow(log, data, [len(b"".join(lines[:201]))]):
+        with open(log, "rb") as f:
+            auditor.cycle(f)
+    first = auditor.update_summary(engine)
+    assert first.endswith("Review 1") and auditor.pending_rows == 0
+    assert "rows 1 to 200" in fake_gemini[0][1]
+
+    with open(log, "ab") as f:
+        f.write(b"".join(lines[201:]))
+    with open(log, "rb") as f:
+        auditor.cycle(f)
+    assert auditor.pending_rows == len(lines) - 201
+    assert auditor.update_summary(engine).endswith("Review 2")
+    prompt, context = fake_gemini[1]
+    assert "Review 1" in prompt # the previous report is revised, not rebuilt
+    assert f"rows 201 to {len(lines) - 1}" in context and "Rows scanned: 250" in context
+    assert "\n200," not in context and "\n201," in context # only appended rows are sent
+    assert auditor.update_summary(engine) == auditor.report and len(fake_gemini) == 2
+
+def test_skipped_column_is_rechecked_when_pii_is_appended(security_engine, tmp_path):
+    log = tmp_path / "live.csv"
+    log.write_text("User,Note\n" + "".join(f"u{i % 3},ok\n" for i in range(10)))
+    auditor = TailAuditor(str(log), state_dir=str(tmp_path / "state"), engine=security_engine)
+    with open(log, "rb") as f:
+        auditor.cycle(f)
+    assert auditor.state["plan"]["Note"] == "enum"
+
+    with open(log, "a") as f:
+        f.write("u1,mail john.smith@example.com\n")
+    with open(log, "rb") as f:
+        auditor.cycle(f)
+    assert auditor.state["plan"]["Note"] != "enum"
+    masked = pd.read_csv(auditor.masked_path)
+    assert masked["Note"].iloc[-1] == "mail <EMAIL>"
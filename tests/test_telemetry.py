@@ -0,0 +1,60 @@
+import json
+from telemetry_utils import Telemetry, span, _NOOP
+from scheduler_utils import RateLimitScheduler
+
+def test_disabled_is_noop(monkeypatch):
+    telemetry = Telemetry(enabled=False)
+    monkeypatch.setattr(Telemetry, "_instance", telemetry)
+    with span("parse", rows=10) as sp:
+        sp.set(bytes=5)
+    assert sp is _NOOP
+    assert telemetry.recent() == [] and telemetry.summary() == []
+
+def test_spans_nest_and_export(monkeypatch):
+    telemetry = Telemetry(enabled=True)
+    monkeypatch.setattr(Telemetry, "_instance", telemetry)
+    with span("anonymize.dataframe", rows=100):
+        for col in ["User", "Detail"]:
+            with span("anonymize.column", column=col, rows=100) as sp:
+                sp.set(unique=3)
+    try:
+        with span("cloud.upload", bytes=2048):
+            raise OSError("offline")
+    except OSError:
+        pass
+
+    spans = [json.loads(line) for line in telemetry.to_jsonl().splitlines()]
+    parent = next(s for s in spans if s["name"] == "anonymize.dataframe")
+    columns = [s for s in spans if s["name"] == "anonymize.column"]
+    assert [s["column"] for s in columns] == ["User", "Detail"]
+    assert all(s["parent_id"] == parent["span_id"] and s["unique"] == 3 for s in columns)
+    assert parent["seconds"] >= sum(s["seconds"] for s in columns)
+    assert spans[-1]["error"] == "OSError" and spans[-1]["peak_rss"] > 0
+
+    prom = telemetry.to_prometheus()
+    assert 'audit_span_count_total{span="anonymize.column"} 2' in prom
+    assert 'audit_span_rows_total{span="anonymize.column"} 200' in prom
+    assert 'audit_span_errors_total{span="cloud.upload"} 1' in prom
+    assert "# TYPE audit_span_seconds_total counter" in prom
+
+def test_llm_span_records_retries_and_tokens(monkeypatch):
+    from fake_gemini_server import start_server
+    from ai_utils import AIEngine
+
+    telemetry = Telemetry(enabled=True)
+    monkeypatch.setattr(Telemetry, "_instance", telemetry)
+    server, state, url = start_server(rpm=1, window=0.3, latency=0.0, reply="FAKE REPORT " * 10)
+    try:
+        monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+        monkeypatch.setenv("GEMINI_BASE_URL", url)
+        monkeypatch.setattr(RateLimitScheduler, "_instance", RateLimitScheduler(rpm=10_000, max_concurrency=1))
+        engine = AIEngine(user_id="tester")
+        for i in range(2):
+            engine._generate_content_with_retry("prompt", f"context {i}")
+    finally:
+        server.shutdown()
+
+    calls = [s for s in telemetry.recent() if s["name"] == "llm.generate"]
+    assert len(calls) == 2 and state.rejected >= 1
+    assert calls[0]["retries"] == 0 and calls[1]["retries"] >= 1
+    assert all(s["output_tokens"] == 30 and s["prompt_tokens"] > 0 for s in calls)
@@ -0,0 +1,67 @@
+import pandas as pd
+from generate_large_test_data import generate_chunks, write_txt
+from ingest_utils import load_upload
+from prescreen_utils import prescreen
+from profiler_utils import profile_dataframe, ROLE_TEXT
+from template_utils import TemplateMiner, mine_lines
+
+def test_templated_txt_becomes_structured_frame(tmp_path):
+    frame, violation = next(generate_chunks(5000, density=0.03, seed=11))
+    path = tmp_path / "log.txt"
+    write_txt(str(path), [(frame, violation)])
+
+    with open(path, "rb") as f:
+        mined, data_type = load_upload("log.txt", f)
+    assert data_type == "dataframe" and len(mined) == 5000
+    assert mined["Template"].nunique() == 1
+    assert {"Timestamp", "Severity", "User", "IP", "Action", "Equipment", "Details"} <= set(mined.columns)
+    assert mined["User"].tolist() == frame["User_ID"].tolist()
+    assert mined["IP"].tolist() == frame["IP_Address"].tolist()
+    # Memory follows the distinct values: slot columns are dictionary-encoded
+    assert isinstance(mined["Equipment"].dtype, pd.CategoricalDtype)
+
+    # The structured frame screens like the original table (no matches inside free text)
+    flags = prescreen(mined).flags
+    for rule in ["data_deletion", "audit_trail_change", "abort_then_pass", "generic_account", "off_hours"]:
+        assert (flags[rule].to_numpy() == (violation == rule)).all(), rule
+
+def test_shapes_merge_and_outliers_stay_out_of_templates():
+    lines = [f"2024-01-0{d} 10:0{i}:00 User {u} performed {a} on HPLC-0{i}"
+             for d in range(1, 4) for i, u in enumerate(["alice", "bob", "carol"])
+             for a in ["Login", "Audit Trail Review", "Delete File"]]
+    lines.insert(5, "")
+    lines.append("Unrelated free text mentioning John Smith once")
+    mined = mine_lines(lambda: iter(lines), min_coverage=0.5)
+
+    templates = mined["Template"].value_counts()
+    assert templates.index[0] == "<Timestamp> User <User> performed <Action> on <Equipment>"
+    assert templates.iloc[0] == 27
+    # One-off lines are kept whole in a Message field, never baked into a template
+    last = mined.iloc[-1]
+    assert last["Template"] == "<Message>" and "John Smith" in last["Message"]
+    assert not any("John" in t for t in templates.index)
+    # Blank lines are dropped; Line keeps the position in the file
+    assert len(mined) == len(lines) - 1 and mined["Line"].iloc[-1] == len(lines)
+
+def test_identifier_repeated_in_a_template_becomes_a_slot():
+    # Every line of each template comes from one user: the name must not be a template constant
+    lines = [f"[2024-01-0{d} 10:00:00] [Sev: HIGH] User:Alice Wong (10.0.0.{d}) performed Delete File on HPLC-01"
+             for d in range(1, 7)]
+    lines += [f"[2024-01-0{d} 11:00:00] [Sev: LOW] User:Bob Stone (10.0.1.{d}) performed Login on HPLC-02"
+              for d in range(1, 7)]
+    mined = mine_lines(lambda: iter(lines))
+    assert not any("Alice" in t or "Bob" in t for t in mined["Template"].cat.categories)
+    assert mined["User"].tolist() == ["Alice Wong"] * 6 + ["Bob Stone"] * 6
+
+    # Template and Message always get NER, however few distinct values they have
+    plan = profile_dataframe(mined, probe=lambda values: values)
+    assert plan["Template"] == ROLE_TEXT
+    assert profile_dataframe(mine_lines(lambda: iter(lines[:2] + lines[6:8]), min_coverage=0))["Message"] == ROLE_TEXT
+
+def test_free_text_log_is_left_as_text():
+    with open("test_data/raw_log.txt", "rb") as f:
+        data, data_type = load_upload("raw_log.txt", f)
+    assert data_type == "text" and isinstance(data, str)
+
+    miner = TemplateMiner()
+    assert miner.add("   ") == -1 and not miner.clusters